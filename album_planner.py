@@ -0,0 +1,84 @@
+"""
+相册分批模块 - 把媒体组拆成 Telegram 接受的 send_media_group 批次
+send_media_group 每次 2-10 个文件：照片和视频可以混合，文档只能和文档、音频只能和音频放在一起，
+动图、语音、圆形视频和贴纸不能放进相册（单独发送）。批次保持原有顺序，caption 放在第一个能带caption的批次；
+某一批失败时停止发送，caption 只会出现在实际发出的批次中
+"""
+
+from math import ceil
+from typing import List, Optional
+
+MAX_ALBUM_SIZE = 10  # Telegram 单个相册的文件数上限
+
+GROUP_VISUAL = 'visual'
+GROUP_DOCUMENT = 'document'
+GROUP_AUDIO = 'audio'
+
+# 媒体类型 -> 可以放在同一个相册中的类别（不在表中的类型不能放进相册）
+ALBUM_GROUPS = {
+    'photo': GROUP_VISUAL,
+    'video': GROUP_VISUAL,
+    'document': GROUP_DOCUMENT,
+    'audio': GROUP_AUDIO,
+}
+
+CAPTIONLESS_TYPES = ('video_note', 'sticker')  # 不能带caption的类型
+
+BATCH_RETRIES = 1  # 单个批次失败后的重试次数
+BATCH_RETRY_DELAY = 5  # 重试前等待的秒数
+
+
+class AlbumBatch:
+    """一次发送：2个以上同类别文件用 send_media_group，单个文件单独发送"""
+
+    __slots__ = ('group', 'files', 'with_caption')
+
+    def __init__(self, group: Optional[str], files: List[dict]):
+        self.group = group  # 相册类别，不能放进相册的文件为 None
+        self.files = files
+        self.with_caption = False
+
+    @property
+    def is_album(self) -> bool:
+        return len(self.files) > 1
+
+    def describe(self) -> str:
+        types = sorted({file_info['type'] for file_info in self.files})
+        return f"{len(self.files)}个{'/'.join(types)}"
+
+
+class AlbumSendError(Exception):
+    """媒体组某一批重试后仍发送失败：之后的批次不再发送，已发布的批次不会撤回"""
+
+    def __init__(self, message: str, sent_messages: list, sent_files: List[dict], unsent_files: List[dict]):
+        super().__init__(message)
+        self.sent_messages = sent_messages  # 失败前已发布的消息
+        self.sent_files = sent_files  # 已发布的文件（可以清理）
+        self.unsent_files = unsent_files  # 失败批次及之后没有发出的文件（需要保留）
+
+
+def plan_album(file_infos: List[dict], max_size: int = MAX_ALBUM_SIZE) -> List[AlbumBatch]:
+    """按原有顺序把连续的同类别文件分成不超过 max_size 的批次（超过上限的连续文件平均拆分，避免最后剩下单个文件）"""
+    runs: List[AlbumBatch] = []
+    for file_info in file_infos:
+        group = ALBUM_GROUPS.get(file_info['type'])
+        if group is not None and runs and runs[-1].group == group:
+            runs[-1].files.append(file_info)
+        else:
+            runs.append(AlbumBatch(group, [file_info]))
+
+    batches: List[AlbumBatch] = []
+    for run in runs:
+        count = ceil(len(run.files) / max_size)
+        size, extra = divmod(len(run.files), count)
+        start = 0
+        for index in range(count):
+            end = start + size + (1 if index < extra else 0)
+            batches.append(AlbumBatch(run.group, run.files[start:end]))
+            start = end
+
+    for batch in batches:
+        if batch.files[0]['type'] not in CAPTIONLESS_TYPES:
+            batch.with_caption = True
+            break
+    return batches
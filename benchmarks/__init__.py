@@ -0,0 +1,3 @@
+"""
+端到端压测工具（假 Bot API 服务器 + 场景驱动）
+"""
@@ -0,0 +1,299 @@
+"""
+本地假 Bot API 服务器 - 用于端到端吞吐量压测
+支持 getUpdates 长轮询、getFile、文件下载以及 send* 上传接口，可配置请求延迟和带宽
+可注入停滞故障：接下来的N个上传/下载传输一部分数据后不再继续（测试停滞检测）
+"""
+
+import argparse
+import asyncio
+import json
+import re
+import time
+from collections import Counter
+from typing import Dict, List, Optional
+
+from aiohttp import web
+
+# 每条被压测的消息在文本/caption中携带标记，用于匹配入队和发布时间
+MARKER_PATTERN = re.compile(rb'BENCH#(\d+)#')
+CHAT_ID_PATTERN = re.compile(rb'name="chat_id"\r\n\r\n([^\r]+)\r\n')
+MEDIA_FIELD_PATTERN = re.compile(rb'name="media"\r\n\r\n(.*?)\r\n--', re.DOTALL)
+
+HEAD_LIMIT = 256 * 1024  # 上传请求只保留前256KB用于解析文本字段
+CHUNK_SIZE = 64 * 1024
+STALL_AFTER = 1024 * 1024  # 注入停滞故障时，传输这么多字节后停止
+
+
+def _album_error(media: List[dict]) -> Optional[str]:
+    """与 Telegram 相同的相册限制：2-10个文件，文档和音频只能与同类型放在一起"""
+    if not 2 <= len(media) <= 10:
+        return "Bad Request: wrong number of messages to send as an album"
+    types = {item.get('type') for item in media}
+    if len(types) > 1 and types & {'document', 'audio'}:
+        return "Bad Request: document/audio can't be mixed with other media types"
+    if types - {'photo', 'video', 'document', 'audio'}:
+        return "Bad Request: unsupported media type in album"
+    return None
+
+
+class FakeBotAPI:
+    """假 Bot API 服务器状态"""
+
+    def __init__(self, latency: float = 0.0, download_bandwidth: float = 0.0, upload_bandwidth: float = 0.0):
+        self.latency = latency                        # 秒 - 每个API请求的额外延迟
+        self.download_bandwidth = download_bandwidth  # 字节/秒 - 0表示不限速
+        self.upload_bandwidth = upload_bandwidth      # 字节/秒 - 0表示不限速
+        self.reset()
+
+    def reset(self):
+        self.updates: List[dict] = []
+        self.next_update_id = 1
+        self.next_message_id = 1
+        self.files: Dict[str, int] = {}  # {file_id: file_size}
+        self.enqueued: Dict[str, float] = {}
+        self.published: Dict[str, float] = {}
+        self.bytes_downloaded = 0
+        self.bytes_uploaded = 0
+        self.requests = Counter()
+        self.faults = Counter()  # {'stall_uploads': N, 'stall_downloads': N, 'stall_responses': N, 'fail_albums': N}
+        self.new_updates = asyncio.Event()
+
+    # ---- 控制接口（压测驱动程序使用） ----
+
+    async def control_enqueue(self, request: web.Request) -> web.Response:
+        payload = await request.json()
+        now = time.monotonic()
+        self.files.update(payload.get('files', {}))
+        for marker in payload.get('markers', []):
+            self.enqueued[str(marker)] = now
+        for update in payload.get('updates', []):
+            update['update_id'] = self.next_update_id
+            self.next_update_id += 1
+            self.updates.append(update)
+        self.new_updates.set()
+        return web.json_response({'ok': True, 'queued': len(self.updates)})
+
+    async def control_results(self, request: web.Request) -> web.Response:
+        return web.json_response({
+            'enqueued': self.enqueued,
+            'published': self.published,
+            'bytes_downloaded': self.bytes_downloaded,
+            'bytes_uploaded': self.bytes_uploaded,
+            'requests': dict(self.requests),
+        })
+
+    async def control_faults(self, request: web.Request) -> web.Response:
+        self.faults.update(await request.json())
+        return web.json_response({'ok': True, 'faults': dict(self.faults)})
+
+    def _take_fault(self, name: str) -> bool:
+        if self.faults[name] > 0:
+            self.faults[name] -= 1
+            return True
+        return False
+
+    async def _stall(self):
+        """模拟停滞的连接：不再收发数据，直到客户端断开"""
+        self.requests['stalled'] += 1
+        await asyncio.sleep(3600)
+
+    async def control_reset(self, request: web.Request) -> web.Response:
+        self.reset()
+        return web.json_response({'ok': True})
+
+    # ---- Bot API ----
+
+    def _message(self, chat_id, **fields) -> dict:
+        message_id = self.next_message_id
+        self.next_message_id += 1
+        try:
+            chat_id = int(chat_id)
+        except (TypeError, ValueError):
+            chat_id = -1000000000000
+        return {
+            'message_id': message_id,
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'channel', 'title': 'bench target'},
+            **fields
+        }
+
+    def _chat(self, chat_id) -> dict:
+        """压测频道: @bench_src_N <-> -1001000000000-N，其他数字ID原样返回"""
+        chat_id = str(chat_id)
+        match = re.fullmatch(r'@bench_src_(\d+)', chat_id)
+        if match:
+            index = int(match.group(1))
+        elif chat_id.lstrip('-').isdigit() and -1001000000000 - 10000 < int(chat_id) <= -1001000000000:
+            index = -1001000000000 - int(chat_id)
+        else:
+            numeric = int(chat_id) if chat_id.lstrip('-').isdigit() else -1000000000000
+            return {'id': numeric, 'type': 'channel', 'title': 'bench'}
+        return {'id': -1001000000000 - index, 'type': 'channel', 'title': f'bench source {index}', 'username': f'bench_src_{index}'}
+
+    def _mark_published(self, data: bytes):
+        now = time.monotonic()
+        for match in MARKER_PATTERN.finditer(data):
+            self.published.setdefault(match.group(1).decode(), now)
+
+    async def _read_params(self, request: web.Request) -> dict:
+        if request.content_type == 'application/json':
+            return await request.json()
+        if request.method == 'POST':
+            return dict(await request.post())
+        return dict(request.query)
+
+    async def _consume_upload(self, request: web.Request) -> bytes:
+        """流式读取上传请求体（按带宽限速），只保留开头部分用于解析"""
+        head = bytearray()
+        stall = self._take_fault('stall_uploads')
+        received = 0
+        async for chunk in request.content.iter_chunked(CHUNK_SIZE):
+            received += len(chunk)
+            if stall and received > STALL_AFTER:
+                await self._stall()
+            self.bytes_uploaded += len(chunk)
+            if len(head) < HEAD_LIMIT:
+                head.extend(chunk[:HEAD_LIMIT - len(head)])
+            if self.upload_bandwidth > 0:
+                await asyncio.sleep(len(chunk) / self.upload_bandwidth)
+        return bytes(head)
+
+    async def handle_api(self, request: web.Request) -> web.Response:
+        method = request.match_info['method']
+        self.requests[method] += 1
+        if self.latency > 0:
+            await asyncio.sleep(self.latency)
+
+        if request.content_type.startswith('multipart/'):
+            head = await self._consume_upload(request)
+            if self._take_fault('stall_responses'):
+                # 已收到并"发布"了整个上传，但不返回响应（客户端重发会造成重复发布）
+                self._mark_published(head)
+                self.requests['published_unanswered'] += 1
+                await self._stall()
+            match = CHAT_ID_PATTERN.search(head)
+            chat_id = match.group(1).decode() if match else None
+            if method == 'sendMediaGroup':
+                media_match = MEDIA_FIELD_PATTERN.search(head)
+                media = json.loads(media_match.group(1)) if media_match else []
+                error = _album_error(media) if media_match else None
+                if not error and self._take_fault('fail_albums'):
+                    self.requests['failed_albums'] += 1
+                    return web.json_response({'ok': False, 'error_code': 500, 'description': 'Internal Server Error'}, status=500)
+                if error:
+                    self.requests['rejected_albums'] += 1
+                    return web.json_response({'ok': False, 'error_code': 400, 'description': error}, status=400)
+                self._mark_published(head)
+                return web.json_response({'ok': True, 'result': [self._message(chat_id) for _ in media or [None]]})
+            self._mark_published(head)
+            return web.json_response({'ok': True, 'result': self._message(chat_id)})
+
+        params = await self._read_params(request)
+
+        if method == 'getMe':
+            return web.json_response({'ok': True, 'result': {
+                'id': 1, 'is_bot': True, 'first_name': 'BenchBot', 'username': 'bench_bot'
+            }})
+        if method in ('deleteWebhook', 'setWebhook', 'setMyCommands'):
+            return web.json_response({'ok': True, 'result': True})
+        if method == 'getUpdates':
+            return web.json_response({'ok': True, 'result': await self._get_updates(params)})
+        if method == 'getFile':
+            file_id = params.get('file_id')
+            if file_id not in self.files:
+                return web.json_response({'ok': False, 'error_code': 400, 'description': 'Bad Request: invalid file_id'}, status=400)
+            return web.json_response({'ok': True, 'result': {
+                'file_id': file_id, 'file_unique_id': f"u{file_id}",
+                'file_size': self.files[file_id], 'file_path': f"files/{file_id}"
+            }})
+        if method.startswith('send') or method.startswith('edit'):
+            if method == 'sendMediaGroup':
+                media = json.loads(params.get('media', '[]'))
+                error = _album_error(media)
+                if error:
+                    self.requests['rejected_albums'] += 1
+                    return web.json_response({'ok': False, 'error_code': 400, 'description': error}, status=400)
+                self._mark_published(json.dumps(params).encode())
+                return web.json_response({'ok': True, 'result': [self._message(params.get('chat_id')) for _ in media]})
+            self._mark_published(json.dumps(params).encode())
+            return web.json_response({'ok': True, 'result': self._message(params.get('chat_id'), text=params.get('text'))})
+        if method == 'getChat':
+            return web.json_response({'ok': True, 'result': self._chat(params.get('chat_id'))})
+        if method == 'getChatMemberCount':
+            return web.json_response({'ok': True, 'result': 1000})
+        if method == 'getChatMember':
+            return web.json_response({'ok': True, 'result': {
+                'status': 'administrator', 'user': {'id': 1, 'is_bot': True, 'first_name': 'BenchBot'},
+                'can_be_edited': False, 'is_anonymous': False, 'can_manage_chat': True, 'can_delete_messages': True,
+                'can_manage_video_chats': False, 'can_restrict_members': False, 'can_promote_members': False,
+                'can_change_info': False, 'can_invite_users': False, 'can_post_messages': True, 'can_edit_messages': True,
+            }})
+
+        return web.json_response({'ok': True, 'result': True})
+
+    async def _get_updates(self, params: dict) -> List[dict]:
+        offset = int(params.get('offset') or 0)
+        timeout = float(params.get('timeout') or 0)
+        limit = int(params.get('limit') or 100)
+
+        # 丢弃已确认的更新
+        self.updates = [u for u in self.updates if u['update_id'] >= offset]
+        if not self.updates and timeout > 0:
+            self.new_updates.clear()
+            try:
+                await asyncio.wait_for(self.new_updates.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return self.updates[:limit]
+
+    async def handle_file(self, request: web.Request) -> web.StreamResponse:
+        file_id = request.match_info['path'].rsplit('/', 1)[-1]
+        size = self.files.get(file_id)
+        if size is None:
+            raise web.HTTPNotFound()
+        if self.latency > 0:
+            await asyncio.sleep(self.latency)
+
+        response = web.StreamResponse(headers={'Content-Length': str(size)})
+        await response.prepare(request)
+        chunk = b'\0' * CHUNK_SIZE
+        remaining = size
+        stall = self._take_fault('stall_downloads')
+        while remaining > 0:
+            if stall and size - remaining >= STALL_AFTER:
+                await self._stall()
+            part = chunk[:min(CHUNK_SIZE, remaining)]
+            await response.write(part)
+            remaining -= len(part)
+            self.bytes_downloaded += len(part)
+            if self.download_bandwidth > 0:
+                await asyncio.sleep(len(part) / self.download_bandwidth)
+        await response.write_eof()
+        return response
+
+    def build_app(self) -> web.Application:
+        app = web.Application(client_max_size=0)
+        app.router.add_post('/_control/enqueue', self.control_enqueue)
+        app.router.add_get('/_control/results', self.control_results)
+        app.router.add_post('/_control/reset', self.control_reset)
+        app.router.add_post('/_control/faults', self.control_faults)
+        app.router.add_route('*', '/file/bot{token}/{path:.*}', self.handle_file)
+        app.router.add_route('*', '/bot{token}/{method}', self.handle_api)
+        return app
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="本地假 Bot API 服务器")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--latency', type=float, default=0.0, help="每个请求的延迟（秒）")
+    parser.add_argument('--download-bandwidth', type=float, default=0.0, help="下载带宽（字节/秒，0为不限速）")
+    parser.add_argument('--upload-bandwidth', type=float, default=0.0, help="上传带宽（字节/秒，0为不限速）")
+    args = parser.parse_args(argv)
+
+    server = FakeBotAPI(args.latency, args.download_bandwidth, args.upload_bandwidth)
+    web.run_app(server.build_app(), host=args.host, port=args.port, print=None)
+
+
+if __name__ == "__main__":
+    main()
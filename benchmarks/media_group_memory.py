@@ -0,0 +1,113 @@
+"""
+媒体组内存压测 - 对比同时收集数千个相册时两种表示的内存占用
+
+用法（在仓库根目录）:
+    python -m benchmarks.media_group_memory                  # 默认 2000 个相册，每个 10 张图片
+    python -m benchmarks.media_group_memory --albums 20000 --items 10
+
+legacy: 旧实现，每个媒体组保存完整的 PTB Message 对象列表和临时字典
+record: MediaGroup / AlbumItem（__slots__，只保存 ID、file_id、大小、类型、caption）
+使用 tracemalloc 统计收集完成后仍然存活的内存，结果以JSON输出。
+"""
+
+import argparse
+import gc
+import json
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Optional, List
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_ROOT))
+
+from telegram import Bot, Message  # noqa: E402
+
+from media_group import MediaGroup  # noqa: E402
+from media_downloader import MediaDownloader  # noqa: E402
+
+
+def _album_message(bot: Bot, album: int, item: int, message_id: int) -> Message:
+    data = {
+        'message_id': message_id,
+        'date': int(time.time()),
+        'chat': {'id': -1001000000000, 'type': 'channel', 'title': 'bench source', 'username': 'bench_src'},
+        'media_group_id': f"G{album}",
+        'photo': [
+            {'file_id': f"F{message_id}_{size}", 'file_unique_id': f"U{message_id}_{size}",
+             'width': width, 'height': width * 3 // 4, 'file_size': width * 150}
+            for size, width in enumerate((90, 320, 800, 1280))
+        ],
+    }
+    if item == 0:
+        data['caption'] = f"album {album} caption with a link https://example.com/{album}"
+        data['caption_entities'] = [{'type': 'url', 'offset': 27, 'length': 20 + len(str(album))}]
+    return Message.de_json(data, bot)
+
+
+def _build_legacy(bot: Bot, albums: int, items: int) -> dict:
+    groups = {}
+    message_id = 1
+    for album in range(albums):
+        group = {
+            'messages': [], 'timer': None, 'last_message_time': 0.0, 'start_time': 0.0,
+            'status': 'collecting', 'download_start_time': None, 'channel_mapping': None, 'publish_ticket': None,
+        }
+        for item in range(items):
+            group['messages'].append(_album_message(bot, album, item, message_id))
+            message_id += 1
+        groups[f"G{album}"] = group
+    return groups
+
+
+def _build_records(bot: Bot, albums: int, items: int) -> dict:
+    get_media_info = MediaDownloader._get_all_media_info  # 不依赖实例状态，无需创建下载器
+    groups = {}
+    message_id = 1
+    for album in range(albums):
+        group = MediaGroup(-1001000000000, f"G{album}", None, 0.0)
+        for item in range(items):
+            message = _album_message(bot, album, item, message_id)
+            group.add(message, get_media_info(None, message), 0.0)
+            message_id += 1
+        groups[f"G{album}"] = group
+    return groups
+
+
+def _measure(builder, bot: Bot, albums: int, items: int) -> dict:
+    gc.collect()
+    tracemalloc.start()
+    started = time.perf_counter()
+    groups = builder(bot, albums, items)
+    elapsed = time.perf_counter() - started
+    gc.collect()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del groups
+    return {
+        'retained_mb': round(current / (1024 * 1024), 2),
+        'peak_mb': round(peak / (1024 * 1024), 2),
+        'bytes_per_album': current // albums,
+        'build_s': round(elapsed, 3),
+    }
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="媒体组内存压测")
+    parser.add_argument('--albums', type=int, default=2000)
+    parser.add_argument('--items', type=int, default=10)
+    args = parser.parse_args(argv)
+
+    bot = Bot('123456:BENCH')
+    report = {
+        'albums': args.albums,
+        'items_per_album': args.items,
+        'legacy': _measure(_build_legacy, bot, args.albums, args.items),
+        'record': _measure(_build_records, bot, args.albums, args.items),
+    }
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
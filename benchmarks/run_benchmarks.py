@@ -0,0 +1,516 @@
+"""
+端到端吞吐量压测 - 驱动 CompleteTelegramMediaBot 对接本地假 Bot API 服务器
+
+用法（在仓库根目录）:
+    python -m benchmarks.run_benchmarks                      # 运行所有合成场景
+    python -m benchmarks.run_benchmarks --scenarios text_burst albums --output results.json
+    python -m benchmarks.run_benchmarks --scenarios replay --recording data/updates.jsonl.gz --speed 10
+
+replay 场景回放 UPDATE_RECORD_ENABLED 录制的真实更新流（按原始到达间隔，--speed 0 为最快速度）。
+
+每个场景在独立的子进程中运行机器人，以便分别统计峰值内存（RSS）。
+结果以JSON输出：吞吐量（消息/秒、MB/秒）、端到端延迟 p50/p99、峰值RSS。
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import resource
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from pathlib import Path
+from typing import Dict, List, Optional
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+BENCH_TOKEN = '123456:BENCH'
+SOURCE_CHAT_BASE_ID = -1001000000000
+TARGET_CHAT_BASE_ID = -1002000000000
+
+
+# ---- 场景构建 ----
+
+class ScenarioBuilder:
+    """构建压测场景的更新数据"""
+
+    def __init__(self):
+        self.updates: List[dict] = []
+        self.markers: List[str] = []
+        self.files: Dict[str, int] = {}
+        self.offsets: List[float] = []  # 录制更新相对开始时间的入队偏移（秒），为空表示一次性入队
+        self.update_markers: List[Optional[str]] = []  # 录制更新对应的标记
+        self.next_message_id = 1
+        self.next_file_id = 1
+
+    def _post(self, source_index: int, **fields) -> dict:
+        message_id = self.next_message_id
+        self.next_message_id += 1
+        return {'channel_post': {
+            'message_id': message_id,
+            'date': int(time.time()),
+            'chat': {'id': SOURCE_CHAT_BASE_ID - source_index, 'type': 'channel',
+                     'title': f'bench source {source_index}', 'username': f'bench_src_{source_index}'},
+            **fields
+        }}
+
+    def _file(self, size: int) -> str:
+        file_id = f"F{self.next_file_id}"
+        self.next_file_id += 1
+        self.files[file_id] = size
+        return file_id
+
+    def _marker(self) -> str:
+        marker = str(len(self.markers) + 1)
+        self.markers.append(marker)
+        return f"BENCH#{marker}#"
+
+    def add_text(self, source_index: int = 0, text: str = 'bench text post'):
+        self.updates.append(self._post(source_index, text=f"{self._marker()} {text}"))
+
+    def _photo(self, size: int) -> list:
+        file_id = self._file(size)
+        return [{'file_id': file_id, 'file_unique_id': f"u{file_id}", 'width': 1280, 'height': 960, 'file_size': size}]
+
+    def add_photo(self, size: int, source_index: int = 0):
+        self.updates.append(self._post(source_index, photo=self._photo(size), caption=f"{self._marker()} photo"))
+
+    def add_voice(self, size: int, source_index: int = 0):
+        file_id = self._file(size)
+        self.updates.append(self._post(source_index, caption=f"{self._marker()} voice", voice={
+            'file_id': file_id, 'file_unique_id': f"u{file_id}", 'duration': 5, 'file_size': size, 'mime_type': 'audio/ogg'
+        }))
+
+    def add_video(self, size: int, source_index: int = 0):
+        file_id = self._file(size)
+        self.updates.append(self._post(source_index, caption=f"{self._marker()} video", video={
+            'file_id': file_id, 'file_unique_id': f"u{file_id}", 'width': 1920, 'height': 1080,
+            'duration': 60, 'file_size': size, 'file_name': f"{file_id}.mp4", 'mime_type': 'video/mp4'
+        }))
+
+    def add_album(self, items: int, size: int, source_index: int = 0, group_id: Optional[str] = None):
+        group_id = group_id or f"G{self.next_message_id}"
+        for i in range(items):
+            fields = {'photo': self._photo(size), 'media_group_id': group_id}
+            if i == 0:
+                fields['caption'] = f"{self._marker()} album"
+            self.updates.append(self._post(source_index, **fields))
+
+    def add_recorded(self, update: dict, offset: float, source_index: int, mark: bool):
+        """添加一条录制的更新：源频道改写为压测源频道，按需在文本/caption前插入标记"""
+        update = json.loads(json.dumps(update))
+        update.pop('update_id', None)
+        message = _recorded_message(update)
+        message['chat'] = {'id': SOURCE_CHAT_BASE_ID - source_index, 'type': 'channel',
+                           'title': f'bench source {source_index}', 'username': f'bench_src_{source_index}'}
+        _collect_files(message, self.files)
+
+        marker = None
+        if mark:
+            field, entities_field = ('text', 'entities') if 'text' in message else ('caption', 'caption_entities')
+            prefix = f"{self._marker()} "
+            marker = self.markers[-1]
+            message[field] = prefix + message.get(field, '')
+            for entity in message.get(entities_field, []):
+                entity['offset'] += len(prefix)
+
+        self.updates.append(update)
+        self.update_markers.append(marker)
+        self.offsets.append(offset)
+
+
+RECORDED_MESSAGE_KEYS = ('channel_post', 'message', 'edited_channel_post', 'edited_message')
+CAPTION_MEDIA_KEYS = ('photo', 'video', 'document', 'audio', 'animation', 'voice')
+
+
+def _recorded_message(update: dict) -> Optional[dict]:
+    for key in RECORDED_MESSAGE_KEYS:
+        if key in update:
+            return update[key]
+    return None
+
+
+def _collect_files(value, files: Dict[str, int]):
+    """收集消息中所有文件（含缩略图）的 file_id 和大小，供假服务器提供下载"""
+    if isinstance(value, dict):
+        if 'file_id' in value:
+            files[value['file_id']] = value.get('file_size') or 0
+        for item in value.values():
+            _collect_files(item, files)
+    elif isinstance(value, list):
+        for item in value:
+            _collect_files(item, files)
+
+
+def scenario_text_burst(builder: ScenarioBuilder, args) -> int:
+    for _ in range(args.text_count):
+        builder.add_text()
+    return 1
+
+
+def scenario_large_video(builder: ScenarioBuilder, args) -> int:
+    builder.add_video(int(args.video_size_mb * 1024 * 1024))
+    return 1
+
+
+def scenario_albums(builder: ScenarioBuilder, args) -> int:
+    for _ in range(args.album_count):
+        builder.add_album(10, int(args.photo_size_kb * 1024))
+    return 1
+
+
+def scenario_small_media(builder: ScenarioBuilder, args) -> int:
+    """大量单独的小图片和语音（对比 MEMORY_STAGING_ENABLED=true/false）"""
+    for i in range(args.small_media_count):
+        if i % 2:
+            builder.add_voice(int(args.photo_size_kb * 1024))
+        else:
+            builder.add_photo(int(args.photo_size_kb * 1024))
+    return 1
+
+
+def scenario_many_mappings(builder: ScenarioBuilder, args) -> int:
+    for source_index in range(args.mapping_count):
+        builder.add_text(source_index)
+        builder.add_photo(int(args.photo_size_kb * 1024), source_index)
+    return args.mapping_count
+
+
+def scenario_replay(builder: ScenarioBuilder, args) -> int:
+    """回放录制的更新流：保留原始到达间隔（除以 --speed），每个源频道映射到一个压测频道"""
+    from update_recorder import read_recording
+
+    if not args.recording:
+        raise ValueError("replay 场景需要 --recording 参数")
+
+    sources: Dict[str, int] = {}
+    marked_groups = set()
+    start_time = None
+    for arrival_time, update in read_recording(args.recording):
+        message = _recorded_message(update)
+        if message is None:
+            continue
+        if start_time is None:
+            start_time = arrival_time
+
+        chat = message.get('chat', {})
+        source_index = sources.setdefault(str(chat.get('id')), len(sources))
+
+        # 单条消息按内容打标记；媒体组只标记第一条（机器人以第一条的caption为准）
+        group_id = message.get('media_group_id')
+        if group_id:
+            mark = (source_index, group_id) not in marked_groups
+            marked_groups.add((source_index, group_id))
+        else:
+            mark = 'text' in message or any(key in message for key in CAPTION_MEDIA_KEYS)
+
+        offset = (arrival_time - start_time) / args.speed if args.speed > 0 else 0.0
+        builder.add_recorded(update, offset, source_index, mark)
+
+    return max(1, len(sources))
+
+
+SCENARIOS = {
+    'text_burst': scenario_text_burst,
+    'large_video': scenario_large_video,
+    'albums': scenario_albums,
+    'small_media': scenario_small_media,
+    'many_mappings': scenario_many_mappings,
+    'replay': scenario_replay,
+}
+SYNTHETIC_SCENARIOS = [name for name in SCENARIOS if name != 'replay']
+
+
+# ---- 工作进程：在本进程内运行机器人 ----
+
+def _write_channels_config(path: Path, mapping_count: int):
+    channels = [{
+        'id': f'bench_{i}',
+        'name': f'bench mapping {i}',
+        'source_channel': f'@bench_src_{i}',
+        'target_channel': str(TARGET_CHAT_BASE_ID - i),
+        'enabled': True,
+        'settings': {'delay_enabled': False}
+    } for i in range(mapping_count)]
+    path.write_text(json.dumps({'channels': channels, 'global_settings': {}}), encoding='utf-8')
+
+
+def _control(api_url: str, action: str, payload: Optional[dict] = None) -> dict:
+    data = json.dumps(payload or {}).encode() if action != 'results' else None
+    request = urllib.request.Request(
+        f"{api_url}/_control/{action}", data=data,
+        headers={'Content-Type': 'application/json'}, method='POST' if data is not None else 'GET'
+    )
+    with urllib.request.urlopen(request, timeout=30) as response:
+        return json.loads(response.read())
+
+
+def _process_io() -> Dict[str, int]:
+    """本进程的I/O计数（Linux /proc/self/io，其他平台返回空）"""
+    try:
+        with open('/proc/self/io', encoding='ascii') as f:
+            return {key: int(value) for key, value in (line.split(': ') for line in f)}
+    except OSError:
+        return {}
+
+
+def _percentile(values: List[float], percentile: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(percentile / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+async def _enqueue_paced(api_url: str, builder: ScenarioBuilder):
+    """按录制的到达间隔逐批入队（同一时刻到期的更新合并为一次请求）"""
+    _control(api_url, 'enqueue', {'files': builder.files})
+    start = time.monotonic()
+    index = 0
+    while index < len(builder.updates):
+        delay = builder.offsets[index] - (time.monotonic() - start)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+        elapsed = time.monotonic() - start
+        batch_end = index
+        while batch_end < len(builder.updates) and builder.offsets[batch_end] <= elapsed:
+            batch_end += 1
+        batch_markers = [marker for marker in builder.update_markers[index:batch_end] if marker]
+        _control(api_url, 'enqueue', {'updates': builder.updates[index:batch_end], 'markers': batch_markers})
+        index = batch_end
+
+
+async def _run_worker(scenario: str, api_url: str, args) -> dict:
+    builder = ScenarioBuilder()
+    mapping_count = SCENARIOS[scenario](builder, args)
+
+    work_dir = Path(tempfile.mkdtemp(prefix=f"bench_{scenario}_"))
+    channels_file = work_dir / 'channels.json'
+    _write_channels_config(channels_file, mapping_count)
+
+    os.environ.update({
+        'BOT_TOKEN': BENCH_TOKEN,
+        'SOURCE_CHANNEL_ID': '@bench_src_0',
+        'TARGET_CHANNEL_ID': str(TARGET_CHAT_BASE_ID),
+        'BOT_API_BASE_URL': f"{api_url}/bot",
+        'BOT_API_BASE_FILE_URL': f"{api_url}/file/bot",
+        'MULTI_CHANNEL_ENABLED': 'true',
+        'CHANNELS_CONFIG_FILE': str(channels_file),
+        'DOWNLOAD_PATH': str(work_dir / 'downloads'),
+        'STATE_DIR': str(work_dir / 'data'),
+        'MAX_FILE_SIZE': '4GB',
+        'DELAY_ENABLED': 'false',
+        'AUTO_POLLING': 'true',
+        'POLLING_ENABLED': 'true',
+        'TIME_CONTROL_ENABLED': 'false',
+        'MEDIA_GROUP_TIMEOUT': '1',
+        'PROXY_ENABLED': 'false',
+    })
+    os.environ.update(dict(item.split('=', 1) for item in args.env))
+
+    sys.path.insert(0, str(REPO_ROOT))
+    from main import CompleteTelegramMediaBot
+
+    _control(api_url, 'reset')
+    if args.stall_uploads or args.stall_downloads or args.stall_responses:
+        _control(api_url, 'faults', {'stall_uploads': args.stall_uploads, 'stall_downloads': args.stall_downloads,
+                                     'stall_responses': args.stall_responses})
+    io_before = _process_io()
+    bot = CompleteTelegramMediaBot()
+    bot_task = asyncio.create_task(bot.run())
+
+    # 等待机器人启动并开始处理
+    deadline = time.monotonic() + 30
+    while not (bot.running and bot.polling_active):
+        if bot_task.done() or time.monotonic() > deadline:
+            raise RuntimeError("机器人启动失败")
+        await asyncio.sleep(0.05)
+
+    if builder.offsets:
+        await _enqueue_paced(api_url, builder)
+    else:
+        _control(api_url, 'enqueue', {'updates': builder.updates, 'markers': builder.markers, 'files': builder.files})
+
+    deadline = time.monotonic() + args.timeout
+    while True:
+        results = _control(api_url, 'results')
+        if len(results['published']) >= len(builder.markers) or time.monotonic() > deadline:
+            break
+        await asyncio.sleep(0.1)
+
+    bot.shutdown_flag = True
+    await asyncio.wait_for(bot_task, 30)
+    io_after = _process_io()
+    staging = bot.media_downloader.staging_budget
+
+    latencies = [
+        results['published'][marker] - results['enqueued'][marker]
+        for marker in builder.markers if marker in results['published']
+    ]
+    if results['published']:
+        elapsed = max(results['published'].values()) - min(results['enqueued'].values())
+    else:
+        elapsed = args.timeout
+    total_bytes = results['bytes_downloaded'] + results['bytes_uploaded']
+
+    return {
+        'scenario': scenario,
+        'messages': len(builder.updates),
+        'posts': len(builder.markers),
+        'posts_published': len(latencies),
+        'timed_out': len(latencies) < len(builder.markers),
+        'elapsed_s': round(elapsed, 3),
+        'posts_per_s': round(len(latencies) / elapsed, 2) if elapsed > 0 else 0.0,
+        'messages_per_s': round(len(builder.updates) / elapsed, 2) if elapsed > 0 else 0.0,
+        'mb_per_s': round(total_bytes / (1024 * 1024) / elapsed, 2) if elapsed > 0 else 0.0,
+        'bytes_downloaded': results['bytes_downloaded'],
+        'bytes_uploaded': results['bytes_uploaded'],
+        'latency_p50_s': round(_percentile(latencies, 50), 3),
+        'latency_p99_s': round(_percentile(latencies, 99), 3),
+        'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        # 下载目录的文件数（每个文件: 写入、重新打开读取、删除），以及内存暂存的文件数
+        'disk_files': bot.media_downloader.disk_stats['files'],
+        'disk_bytes': bot.media_downloader.disk_stats['bytes'],
+        'staged_files': staging.stats['staged'] if staging else 0,
+        'staged_peak_mb': round(staging.stats['peak_bytes'] / (1024 * 1024), 2) if staging else 0.0,
+        'io_write_bytes': io_after.get('write_bytes', 0) - io_before.get('write_bytes', 0),
+        'api_requests': results['requests'],
+    }
+
+
+# ---- 主进程 ----
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def _wait_for_server(api_url: str, timeout: float = 15.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            _control(api_url, 'results')
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError("假 Bot API 服务器启动超时")
+
+
+def _scenario_args(args) -> List[str]:
+    forwarded = [
+        '--text-count', str(args.text_count),
+        '--video-size-mb', str(args.video_size_mb),
+        '--album-count', str(args.album_count),
+        '--photo-size-kb', str(args.photo_size_kb),
+        '--mapping-count', str(args.mapping_count),
+        '--small-media-count', str(args.small_media_count),
+        '--speed', str(args.speed),
+        '--timeout', str(args.timeout),
+        '--stall-uploads', str(args.stall_uploads),
+        '--stall-downloads', str(args.stall_downloads),
+        '--stall-responses', str(args.stall_responses),
+    ]
+    if args.recording:
+        forwarded += ['--recording', str(Path(args.recording).resolve())]
+    for item in args.env:
+        forwarded += ['--env', item]
+    return forwarded
+
+
+def run_all(args) -> dict:
+    port = _free_port()
+    api_url = f"http://127.0.0.1:{port}"
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'benchmarks.fake_bot_api', '--port', str(port),
+         '--latency', str(args.latency),
+         '--download-bandwidth', str(args.download_bandwidth),
+         '--upload-bandwidth', str(args.upload_bandwidth)],
+        cwd=REPO_ROOT
+    )
+
+    results = []
+    try:
+        _wait_for_server(api_url)
+        for scenario in args.scenarios:
+            with tempfile.TemporaryDirectory(prefix='bench_worker_') as work_dir:
+                result_file = Path(work_dir) / 'result.json'
+                worker = subprocess.run(
+                    [sys.executable, '-m', 'benchmarks.run_benchmarks', '--worker', scenario,
+                     '--api-url', api_url, '--result-file', str(result_file), *_scenario_args(args)],
+                    cwd=work_dir,
+                    env={**os.environ, 'PYTHONPATH': str(REPO_ROOT)},
+                    stdout=subprocess.DEVNULL if not args.verbose else None,
+                    stderr=subprocess.DEVNULL if not args.verbose else None,
+                )
+                if worker.returncode == 0 and result_file.exists():
+                    results.append(json.loads(result_file.read_text()))
+                else:
+                    results.append({'scenario': scenario, 'error': f"worker exited with {worker.returncode}"})
+    finally:
+        server.terminate()
+        server.wait()
+
+    return {
+        'timestamp': int(time.time()),
+        'python': sys.version.split()[0],
+        'settings': {
+            'latency_s': args.latency,
+            'download_bandwidth': args.download_bandwidth,
+            'upload_bandwidth': args.upload_bandwidth,
+            'recording': args.recording,
+            'speed': args.speed,
+            'env': args.env,
+        },
+        'results': results,
+    }
+
+
+def parse_args(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="端到端吞吐量压测")
+    parser.add_argument('--scenarios', nargs='+', default=SYNTHETIC_SCENARIOS, choices=list(SCENARIOS))
+    parser.add_argument('--output', help="结果JSON文件（默认输出到标准输出）")
+    parser.add_argument('--latency', type=float, default=0.0, help="假服务器每个请求的延迟（秒）")
+    parser.add_argument('--download-bandwidth', type=float, default=0.0, help="下载带宽（字节/秒，0为不限速）")
+    parser.add_argument('--upload-bandwidth', type=float, default=0.0, help="上传带宽（字节/秒，0为不限速）")
+    parser.add_argument('--text-count', type=int, default=200)
+    parser.add_argument('--video-size-mb', type=float, default=100)
+    parser.add_argument('--album-count', type=int, default=5)
+    parser.add_argument('--photo-size-kb', type=float, default=300)
+    parser.add_argument('--mapping-count', type=int, default=20)
+    parser.add_argument('--small-media-count', type=int, default=100)
+    parser.add_argument('--recording', help="replay 场景使用的录制文件（UPDATE_RECORD_PATH）")
+    parser.add_argument('--speed', type=float, default=1.0, help="回放倍速（1为原速，0为最快速度）")
+    parser.add_argument('--timeout', type=float, default=600, help="单个场景的最长运行时间（秒）")
+    parser.add_argument('--stall-uploads', type=int, default=0, help="让假服务器上接下来的N个上传停滞（测试停滞检测）")
+    parser.add_argument('--stall-downloads', type=int, default=0, help="让假服务器上接下来的N个下载停滞")
+    parser.add_argument('--stall-responses', type=int, default=0, help="让假服务器收完接下来的N个上传后不返回响应（测试不重复发布）")
+    parser.add_argument('--env', action='append', default=[], help="传给机器人的额外环境变量 KEY=VALUE")
+    parser.add_argument('--verbose', action='store_true', help="显示工作进程输出")
+    # 内部参数：工作进程模式
+    parser.add_argument('--worker', help=argparse.SUPPRESS)
+    parser.add_argument('--api-url', help=argparse.SUPPRESS)
+    parser.add_argument('--result-file', help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None):
+    args = parse_args(argv)
+
+    if args.worker:
+        result = asyncio.run(_run_worker(args.worker, args.api_url, args))
+        Path(args.result_file).write_text(json.dumps(result), encoding='utf-8')
+        return
+
+    report = json.dumps(run_all(args), indent=2, ensure_ascii=False)
+    if args.output:
+        Path(args.output).write_text(report, encoding='utf-8')
+    print(report)
+
+
+if __name__ == "__main__":
+    main()
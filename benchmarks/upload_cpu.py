@@ -0,0 +1,157 @@
+"""
+上传CPU压测 - 对比大文件上传三种方式每GB消耗的CPU时间和峰值内存
+
+用法（在仓库根目录）:
+    python -m benchmarks.upload_cpu                      # 默认 1024MB 文件，每种方式 3 次
+    python -m benchmarks.upload_cpu --size-mb 2048 --repeat 1 --modes ptb sendfile
+
+ptb:      原有方式，打开文件交给 PTB（整个文件读入内存，httpx 重新编码 multipart）
+chunked:  流式上传回退路径（按块读取文件，通过 httpx 连接池发送；代理或 TLS 时使用）
+sendfile: 流式上传直连路径（multipart 头尾在内存中，文件由 os.sendfile 直接写入 socket）
+每种方式在独立子进程中运行，统计上传期间本进程的用户态+内核态CPU时间（假服务器的CPU不计入），结果以JSON输出。
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import List, Optional
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_ROOT))
+
+from benchmarks.run_benchmarks import BENCH_TOKEN, TARGET_CHAT_BASE_ID, _free_port, _wait_for_server  # noqa: E402
+
+MODES = ['ptb', 'chunked', 'sendfile']
+
+
+def _write_test_file(path: Path, size_mb: int):
+    block = os.urandom(1024 * 1024)
+    with open(path, 'wb') as f:
+        for _ in range(size_mb):
+            f.write(block)
+
+
+def _cpu_seconds() -> float:
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+async def _run_worker(mode: str, api_url: str, file_path: Path, repeat: int) -> dict:
+    from telegram import Bot
+
+    from http_pools import TRAFFIC_UPLOAD, TrafficRoutedRequest, build_traffic_requests
+    from sendfile_upload import FileInputFile
+
+    settings = {
+        'size': 1, 'keepalive': 15.0, 'http2': False, 'connect_timeout': 30.0,
+        'read_timeout': 600.0, 'write_timeout': 60.0, 'pool_timeout': 60.0,
+    }
+    requests = build_traffic_requests(
+        {traffic_class: dict(settings) for traffic_class in ('api', TRAFFIC_UPLOAD)}, sendfile=(mode == 'sendfile')
+    )
+    bot = Bot(BENCH_TOKEN, base_url=f"{api_url}/bot", base_file_url=f"{api_url}/file/bot",
+              request=TrafficRoutedRequest(requests))
+    size = file_path.stat().st_size
+
+    runs = []
+    async with bot:
+        for _ in range(repeat):
+            cpu_started, started = _cpu_seconds(), time.monotonic()
+            if mode == 'ptb':
+                with open(file_path, 'rb') as f:
+                    await bot.send_video(chat_id=TARGET_CHAT_BASE_ID, video=f)
+            else:
+                await bot.send_video(chat_id=TARGET_CHAT_BASE_ID, video=FileInputFile(file_path))
+            cpu, elapsed = _cpu_seconds() - cpu_started, time.monotonic() - started
+            runs.append({'cpu_s': round(cpu, 3), 'elapsed_s': round(elapsed, 3)})
+
+    best = min(runs, key=lambda run: run['cpu_s'])
+    gigabytes = size / 1024 ** 3
+    return {
+        'mode': mode,
+        'size_mb': round(size / 1024 / 1024),
+        'cpu_s_per_gb': round(best['cpu_s'] / gigabytes, 3),
+        'mb_per_s': round(size / 1024 / 1024 / best['elapsed_s'], 1),
+        'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        'streamed_uploads': requests[TRAFFIC_UPLOAD].get_stats()['streamed_uploads'],
+        'runs': runs,
+    }
+
+
+def run_all(args) -> dict:
+    port = _free_port()
+    api_url = f"http://127.0.0.1:{port}"
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'benchmarks.fake_bot_api', '--port', str(port)],
+        cwd=REPO_ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+
+    results = []
+    try:
+        _wait_for_server(api_url)
+        with tempfile.TemporaryDirectory(prefix='bench_upload_') as work_dir:
+            file_path = Path(work_dir) / 'upload.mp4'
+            _write_test_file(file_path, args.size_mb)
+            for mode in args.modes:
+                result_file = Path(work_dir) / f'{mode}.json'
+                worker = subprocess.run(
+                    [sys.executable, '-m', 'benchmarks.upload_cpu', '--worker', mode, '--api-url', api_url,
+                     '--file', str(file_path), '--repeat', str(args.repeat), '--result-file', str(result_file)],
+                    cwd=REPO_ROOT,
+                    stdout=subprocess.DEVNULL if not args.verbose else None,
+                    stderr=subprocess.DEVNULL if not args.verbose else None,
+                )
+                if worker.returncode == 0 and result_file.exists():
+                    results.append(json.loads(result_file.read_text()))
+                else:
+                    results.append({'mode': mode, 'error': f"worker exited with {worker.returncode}"})
+    finally:
+        server.terminate()
+        server.wait()
+
+    return {
+        'timestamp': int(time.time()),
+        'python': sys.version.split()[0],
+        'settings': {'size_mb': args.size_mb, 'repeat': args.repeat},
+        'results': results,
+    }
+
+
+def parse_args(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="上传CPU压测")
+    parser.add_argument('--modes', nargs='+', default=MODES, choices=MODES)
+    parser.add_argument('--size-mb', type=int, default=1024, help="测试文件大小（MB）")
+    parser.add_argument('--repeat', type=int, default=3, help="每种方式上传的次数（取CPU时间最少的一次）")
+    parser.add_argument('--output', help="结果JSON文件（默认输出到标准输出）")
+    parser.add_argument('--verbose', action='store_true', help="显示工作进程输出")
+    # 内部参数：工作进程模式
+    parser.add_argument('--worker', help=argparse.SUPPRESS)
+    parser.add_argument('--api-url', help=argparse.SUPPRESS)
+    parser.add_argument('--file', help=argparse.SUPPRESS)
+    parser.add_argument('--result-file', help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None):
+    args = parse_args(argv)
+
+    if args.worker:
+        result = asyncio.run(_run_worker(args.worker, args.api_url, Path(args.file), args.repeat))
+        Path(args.result_file).write_text(json.dumps(result), encoding='utf-8')
+        return
+
+    report = json.dumps(run_all(args), indent=2, ensure_ascii=False)
+    if args.output:
+        Path(args.output).write_text(report, encoding='utf-8')
+    print(report)
+
+
+if __name__ == "__main__":
+    main()
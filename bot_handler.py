@@ -4,15 +4,22 @@ Telegram Bot 消息处理模块
 
 import asyncio
 import logging
-import random
+import os
 import re
+from contextlib import nullcontext
 from typing import List, Optional
 from pathlib import Path
 
-from telegram import Update, Message, InputMediaPhoto, InputMediaVideo, InputMediaDocument
+from telegram import Update, Message, InputMediaPhoto, InputMediaVideo, InputMediaDocument, InputMediaAudio
 from telegram.error import TelegramError
 
+from album_planner import BATCH_RETRIES, BATCH_RETRY_DELAY, AlbumBatch, AlbumSendError, plan_album
 from config import Config
+from http_pools import TRAFFIC_UPLOAD
+from memory_staging import staged_buffer
+from sendfile_upload import FileInputFile
+from transfer_progress import DIRECTION_UPLOAD, TransferProgress
+from transfer_timeouts import TransferTimeouts, UploadUnconfirmed
 
 logger = logging.getLogger(__name__)
 
@@ -22,6 +29,10 @@ class TelegramBotHandler:
     
     def __init__(self, config: Config):
         self.config = config
+        self.image_processor = None  # 可选的图片优化阶段（ImageProcessor）
+        self.publish_scheduler = None  # 可选的发布调度器（PublishScheduler），负责发布前的随机延迟
+        self.transfer_timeouts = TransferTimeouts(config)  # 上传截止时间（主程序替换为带实测吞吐量的实例）
+        self.transfer_progress = TransferProgress()  # 上传进度（主程序替换为与下载共用的实例）
     
     def has_media(self, message: Message) -> bool:
         """检查消息是否包含媒体文件"""
@@ -64,17 +75,18 @@ class TelegramBotHandler:
         
         logger.info(f"📥 收到来自源频道的消息 {message.message_id}")
         
+        # 到达时预约发布时间：下载立即开始，随机延迟只在发布前等待
+        ticket = None
+        if self.publish_scheduler:
+            delay_range = (self.config.forward_delay_min, self.config.forward_delay_max) if self.config.delay_enabled else (0.0, 0.0)
+            ticket = self.publish_scheduler.reserve(self.config.target_channel_id, *delay_range)
+        published = False
+        
         try:
             # 检查消息是否包含媒体
             if self.has_media(message):
                 logger.info(f"📥 消息 {message.message_id} 包含媒体，开始下载...")
                 
-                # 添加下载前的随机延迟
-                if self.config.delay_enabled:
-                    delay = random.uniform(self.config.download_delay_min, self.config.download_delay_max)
-                    logger.info(f"⏱️ 下载前等待 {delay:.1f}s（模拟人工操作）")
-                    await asyncio.sleep(delay)
-                
                 # 下载媒体文件
                 from media_downloader import MediaDownloader
                 downloader = MediaDownloader(self.config)
@@ -83,16 +95,15 @@ class TelegramBotHandler:
                 if downloaded_files:
                     logger.info(f"📥 消息 {message.message_id} 下载完成，共 {len(downloaded_files)} 个文件")
                     
-                    # 添加转发前的随机延迟
-                    if self.config.delay_enabled:
-                        delay = random.uniform(self.config.forward_delay_min, self.config.forward_delay_max)
-                        logger.info(f"⏱️ 转发前等待 {delay:.1f}s（模拟人工操作）")
-                        await asyncio.sleep(delay)
+                    # 等待轮到该消息发布
+                    if ticket:
+                        await self.publish_scheduler.wait_turn(ticket)
                     
                     logger.info(f"📤 开始转发消息 {message.message_id} 到目标频道...")
                     
                     # 转发消息到目标频道
                     await self.forward_message(message, downloaded_files, context.bot)
+                    published = True
                     logger.info(f"🎉 成功转发消息 {message.message_id} 到目标频道")
                     
                     # 自动清理已成功发布的文件
@@ -105,25 +116,32 @@ class TelegramBotHandler:
             else:
                 logger.info(f"📝 消息 {message.message_id} 是纯文本消息")
                 
-                # 添加转发前的随机延迟
-                if self.config.delay_enabled:
-                    delay = random.uniform(self.config.forward_delay_min, self.config.forward_delay_max)
-                    logger.info(f"⏱️ 转发前等待 {delay:.1f}s（模拟人工操作）")
-                    await asyncio.sleep(delay)
+                # 等待轮到该消息发布
+                if ticket:
+                    await self.publish_scheduler.wait_turn(ticket)
                 
                 # 转发纯文本消息
                 await self.forward_text_message(message, context.bot)
+                published = True
                 logger.info(f"🎉 成功转发文本消息 {message.message_id} 到目标频道")
                 
         except Exception as e:
             logger.error(f"❌ 处理消息 {message.message_id} 失败: {e}")
             raise
+        finally:
+            if ticket:
+                self.publish_scheduler.release(ticket, published)
     
     async def _cleanup_files(self, file_infos: list):
         """清理已成功发布的文件"""
         import os
         for file_info in file_infos:
             try:
+                # 内存暂存的文件：释放内存预算
+                staged = staged_buffer(file_info)
+                if staged:
+                    staged.release()
+                
                 # 处理文件格式 {'path': Path, 'type': str}
                 if isinstance(file_info, dict):
                     file_path = file_info['path']
@@ -131,85 +149,132 @@ class TelegramBotHandler:
                     # 向后兼容旧格式
                     file_path = file_info
                     
-                if os.path.exists(file_path):
+                if file_path and os.path.exists(file_path):
                     os.remove(file_path)
                     logger.info(f"已清理文件: {file_path}")
+                
+                # 清理优化阶段生成的缩略图
+                thumbnail_path = file_info.get('thumbnail') if isinstance(file_info, dict) else None
+                if thumbnail_path and os.path.exists(thumbnail_path):
+                    os.remove(thumbnail_path)
             except Exception as e:
                 logger.error(f"清理文件 {file_info} 失败: {e}")
     
-    async def forward_text_message(self, message: Message, bot=None, channel_mapping: dict = None):
-        """发送纯文本消息（作为原创内容）"""
+    async def forward_text_message(self, message: Message, bot=None, channel_mapping: dict = None) -> List[Message]:
+        """发送纯文本消息（作为原创内容），返回发送的消息"""
         try:
             # 获取bot实例
             bot_instance = bot or getattr(message, 'bot', None)
             if not bot_instance:
                 raise ValueError("无法获取bot实例")
             
-            # 构建消息文本（支持频道特定设置）
-            forward_text = self._build_forward_text(message, channel_mapping)
-            
-            # 获取目标频道ID
-            target_channel = channel_mapping['target_channel'] if channel_mapping else self.config.target_channel_id
-            
-            # 发送到目标频道
-            await bot_instance.send_message(
-                chat_id=target_channel,
-                text=forward_text,
-                parse_mode='HTML',
-                disable_web_page_preview=False
-            )
-            
-            logger.info(f"成功转发文本消息到目标频道")
+            return await self.publish_text(self._get_source_text(message), bot_instance, channel_mapping)
             
         except TelegramError as e:
             logger.error(f"转发文本消息失败: {e}")
             raise
     
-    async def forward_message(self, message: Message, downloaded_files: List[dict], bot=None, channel_mapping: dict = None, send_lock=None):
-        """发送包含媒体的消息（作为原创内容）"""
+    async def publish_text(self, source_text: str, bot, channel_mapping: dict = None) -> List[Message]:
+        """按原始文本发布纯文本消息（不依赖 Message 对象，供索引重发等场景使用），返回发送的消息"""
+        # 构建消息文本（支持频道特定设置）
+        forward_text = self.build_caption(source_text, channel_mapping)
+        
+        # 获取目标频道ID
+        target_channel = channel_mapping['target_channel'] if channel_mapping else self.config.target_channel_id
+        
+        # 发送到目标频道
+        sent_message = await bot.send_message(
+            chat_id=target_channel,
+            text=forward_text,
+            parse_mode='HTML',
+            disable_web_page_preview=False
+        )
+        
+        logger.info(f"成功转发文本消息到目标频道")
+        return [sent_message]
+    
+    async def forward_message(self, message: Message, downloaded_files: List[dict], bot=None, channel_mapping: dict = None, send_lock=None) -> List[Message]:
+        """发送包含媒体的消息（作为原创内容），返回发送的消息"""
         try:
             # 获取bot实例
             bot_instance = bot or getattr(message, 'bot', None)
             if not bot_instance:
                 raise ValueError("无法获取bot实例")
             
-            # 构建消息文本（支持频道特定设置）
-            forward_text = self._build_forward_text(message, channel_mapping)
-            
-            # 根据媒体类型和数量选择转发方式
-            media_type = self.get_media_type(message)
-            
-            if len(downloaded_files) == 1:
-                # 单个媒体文件
-                await self._send_single_media(message, downloaded_files[0], forward_text, bot_instance, channel_mapping, send_lock)
-            else:
-                # 多个媒体文件
-                await self._send_media_group(message, downloaded_files, forward_text, bot_instance, channel_mapping, send_lock)
-            
-            logger.info(f"成功转发媒体消息到目标频道")
+            return await self.publish_media(downloaded_files, self._get_source_text(message), bot_instance, channel_mapping, send_lock)
             
         except TelegramError as e:
             logger.error(f"转发媒体消息失败: {e}")
             raise
     
-    async def _send_single_media(self, message: Message, file_info: dict, caption: str, bot, channel_mapping: dict = None, send_lock=None):
-        """发送单个媒体文件"""
-        file_path = file_info['path']
-        media_type = file_info['type']
+    async def publish_media(self, downloaded_files: List[dict], source_text: str, bot, channel_mapping: dict = None, send_lock=None,
+                            progress: Optional[list] = None) -> List[Message]:
+        """按原始文本发布已下载的媒体文件（不依赖 Message 对象，供索引重发等场景使用），返回发送的消息
+        
+        progress: 媒体组每发完一批追加 (文件列表, 消息列表)，发布中途被取消时调用方据此知道哪些文件已经发出
+        """
+        # 构建消息文本（支持频道特定设置）
+        forward_text = self.build_caption(source_text, channel_mapping)
+        
+        # 下载阶段没有优化过的图片（回填、晚到的相册文件等）在这里优化
+        downloaded_files = await self.prepare_media(downloaded_files, channel_mapping)
+        
+        if len(downloaded_files) == 1:
+            # 单个媒体文件
+            sent_messages = [await self._send_single_media(None, downloaded_files[0], forward_text, bot, channel_mapping)]
+        else:
+            # 多个媒体文件
+            sent_messages = await self._send_media_group(None, downloaded_files, forward_text, bot, channel_mapping, send_lock, progress)
         
+        logger.info(f"成功转发媒体消息到目标频道")
+        return sent_messages
+    
+    async def prepare_media(self, downloaded_files: List[dict], channel_mapping: dict = None) -> List[dict]:
+        """下载阶段的后处理：可选的上传前图片优化（进程池中执行，不阻塞事件循环），在等待发布时间之前调用"""
+        if self.image_processor:
+            downloaded_files = await self.image_processor.process_files(downloaded_files, channel_mapping)
+        return downloaded_files
+    
+    @staticmethod
+    def _file_size(file_info: dict) -> int:
+        staged = staged_buffer(file_info)
+        return len(staged.data) if staged else os.path.getsize(file_info['path'])
+    
+    def _stream_upload(self, file_info: dict) -> bool:
+        """大文件按路径流式上传（不读入内存）"""
+        return (
+            self.config.upload_streaming_enabled and not staged_buffer(file_info)
+            and os.path.getsize(file_info['path']) >= self.config.upload_streaming_min_size
+        )
+    
+    async def _send_single_media(self, message: Message, file_info: dict, caption: str, bot, channel_mapping: dict = None) -> Message:
+        """发送单个媒体文件，返回发送的消息（按文件大小计算截止时间，停滞或超时后重试）"""
         # 获取目标频道ID
         target_channel = channel_mapping['target_channel'] if channel_mapping else self.config.target_channel_id
         
-        # 通用超时设置（从配置读取，支持大文件）
-        timeout_kwargs = {
-            'read_timeout': self.config.upload_read_timeout,
-            'write_timeout': self.config.upload_write_timeout,
-            'connect_timeout': self.config.upload_connect_timeout
-        }
+        return await self.transfer_timeouts.run(
+            TRAFFIC_UPLOAD, self._file_size(file_info), f"上传{file_info['type']}",
+            lambda timeouts: self._send_single_media_once(file_info, caption, bot, target_channel, timeouts)
+        )
+    
+    async def _send_single_media_once(self, file_info: dict, caption: str, bot, target_channel: str, timeouts: dict) -> Message:
+        media_type = file_info['type']
+        timeout_kwargs = dict(timeouts)
         
-        with open(file_path, 'rb') as file:
+        # 内存暂存的文件直接上传（需要提供文件名），大文件流式上传，其他文件从下载目录读取
+        staged = staged_buffer(file_info)
+        if staged:
+            timeout_kwargs['filename'] = staged.file_name
+            source = nullcontext(staged.data)
+        elif self._stream_upload(file_info):
+            source = nullcontext(FileInputFile(file_info['path']))
+        else:
+            source = open(file_info['path'], 'rb')
+        file_name = staged.file_name if staged else Path(file_info['path']).name
+        
+        with self.transfer_progress.track(DIRECTION_UPLOAD, file_name, self._file_size(file_info)), source as file:
             if media_type == 'photo':
-                await bot.send_photo(
+                return await bot.send_photo(
                     chat_id=target_channel,
                     photo=file,
                     caption=caption,
@@ -217,7 +282,7 @@ class TelegramBotHandler:
                     **timeout_kwargs
                 )
             elif media_type == 'video':
-                await bot.send_video(
+                return await bot.send_video(
                     chat_id=target_channel,
                     video=file,
                     caption=caption,
@@ -225,15 +290,17 @@ class TelegramBotHandler:
                     **timeout_kwargs
                 )
             elif media_type == 'document':
-                await bot.send_document(
+                thumbnail_path = file_info.get('thumbnail')
+                return await bot.send_document(
                     chat_id=target_channel,
                     document=file,
                     caption=caption,
                     parse_mode='HTML',
+                    thumbnail=Path(thumbnail_path).read_bytes() if thumbnail_path else None,
                     **timeout_kwargs
                 )
             elif media_type == 'audio':
-                await bot.send_audio(
+                return await bot.send_audio(
                     chat_id=target_channel,
                     audio=file,
                     caption=caption,
@@ -241,7 +308,7 @@ class TelegramBotHandler:
                     **timeout_kwargs
                 )
             elif media_type == 'voice':
-                await bot.send_voice(
+                return await bot.send_voice(
                     chat_id=target_channel,
                     voice=file,
                     caption=caption,
@@ -249,13 +316,13 @@ class TelegramBotHandler:
                     **timeout_kwargs
                 )
             elif media_type == 'video_note':
-                await bot.send_video_note(
+                return await bot.send_video_note(
                     chat_id=target_channel,
                     video_note=file,
                     **timeout_kwargs
                 )
             elif media_type == 'animation':
-                await bot.send_animation(
+                return await bot.send_animation(
                     chat_id=target_channel,
                     animation=file,
                     caption=caption,
@@ -263,72 +330,133 @@ class TelegramBotHandler:
                     **timeout_kwargs
                 )
             elif media_type == 'sticker':
-                await bot.send_sticker(
+                timeout_kwargs.pop('filename', None)
+                return await bot.send_sticker(
                     chat_id=target_channel,
                     sticker=file,
                     **timeout_kwargs
                 )
     
-    async def _send_media_group(self, message: Message, file_infos: List[dict], caption: str, bot, channel_mapping: dict = None, send_lock=None):
-        """发送媒体组"""
+    async def _send_media_group(self, message: Message, file_infos: List[dict], caption: str, bot, channel_mapping: dict = None, send_lock=None,
+                                progress: Optional[list] = None) -> List[Message]:
+        """发送媒体组，返回发送的消息（按类型和数量拆分为合法的批次，按顺序发送）"""
         # 获取目标频道ID
         target_channel = channel_mapping['target_channel'] if channel_mapping else self.config.target_channel_id
         
-        media_list = []
+        batches = plan_album(file_infos)
+        if len(batches) > 1:
+            logger.info(f"📦 媒体组 ({len(file_infos)} 个文件) 拆分为 {len(batches)} 批发送: {', '.join(batch.describe() for batch in batches)}")
+        
+        # 使用全局发送锁，确保同时只有一个媒体组在发送（各批次之间不会插入其他内容）
+        if send_lock:
+            async with send_lock:
+                logger.info(f"🔒 获得发送锁，开始发送媒体组")
+                sent_messages = await self._send_album_batches(batches, caption, bot, target_channel, channel_mapping, progress)
+        else:
+            sent_messages = await self._send_album_batches(batches, caption, bot, target_channel, channel_mapping, progress)
         
-        # 读取所有文件内容到内存，避免文件句柄关闭问题
-        file_contents = []
+        logger.info(f"✅ 成功发送媒体组，包含 {len(file_infos)} 个媒体文件")
+        return sent_messages
+    
+    async def _send_album_batches(self, batches: List[AlbumBatch], caption: str, bot, target_channel: str,
+                                  channel_mapping: dict = None, progress: Optional[list] = None) -> List[Message]:
+        """按顺序发送各批次，下一批的文件在当前批上传时读取（流水线）；
+        某一批重试后仍失败时停止发送并抛出 AlbumSendError（之后的批次不发送，caption 不会落到后面的批次上）"""
+        sent_messages = []
+        sent_files = []
+        prepared = asyncio.create_task(self._prepare_album_batch(batches[0], caption))
+        try:
+            for index, batch in enumerate(batches):
+                current, prepared = prepared, None
+                if index + 1 < len(batches):
+                    prepared = asyncio.create_task(self._prepare_album_batch(batches[index + 1], caption))
+                
+                for attempt in range(BATCH_RETRIES + 1):
+                    try:
+                        if attempt:
+                            # 流式上传的文件已被读取，重新构建这一批
+                            current = self._prepare_album_batch(batch, caption)
+                        batch_messages = await self._send_album_batch(batch, await current, caption, bot, target_channel, channel_mapping)
+                        break
+                    except (TelegramError, OSError) as e:
+                        failure = f"媒体组第 {index + 1}/{len(batches)} 批 ({batch.describe()}) 发送失败: {e}"
+                        # 请求已发出但未确认时服务器可能已经发布，重发会重复
+                        if attempt == BATCH_RETRIES or isinstance(e, UploadUnconfirmed):
+                            unsent_files = [file_info for pending in batches[index:] for file_info in pending.files]
+                            raise AlbumSendError(failure, sent_messages, sent_files, unsent_files) from e
+                        logger.warning(f"🔄 {failure}，{BATCH_RETRY_DELAY}秒后重试")
+                        await asyncio.sleep(BATCH_RETRY_DELAY)
+                sent_messages += batch_messages
+                sent_files += batch.files
+                if progress is not None:
+                    progress.append((batch.files, batch_messages))
+        finally:
+            if prepared is not None:
+                prepared.cancel()
+        
+        return sent_messages
+    
+    async def _send_album_batch(self, batch: AlbumBatch, prepared: tuple, caption: str, bot, target_channel: str,
+                                channel_mapping: dict = None) -> List[Message]:
+        """发送一个批次：2个以上文件用 send_media_group，单个文件单独发送"""
+        media_list, total_size = prepared
+        if batch.is_album:
+            return await self._send_media_group_with_retry(bot, target_channel, media_list, total_size)
+        return [await self._send_single_media(None, batch.files[0], caption if batch.with_caption else None, bot, channel_mapping)]
+    
+    def _read_album_files(self, file_infos: List[dict]) -> list:
+        """读取一批文件的内容和缩略图（在线程中执行）；内存暂存的文件直接使用，大文件流式上传"""
+        contents = []
         for file_info in file_infos:
-            with open(file_info['path'], 'rb') as f:
-                file_contents.append(f.read())
+            staged = staged_buffer(file_info)
+            if staged:
+                content = staged.data
+            elif self._stream_upload(file_info):
+                content = FileInputFile(file_info['path'], attach=True)
+            else:
+                with open(file_info['path'], 'rb') as f:
+                    content = f.read()
+            # 图片优化阶段生成的文档缩略图
+            thumbnail = Path(file_info['thumbnail']).read_bytes() if file_info.get('thumbnail') else None
+            contents.append((content, thumbnail))
+        return contents
+    
+    async def _prepare_album_batch(self, batch: AlbumBatch, caption: str):
+        """构建一批的 InputMedia 列表和总大小（单个文件的批次直接发送，不需要准备）"""
+        if not batch.is_album:
+            return None, 0
+        contents = await asyncio.to_thread(self._read_album_files, batch.files)
         
-        for i, (file_info, file_content) in enumerate(zip(file_infos, file_contents)):
+        media_list = []
+        for i, (file_info, (file_content, thumbnail)) in enumerate(zip(batch.files, contents)):
             media_type = file_info['type']
-            
-            # 只在第一个媒体上添加说明文字
-            if i == 0 and caption:
-                if media_type == 'photo':
-                    media = InputMediaPhoto(media=file_content, caption=caption, parse_mode='HTML')
-                elif media_type == 'video':
-                    media = InputMediaVideo(media=file_content, caption=caption, parse_mode='HTML')
-                else:
-                    media = InputMediaDocument(media=file_content, caption=caption, parse_mode='HTML')
+            # 只在第一批的第一个媒体上添加说明文字
+            media_caption = caption if i == 0 and batch.with_caption and caption else None
+            parse_mode = 'HTML' if media_caption else None
+            if media_type == 'photo':
+                media = InputMediaPhoto(media=file_content, caption=media_caption, parse_mode=parse_mode)
+            elif media_type == 'video':
+                media = InputMediaVideo(media=file_content, caption=media_caption, parse_mode=parse_mode)
+            elif media_type == 'audio':
+                media = InputMediaAudio(media=file_content, caption=media_caption, parse_mode=parse_mode)
             else:
-                if media_type == 'photo':
-                    media = InputMediaPhoto(media=file_content)
-                elif media_type == 'video':
-                    media = InputMediaVideo(media=file_content)
-                else:
-                    media = InputMediaDocument(media=file_content)
-            
+                media = InputMediaDocument(media=file_content, caption=media_caption, parse_mode=parse_mode, thumbnail=thumbnail)
             media_list.append(media)
         
-        logger.info(f"📤 准备发送媒体组，包含 {len(media_list)} 个媒体文件")
-        
-        # 使用全局发送锁，确保同时只有一个媒体组在发送
-        if send_lock:
-            async with send_lock:
-                logger.info(f"🔒 获得发送锁，开始发送媒体组")
-                await self._send_media_group_with_retry(bot, target_channel, media_list)
-        else:
-            await self._send_media_group_with_retry(bot, target_channel, media_list)
-        
-        logger.info(f"✅ 成功发送媒体组，包含 {len(media_list)} 个媒体文件")
+        logger.info(f"📤 准备发送媒体组批次，包含 {len(media_list)} 个媒体文件")
+        return media_list, sum(len(file_content) for file_content, _ in contents)
     
-    async def _send_media_group_with_retry(self, bot, target_channel: str, media_list: list, max_retries: int = 3):
-        """发送媒体组，带重试机制"""
+    async def _send_media_group_with_retry(self, bot, target_channel: str, media_list: list, total_size: int = 0,
+                                           max_retries: int = 3) -> List[Message]:
+        """发送媒体组，带重试机制（429频率限制；停滞或超过截止时间由 transfer_timeouts 快速重试），返回发送的消息"""
         
         for attempt in range(max_retries + 1):
             try:
-                # 发送媒体组（使用配置的超时时间，支持大文件如1GB视频）
-                await bot.send_media_group(
-                    chat_id=target_channel,
-                    media=media_list,
-                    read_timeout=self.config.upload_read_timeout,
-                    write_timeout=self.config.upload_write_timeout,
-                    connect_timeout=self.config.upload_connect_timeout
-                )
-                return  # 成功发送，退出重试循环
+                # 发送媒体组（截止时间按总大小和实测上传速度计算，固定超时作为上限）
+                return await self.transfer_timeouts.run(
+                    TRAFFIC_UPLOAD, total_size, f"上传媒体组({len(media_list)}个文件)",
+                    lambda timeouts: self._send_media_group_once(bot, target_channel, media_list, total_size, timeouts)
+                )  # 成功发送，退出重试循环
                 
             except TelegramError as e:
                 error_code = getattr(e, 'error_code', None)
@@ -358,8 +486,25 @@ class TelegramBotHandler:
                     logger.error(f"❌ 发送媒体组失败: {error_message}")
                     raise
     
+    async def _send_media_group_once(self, bot, target_channel: str, media_list: list, total_size: int,
+                                     timeouts: dict) -> List[Message]:
+        with self.transfer_progress.track(DIRECTION_UPLOAD, f"媒体组({len(media_list)}个文件)", total_size):
+            return await bot.send_media_group(chat_id=target_channel, media=media_list, **timeouts)
+    
+    def _get_source_text(self, message: Message) -> str:
+        """获取原始消息文本（文本消息取text，媒体消息取caption）"""
+        if message.text:
+            return message.text
+        elif message.caption:
+            return message.caption
+        return ""
+    
     def _build_forward_text(self, message: Message, channel_mapping: dict = None) -> str:
         """构建消息文本（支持频道特定设置）"""
+        return self.build_caption(self._get_source_text(message), channel_mapping)
+    
+    def build_caption(self, source_text: str, channel_mapping: dict = None) -> str:
+        """根据原始文本构建最终caption（支持频道特定设置）"""
         
         # 获取caption设置（优先使用频道特定设置）
         fixed_caption = None
@@ -383,15 +528,7 @@ class TelegramBotHandler:
             logger.info(f"使用固定caption: {result_text[:50]}...")
         else:
             # 使用原始消息内容
-            text_parts = []
-            
-            # 添加原始消息文本
-            if message.text:
-                text_parts.append(message.text)
-            elif message.caption:
-                text_parts.append(message.caption)
-            
-            result_text = '\n'.join(text_parts) if text_parts else ""
+            result_text = source_text or ""
             
             # 检查是否需要追加内容
             if append_caption is not None and result_text:
@@ -0,0 +1,223 @@
+"""
+聊天元数据缓存模块 - 所有映射的源/目标频道的标题、数字ID、用户名、成员数和机器人的管理员权限
+后台按 TTL（加随机抖动，避免所有频道同时过期）并发刷新，/status 和 /list_channels 直接读取缓存
+路由时用缓存把 @用户名 和 -100… 数字ID 对应起来（配置写的格式和消息中的格式不同也能匹配）
+"""
+
+import asyncio
+import logging
+import random
+import time
+from typing import Dict, Iterable, List, Optional
+
+from telegram import Chat, ChatMemberAdministrator, ChatMemberOwner
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+ERROR_RETRY = 120.0   # 秒 - 获取失败的频道多久后重试
+MAX_SLEEP = 60.0      # 秒 - 后台刷新的最长休眠时间（期间配置可能新增频道）
+
+
+class ChatInfo:
+    """一个聊天的元数据"""
+
+    __slots__ = (
+        'reference', 'chat_id', 'title', 'username', 'chat_type', 'member_count',
+        'bot_status', 'can_post', 'can_edit', 'can_delete', 'fetched_at', 'expires_at', 'error',
+    )
+
+    def __init__(self, reference: str):
+        self.reference = reference  # 配置中的写法（@用户名 或 数字ID）
+        self.chat_id: Optional[int] = int(reference) if reference.lstrip('-').isdigit() else None
+        self.title: Optional[str] = None
+        self.username: Optional[str] = None
+        self.chat_type: Optional[str] = None
+        self.member_count: Optional[int] = None
+        self.bot_status: Optional[str] = None  # administrator / creator / member / left ...
+        self.can_post = self.can_edit = self.can_delete = False
+        self.fetched_at: Optional[float] = None
+        self.expires_at = 0.0
+        self.error: Optional[str] = None
+
+    @property
+    def is_admin(self) -> bool:
+        return self.bot_status in ('administrator', 'creator')
+
+    def format(self) -> str:
+        """格式化一行（用于 /status 和 /list_channels）"""
+        if self.fetched_at is None:
+            return f"❌ {self.error}" if self.error else "⏳ 尚未获取"
+        name = self.title or self.reference
+        ids = f"{self.chat_id}" + (f", @{self.username}" if self.username else "")
+        members = f", 成员 {self.member_count}" if self.member_count is not None else ""
+        if self.is_admin:
+            rights = "管理员 (" + " ".join(
+                f"{label}{'✓' if allowed else '✗'}"
+                for label, allowed in (('发布', self.can_post), ('编辑', self.can_edit), ('删除', self.can_delete))
+            ) + ")"
+        else:
+            rights = f"⚠️ 机器人不是管理员 ({self.bot_status or '未知'})"
+        line = f"✅ {name} ({ids}){members}, {rights}, {time.time() - self.fetched_at:.0f}s前更新"
+        if self.error:
+            line += f" ⚠️ 上次刷新失败: {self.error}"
+        return line
+
+
+class ChatMetadataCache:
+    """聊天元数据缓存（按配置中的写法和数字ID两种方式索引）"""
+
+    def __init__(self, config: Config):
+        self.config = config
+        self.ttl = config.chat_cache_ttl
+        self.jitter = config.chat_cache_jitter
+        self._entries: Dict[str, ChatInfo] = {}
+        self._usernames: Dict[str, int] = {}  # 小写用户名 -> 数字ID（刷新结果和收到的消息都会更新）
+        self._semaphore = asyncio.Semaphore(config.chat_cache_concurrency)
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self.stats = {'refreshes': 0, 'fetched': 0, 'errors': 0, 'last_duration': None}
+
+    # ---- 查询 ----
+
+    def references(self) -> List[str]:
+        """需要缓存的聊天：所有映射（含禁用的）和单频道配置的源/目标频道"""
+        references = []
+        if self.config.multi_channel_enabled:
+            for mapping in self.config.channel_mappings:
+                references += [mapping['source_channel'], mapping['target_channel']]
+        else:
+            references += [self.config.source_channel_id, self.config.target_channel_id]
+        return list(dict.fromkeys(str(reference) for reference in references if reference))
+
+    def get(self, reference: str) -> Optional[ChatInfo]:
+        return self._entries.get(str(reference))
+
+    def resolve_id(self, reference: str) -> Optional[int]:
+        """配置中的写法 -> 数字ID（未知时返回 None）"""
+        reference = str(reference)
+        if reference.lstrip('-').isdigit():
+            return int(reference)
+        if reference.startswith('@'):
+            return self._usernames.get(reference[1:].lower())
+        return None
+
+    def mapping_for_chat(self, chat_id: int, mappings: Iterable[dict]) -> Optional[dict]:
+        """按数字ID查找源频道匹配的映射（配置写的是 @用户名 而消息中是数字ID，或者相反）"""
+        for mapping in mappings:
+            if self.resolve_id(mapping['source_channel']) == chat_id:
+                return mapping
+        return None
+
+    def observe(self, chat: Chat):
+        """收到消息时顺便记录聊天的用户名和数字ID（不需要额外请求）"""
+        if chat.username and self._usernames.get(chat.username.lower()) != chat.id:
+            self._usernames[chat.username.lower()] = chat.id
+
+    # ---- 刷新 ----
+
+    def start(self, bot):
+        if self._task is None:
+            self._task = asyncio.create_task(self._refresh_loop(bot))
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def request_refresh(self):
+        """频道配置变化后立即获取新增的聊天"""
+        self._wakeup.set()
+
+    async def _refresh_loop(self, bot):
+        while True:
+            try:
+                await self.refresh(bot)
+            except Exception as e:
+                logger.error(f"❌ 刷新聊天元数据失败: {e}")
+            now = time.time()
+            next_expiry = min((entry.expires_at for entry in self._entries.values()), default=now + MAX_SLEEP)
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), max(1.0, min(MAX_SLEEP, next_expiry - now)))
+            except asyncio.TimeoutError:
+                pass
+
+    async def refresh(self, bot, force: bool = False):
+        """并发获取所有过期（或 force 时全部）的聊天元数据"""
+        references = self.references()
+        for reference in list(self._entries):
+            if reference not in references:
+                del self._entries[reference]
+        now = time.time()
+        due = [
+            reference for reference in references
+            if force or reference not in self._entries or self._entries[reference].expires_at <= now
+        ]
+        if not due:
+            return
+        started = time.monotonic()
+        await asyncio.gather(*(self._fetch(bot, reference) for reference in due))
+        self.stats['refreshes'] += 1
+        self.stats['last_duration'] = time.monotonic() - started
+        logger.info(f"🗂️ 已刷新 {len(due)} 个聊天的元数据 ({self.stats['last_duration']:.1f}s)")
+
+    async def _fetch(self, bot, reference: str):
+        entry = self._entries.get(reference) or ChatInfo(reference)
+        self._entries[reference] = entry
+        async with self._semaphore:
+            try:
+                chat, member_count, member = await asyncio.gather(
+                    bot.get_chat(reference),
+                    bot.get_chat_member_count(reference),
+                    bot.get_chat_member(reference, bot.id),
+                )
+            except Exception as e:
+                entry.error = str(e)
+                entry.expires_at = time.time() + min(ERROR_RETRY, self.ttl)
+                self.stats['errors'] += 1
+                logger.warning(f"⚠️ 获取聊天 {reference} 的元数据失败: {e}")
+                return
+
+        entry.chat_id = chat.id
+        entry.title = chat.title or chat.full_name
+        entry.username = chat.username
+        entry.chat_type = chat.type
+        entry.member_count = member_count
+        entry.bot_status = member.status
+        if isinstance(member, ChatMemberOwner):
+            entry.can_post = entry.can_edit = entry.can_delete = True
+        elif isinstance(member, ChatMemberAdministrator):
+            entry.can_post = bool(member.can_post_messages) if chat.type == Chat.CHANNEL else True
+            entry.can_edit = bool(member.can_edit_messages) if chat.type == Chat.CHANNEL else True
+            entry.can_delete = bool(member.can_delete_messages)
+        else:
+            entry.can_post = entry.can_edit = entry.can_delete = False
+        entry.error = None
+        entry.fetched_at = time.time()
+        entry.expires_at = entry.fetched_at + self.ttl * (1 + random.uniform(-self.jitter, self.jitter))
+        if chat.username:
+            self._usernames[chat.username.lower()] = chat.id
+        self.stats['fetched'] += 1
+
+    # ---- 状态 ----
+
+    def format_chat(self, reference: str) -> str:
+        entry = self.get(reference)
+        return entry.format() if entry else "⏳ 尚未获取"
+
+    def format_status(self) -> str:
+        """格式化统计（用于 /status）"""
+        entries = list(self._entries.values())
+        failed = sum(1 for entry in entries if entry.fetched_at is None)
+        not_admin = sum(1 for entry in entries if entry.fetched_at is not None and not entry.is_admin)
+        last = f"{self.stats['last_duration']:.1f}s" if self.stats['last_duration'] is not None else "无"
+        return (
+            f"{len(entries)} 个聊天, 获取失败 {failed}, 非管理员 {not_admin}; "
+            f"刷新 {self.stats['refreshes']} 次 (上次耗时 {last}), TTL {self.ttl:.0f}s"
+        )
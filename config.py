@@ -2,73 +2,178 @@
 配置文件管理
 """
 
+import asyncio
 import os
 import json
+import tempfile
 from pathlib import Path
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, Mapping, Tuple
+
+from content_filter import CompiledFilter
+from time_window import TimeWindow
 
 
 class Config:
     """配置类"""
     
-    def __init__(self):
+    def __init__(self, env: Optional[Mapping[str, str]] = None):
+        # env 覆盖进程环境变量（多租户模式下每个租户的配置）
+        self._env = {**os.environ, **env} if env is not None else os.environ
+        self._mappings_update_lock = asyncio.Lock()  # 串行化管理命令对频道映射的修改（读取-写文件-替换）
         self.bot_token = self._get_required_env('BOT_TOKEN')
         self.source_channel_id = self._get_required_env('SOURCE_CHANNEL_ID')
         self.target_channel_id = self._get_required_env('TARGET_CHANNEL_ID')
         
+        # Bot API 服务地址（可指向本地 Bot API 服务器或压测用的假服务器）
+        self.bot_api_base_url = self._getenv('BOT_API_BASE_URL', 'https://api.telegram.org/bot')
+        self.bot_api_base_file_url = self._getenv('BOT_API_BASE_FILE_URL', 'https://api.telegram.org/file/bot')
+        
         # 可选配置
         self.api_id = self._get_optional_env('API_ID')
         self.api_hash = self._get_optional_env('API_HASH')
         
         # 下载设置
-        self.download_path = os.getenv('DOWNLOAD_PATH', './downloads')
-        self.max_file_size = self._parse_file_size(os.getenv('MAX_FILE_SIZE', '50MB'))
+        self.download_path = self._getenv('DOWNLOAD_PATH', './downloads')
+        self.max_file_size = self._parse_file_size(self._getenv('MAX_FILE_SIZE', '50MB'))
         
         # 代理设置
-        self.proxy_enabled = os.getenv('PROXY_ENABLED', 'false').lower() == 'true'
+        self.proxy_enabled = self._getenv('PROXY_ENABLED', 'false').lower() == 'true'
         self.proxy_host = self._get_optional_env('PROXY_HOST')
         self.proxy_port = self._get_optional_env('PROXY_PORT')
         self.proxy_username = self._get_optional_env('PROXY_USERNAME')
         self.proxy_password = self._get_optional_env('PROXY_PASSWORD')
-        self.proxy_type = os.getenv('PROXY_TYPE', 'socks5').lower()
+        self.proxy_type = self._getenv('PROXY_TYPE', 'socks5').lower()
         
         # 随机延迟设置
-        self.delay_enabled = os.getenv('DELAY_ENABLED', 'true').lower() == 'true'
-        self.min_delay = float(os.getenv('MIN_DELAY', '1.0'))
-        self.max_delay = float(os.getenv('MAX_DELAY', '5.0'))
-        self.download_delay_min = float(os.getenv('DOWNLOAD_DELAY_MIN', '2.0'))
-        self.download_delay_max = float(os.getenv('DOWNLOAD_DELAY_MAX', '8.0'))
-        self.forward_delay_min = float(os.getenv('FORWARD_DELAY_MIN', '1.0'))
-        self.forward_delay_max = float(os.getenv('FORWARD_DELAY_MAX', '4.0'))
+        self.delay_enabled = self._getenv('DELAY_ENABLED', 'true').lower() == 'true'
+        self.min_delay = float(self._getenv('MIN_DELAY', '1.0'))
+        self.max_delay = float(self._getenv('MAX_DELAY', '5.0'))
+        self.download_delay_min = float(self._getenv('DOWNLOAD_DELAY_MIN', '2.0'))
+        self.download_delay_max = float(self._getenv('DOWNLOAD_DELAY_MAX', '8.0'))
+        self.forward_delay_min = float(self._getenv('FORWARD_DELAY_MIN', '1.0'))
+        self.forward_delay_max = float(self._getenv('FORWARD_DELAY_MAX', '4.0'))
         
         # 轮询控制设置
-        self.polling_enabled = os.getenv('POLLING_ENABLED', 'true').lower() == 'true'
-        self.polling_interval = float(os.getenv('POLLING_INTERVAL', '10.0'))  # 轮询间隔（秒）
-        self.auto_polling = os.getenv('AUTO_POLLING', 'true').lower() == 'true'  # 启动时自动开始轮询
+        self.polling_enabled = self._getenv('POLLING_ENABLED', 'true').lower() == 'true'
+        self.polling_interval = float(self._getenv('POLLING_INTERVAL', '10.0'))  # 轮询间隔（秒）
+        self.auto_polling = self._getenv('AUTO_POLLING', 'true').lower() == 'true'  # 启动时自动开始轮询
         
         # 时间段控制
-        self.time_control_enabled = os.getenv('TIME_CONTROL_ENABLED', 'false').lower() == 'true'
-        self.start_time = os.getenv('START_TIME', '10:00')  # 开始时间 HH:MM
-        self.end_time = os.getenv('END_TIME', '12:00')    # 结束时间 HH:MM
-        self.timezone = os.getenv('TIMEZONE', 'Asia/Shanghai')  # 时区
+        self.time_control_enabled = self._getenv('TIME_CONTROL_ENABLED', 'false').lower() == 'true'
+        self.start_time = self._getenv('START_TIME', '10:00')  # 开始时间 HH:MM
+        self.end_time = self._getenv('END_TIME', '12:00')    # 结束时间 HH:MM
+        self.timezone = self._getenv('TIMEZONE', 'Asia/Shanghai')  # 时区
+        self.time_window = None  # 验证配置后创建
         
         # 下载配置
-        self.download_timeout = int(os.getenv('DOWNLOAD_TIMEOUT', '7200'))  # 秒 - 下载超时时间（默认2小时）
-        self.media_group_timeout = int(os.getenv('MEDIA_GROUP_TIMEOUT', '3'))  # 秒 - 等待更多消息的时间
-        self.media_group_max_wait = int(os.getenv('MEDIA_GROUP_MAX_WAIT', '60'))  # 秒 - 等待新消息的最大时间
+        self.download_timeout = int(self._getenv('DOWNLOAD_TIMEOUT', '7200'))  # 秒 - 下载超时时间（默认2小时）
+        self.media_group_timeout = int(self._getenv('MEDIA_GROUP_TIMEOUT', '3'))  # 秒 - 等待更多消息的时间
+        self.media_group_max_wait = int(self._getenv('MEDIA_GROUP_MAX_WAIT', '60'))  # 秒 - 等待新消息的最大时间
+        self.media_group_max_open = int(self._getenv('MEDIA_GROUP_MAX_OPEN', '500'))  # 同时收集的媒体组上限，超出时提前处理最早的
+        self.media_group_prefetch = self._getenv('MEDIA_GROUP_PREFETCH', 'true').lower() == 'true'  # 收集期间提前下载已到达的媒体文件
+        self.media_group_late_policy = self._getenv('MEDIA_GROUP_LATE_POLICY', 'drop').lower()  # 已完成媒体组晚到的消息: drop / edit
+        self.media_group_tombstone_ttl = int(self._getenv('MEDIA_GROUP_TOMBSTONE_TTL', '600'))  # 秒 - 已完成媒体组的记录保留时间
+        self.media_group_tombstone_max = int(self._getenv('MEDIA_GROUP_TOMBSTONE_MAX', '5000'))  # 已完成媒体组的记录数量上限
         
         # 网络超时配置
-        self.upload_connect_timeout = int(os.getenv('UPLOAD_CONNECT_TIMEOUT', '120'))  # 秒 - 连接超时（默认2分钟）
-        self.upload_read_timeout = int(os.getenv('UPLOAD_READ_TIMEOUT', '1800'))  # 秒 - 读取超时（默认30分钟）
-        self.upload_write_timeout = int(os.getenv('UPLOAD_WRITE_TIMEOUT', '1800'))  # 秒 - 写入超时（默认30分钟）
+        self.upload_connect_timeout = int(self._getenv('UPLOAD_CONNECT_TIMEOUT', '120'))  # 秒 - 连接超时（默认2分钟）
+        self.upload_read_timeout = int(self._getenv('UPLOAD_READ_TIMEOUT', '1800'))  # 秒 - 读取超时（默认30分钟）
+        self.upload_write_timeout = int(self._getenv('UPLOAD_WRITE_TIMEOUT', '1800'))  # 秒 - 写入超时（默认30分钟）
+        
+        # 自适应传输超时（按文件大小和实测吞吐量计算截止时间，上面的固定超时作为上限）
+        self.transfer_adaptive_timeouts = self._getenv('TRANSFER_ADAPTIVE_TIMEOUTS', 'true').lower() == 'true'
+        self.transfer_stall_timeout = float(self._getenv('TRANSFER_STALL_TIMEOUT', '60'))  # 秒 - 没有数据传输超过此时间即中止
+        self.transfer_min_timeout = float(self._getenv('TRANSFER_MIN_TIMEOUT', '30'))  # 秒 - 截止时间下限（小文件）
+        self.transfer_initial_rate = self._parse_file_size(self._getenv('TRANSFER_INITIAL_RATE', '1MB'))  # 字节/秒 - 还没有实测数据时假设的速度
+        self.transfer_deadline_factor = float(self._getenv('TRANSFER_DEADLINE_FACTOR', '4'))  # 允许比实测速度慢的倍数
+        self.transfer_retries = int(self._getenv('TRANSFER_RETRIES', '2'))  # 停滞/超时中止后的重试次数
+        
+        # 聊天元数据缓存（频道标题、ID/用户名、成员数、管理员权限）
+        self.chat_cache_ttl = float(self._getenv('CHAT_CACHE_TTL', '3600'))  # 秒 - 元数据刷新间隔
+        self.chat_cache_jitter = float(self._getenv('CHAT_CACHE_JITTER', '0.1'))  # 刷新间隔的随机抖动比例
+        self.chat_cache_concurrency = int(self._getenv('CHAT_CACHE_CONCURRENCY', '4'))  # 同时刷新的聊天数
+        
+        # 指标导出（Prometheus /metrics，端口为0时不启动）
+        self.metrics_host = self._getenv('METRICS_HOST', '127.0.0.1')
+        self.metrics_port = int(self._getenv('METRICS_PORT', '0'))
+        
+        # HTTP连接池配置（按流量类型分离：长轮询/元数据请求/下载/上传）
+        self.http_pools = {
+            'poll': self._parse_pool_settings('POLL', size=1, keepalive=60.0, connect_timeout=30.0, read_timeout=30.0, write_timeout=30.0, pool_timeout=10.0),
+            'api': self._parse_pool_settings('API', size=8, keepalive=30.0, connect_timeout=30.0, read_timeout=30.0, write_timeout=30.0, pool_timeout=10.0),
+            'download': self._parse_pool_settings('DOWNLOAD', size=4, keepalive=30.0, connect_timeout=self.upload_connect_timeout, read_timeout=300.0, write_timeout=30.0, pool_timeout=600.0),
+            'upload': self._parse_pool_settings('UPLOAD', size=4, keepalive=15.0, connect_timeout=self.upload_connect_timeout, read_timeout=self.upload_read_timeout, write_timeout=self.upload_write_timeout, pool_timeout=1800.0),
+        }
+        
+        # 流式上传配置（大文件按路径流式发送，不读入内存；直连 http:// 的本地 Bot API 服务器可用 sendfile）
+        self.upload_streaming_enabled = self._getenv('UPLOAD_STREAMING_ENABLED', 'true').lower() == 'true'
+        self.upload_streaming_min_size = self._parse_file_size(self._getenv('UPLOAD_STREAMING_MIN_SIZE', '20MB'))  # 不小于此大小的文件流式上传
+        self.upload_sendfile_enabled = self._getenv('UPLOAD_SENDFILE_ENABLED', 'true').lower() == 'true'
         
         # Caption管理配置 - 运行时设置，不从环境变量读取
         self.fixed_caption = None  # 固定caption内容，如果设置则替换所有消息的caption
         self.append_caption = None  # 追加到原caption后面的内容
         
+        # 图片优化配置（进程池中执行，可在频道映射 settings.image_optimization 中覆盖）
+        self.image_optimization_enabled = self._getenv('IMAGE_OPTIMIZATION_ENABLED', 'false').lower() == 'true'
+        self.image_max_dimension = int(self._getenv('IMAGE_MAX_DIMENSION', '2560'))  # 像素 - 最长边上限（Telegram照片上限2560）
+        self.image_quality = int(self._getenv('IMAGE_QUALITY', '85'))  # JPEG/WebP 重新编码质量
+        self.image_strip_metadata = self._getenv('IMAGE_STRIP_METADATA', 'true').lower() == 'true'
+        self.image_thumbnails = self._getenv('IMAGE_THUMBNAILS', 'true').lower() == 'true'  # 为图片文档生成缩略图
+        self.image_optimize_documents = self._getenv('IMAGE_OPTIMIZE_DOCUMENTS', 'false').lower() == 'true'  # 是否处理以文档发送的图片
+        self.image_min_size = self._parse_file_size(self._getenv('IMAGE_MIN_SIZE', '200KB'))  # 小于此大小的图片不处理
+        self.image_workers = int(self._getenv('IMAGE_WORKERS', '2'))  # 图片处理进程数
+        
+        # 内存暂存配置（小文件不经过磁盘）
+        self.memory_staging_enabled = self._getenv('MEMORY_STAGING_ENABLED', 'true').lower() == 'true'
+        self.memory_staging_max_file_size = self._parse_file_size(self._getenv('MEMORY_STAGING_MAX_FILE_SIZE', '1MB'))  # 不超过此大小的文件暂存到内存
+        self.memory_staging_budget = self._parse_file_size(self._getenv('MEMORY_STAGING_BUDGET', '64MB'))  # 暂存文件占用的内存上限
+        
+        # 优先级通道配置（按文件大小区分快速通道和大文件通道）
+        self.lane_express_max_size = self._parse_file_size(self._getenv('LANE_EXPRESS_MAX_SIZE', '20MB'))  # 不超过此大小走快速通道
+        self.lane_bulk_max_slots = int(self._getenv('LANE_BULK_MAX_SLOTS', '0'))  # 大文件最多占用的下载槽位（0=总槽位-1）
+        self.lane_bulk_max_wait = float(self._getenv('LANE_BULK_MAX_WAIT', '60'))  # 秒 - 大文件等待超过此时间后优先调度
+        
+        # 本地状态目录（消息索引等持久化数据）
+        self.state_dir = self._getenv('STATE_DIR', './data')
+        
+        # 消息索引配置（SQLite FTS5，用于 /selective_forward）
+        self.message_index_enabled = self._getenv('MESSAGE_INDEX_ENABLED', 'true').lower() == 'true'
+        self.message_index_path = self._getenv('MESSAGE_INDEX_PATH', str(Path(self.state_dir) / 'message_index.db'))
+        
+        # 消息映射配置（源消息 -> 目标消息ID，用于同步编辑和 /unpublish）
+        self.message_map_enabled = self._getenv('MESSAGE_MAP_ENABLED', 'true').lower() == 'true'
+        self.message_map_path = self._getenv('MESSAGE_MAP_PATH', str(Path(self.state_dir) / 'message_map.db'))
+        self.message_map_max_age_days = float(self._getenv('MESSAGE_MAP_MAX_AGE_DAYS', '30'))  # 超过此天数的记录自动清理
+        self.message_sync_edits = self._getenv('MESSAGE_SYNC_EDITS', 'true').lower() == 'true'  # 源消息编辑后同步编辑目标消息
+        
+        # 更新流录制配置（用于回放压测）
+        self.update_record_enabled = self._getenv('UPDATE_RECORD_ENABLED', 'false').lower() == 'true'
+        self.update_record_path = self._getenv('UPDATE_RECORD_PATH', str(Path(self.state_dir) / 'updates.jsonl.gz'))
+        
+        # 延迟队列配置（时间段外的消息保存下来，窗口开启后平滑释放）
+        self.deferred_queue_enabled = self._getenv('DEFERRED_QUEUE_ENABLED', 'true').lower() == 'true'
+        self.deferred_queue_path = self._getenv('DEFERRED_QUEUE_PATH', str(Path(self.state_dir) / 'deferred.db'))
+        self.deferred_release_per_minute = float(self._getenv('DEFERRED_RELEASE_PER_MINUTE', '6'))  # 每分钟最多释放的帖子数
+        
+        # 关闭排空配置（收到 SIGTERM 后等待正在发布的内容完成，其余保存到检查点，重启后恢复）
+        self.shutdown_drain_timeout = float(self._getenv('SHUTDOWN_DRAIN_TIMEOUT', '60'))  # 秒 - 等待正在发布的内容的最长时间
+        self.drain_checkpoint_path = self._getenv('DRAIN_CHECKPOINT_PATH', str(Path(self.state_dir) / 'drain_checkpoint.db'))
+        
+        # 历史回填配置（MTProto用户会话，需要 API_ID/API_HASH）
+        self.backfill_provider = self._getenv('BACKFILL_PROVIDER', 'telethon').lower()  # telethon 或 fake（本地假数据）
+        self.backfill_session_path = self._getenv('BACKFILL_SESSION_PATH', str(Path(self.state_dir) / 'backfill.session'))
+        self.backfill_state_path = self._getenv('BACKFILL_STATE_PATH', str(Path(self.state_dir) / 'backfill.db'))
+        self.backfill_fake_history_file = self._getenv('BACKFILL_FAKE_HISTORY_FILE', 'fake_history.json')
+        self.backfill_page_size = int(self._getenv('BACKFILL_PAGE_SIZE', '100'))  # 每页消息ID数量
+        self.backfill_fetch_concurrency = int(self._getenv('BACKFILL_FETCH_CONCURRENCY', '3'))  # 并行获取的页数
+        self.backfill_max_per_minute = float(self._getenv('BACKFILL_MAX_PER_MINUTE', '20'))  # 每分钟最多发布条数
+        
         # 多频道配置
-        self.multi_channel_enabled = os.getenv('MULTI_CHANNEL_ENABLED', 'false').lower() == 'true'
-        self.channels_config_file = os.getenv('CHANNELS_CONFIG_FILE', 'channels.json')
+        self.multi_channel_enabled = self._getenv('MULTI_CHANNEL_ENABLED', 'false').lower() == 'true'
+        self.channels_config_file = self._getenv('CHANNELS_CONFIG_FILE', 'channels.json')
+        self.channels_hot_reload = self._getenv('CHANNELS_HOT_RELOAD', 'true').lower() == 'true'  # 监视配置文件并自动重新加载
+        self.channels_reload_interval = float(self._getenv('CHANNELS_RELOAD_INTERVAL', '2'))  # 秒 - 无inotify时的轮询间隔
         self.channel_mappings = []  # 存储频道映射列表
         self.global_channel_settings = {}  # 全局频道设置
         
@@ -78,16 +183,33 @@ class Config:
         # 验证配置
         self._validate_config()
     
+    def _getenv(self, key: str, default: Optional[str] = None) -> Optional[str]:
+        return self._env.get(key, default)
+    
     def _get_required_env(self, key: str) -> str:
         """获取必需的环境变量"""
-        value = os.getenv(key)
+        value = self._getenv(key)
         if not value:
             raise ValueError(f"必需的环境变量 {key} 未设置")
         return value
     
     def _get_optional_env(self, key: str) -> Optional[str]:
         """获取可选的环境变量"""
-        return os.getenv(key)
+        return self._getenv(key)
+    
+    def _parse_pool_settings(self, name: str, size: int, keepalive: float, connect_timeout: float,
+                             read_timeout: float, write_timeout: float, pool_timeout: float) -> Dict[str, Any]:
+        """解析单个流量类型的连接池配置（环境变量前缀 HTTP_POOL_<NAME>_）"""
+        prefix = f'HTTP_POOL_{name}_'
+        return {
+            'size': int(self._getenv(prefix + 'SIZE', str(size))),  # 最大连接数
+            'keepalive': float(self._getenv(prefix + 'KEEPALIVE', str(keepalive))),  # 秒 - 空闲连接保活时间
+            'http2': self._getenv(prefix + 'HTTP2', 'false').lower() == 'true',  # 是否启用HTTP/2
+            'connect_timeout': float(self._getenv(prefix + 'CONNECT_TIMEOUT', str(connect_timeout))),
+            'read_timeout': float(self._getenv(prefix + 'READ_TIMEOUT', str(read_timeout))),
+            'write_timeout': float(self._getenv(prefix + 'WRITE_TIMEOUT', str(write_timeout))),
+            'pool_timeout': float(self._getenv(prefix + 'POOL_TIMEOUT', str(pool_timeout))),  # 秒 - 等待空闲连接的最长时间
+        }
     
     def _parse_file_size(self, size_str: str) -> int:
         """解析文件大小字符串为字节数"""
@@ -122,6 +244,11 @@ class Config:
         if not download_path.exists():
             download_path.mkdir(parents=True, exist_ok=True)
         
+        # 验证状态目录
+        state_dir = Path(self.state_dir)
+        if not state_dir.exists():
+            state_dir.mkdir(parents=True, exist_ok=True)
+        
         # 验证文件大小限制
         if self.max_file_size <= 0:
             raise ValueError("最大文件大小必须大于0")
@@ -162,8 +289,16 @@ class Config:
             raise ValueError("媒体组超时时间必须大于0")
         if self.media_group_max_wait <= 0:
             raise ValueError("媒体组最大等待时间必须大于0")
+        if self.media_group_max_open <= 0:
+            raise ValueError("同时收集的媒体组上限必须大于0")
+        if self.media_group_late_policy not in ('drop', 'edit'):
+            raise ValueError("MEDIA_GROUP_LATE_POLICY 必须是 drop 或 edit")
+        if self.media_group_tombstone_ttl <= 0 or self.media_group_tombstone_max <= 0:
+            raise ValueError("已完成媒体组的记录保留时间和数量上限必须大于0")
         if self.download_timeout < 60:
             raise ValueError("下载超时时间至少应为60秒")
+        if self.shutdown_drain_timeout < 0:
+            raise ValueError("关闭排空等待时间不能小于0")
         
         # 验证网络超时配置
         if self.upload_connect_timeout <= 0:
@@ -178,6 +313,68 @@ class Config:
             raise ValueError("读取超时时间至少应为60秒")
         if self.upload_write_timeout < 60:
             raise ValueError("写入超时时间至少应为60秒")
+        if self.transfer_stall_timeout <= 0 or self.transfer_min_timeout <= 0 or self.transfer_initial_rate <= 0:
+            raise ValueError("传输停滞时间、截止时间下限和初始速度必须大于0")
+        if self.transfer_deadline_factor < 1:
+            raise ValueError("TRANSFER_DEADLINE_FACTOR 至少为1")
+        if self.transfer_retries < 0:
+            raise ValueError("传输重试次数不能为负数")
+        if self.message_map_max_age_days <= 0:
+            raise ValueError("MESSAGE_MAP_MAX_AGE_DAYS 必须大于0")
+        if self.chat_cache_ttl <= 0:
+            raise ValueError("CHAT_CACHE_TTL 必须大于0")
+        if not 0 <= self.chat_cache_jitter < 1:
+            raise ValueError("CHAT_CACHE_JITTER 必须在 0-1 之间")
+        if self.chat_cache_concurrency < 1:
+            raise ValueError("CHAT_CACHE_CONCURRENCY 至少为1")
+        if not 0 <= self.metrics_port <= 65535:
+            raise ValueError("METRICS_PORT 必须在 0-65535 之间")
+        
+        # 验证连接池配置
+        for traffic_class, pool in self.http_pools.items():
+            if pool['size'] < 1:
+                raise ValueError(f"连接池 {traffic_class} 的连接数至少为1")
+            if pool['keepalive'] < 0:
+                raise ValueError(f"连接池 {traffic_class} 的保活时间不能为负数")
+            if min(pool['connect_timeout'], pool['read_timeout'], pool['write_timeout'], pool['pool_timeout']) <= 0:
+                raise ValueError(f"连接池 {traffic_class} 的超时时间必须大于0")
+        
+        if self.upload_streaming_min_size <= 0:
+            raise ValueError("UPLOAD_STREAMING_MIN_SIZE 必须大于0")
+        
+        # 验证图片优化配置
+        if not 1 <= self.image_quality <= 95:
+            raise ValueError("图片质量必须在1-95之间")
+        if self.image_max_dimension < 0:
+            raise ValueError("图片最长边上限不能为负数")
+        if self.image_workers < 1:
+            raise ValueError("图片处理进程数至少为1")
+        
+        # 验证内存暂存配置
+        if self.memory_staging_enabled and self.memory_staging_max_file_size > self.memory_staging_budget:
+            raise ValueError("内存暂存的单文件上限不能超过内存预算")
+        
+        # 验证优先级通道配置
+        if self.lane_express_max_size <= 0:
+            raise ValueError("快速通道文件大小上限必须大于0")
+        if self.lane_bulk_max_slots < 0:
+            raise ValueError("大文件通道槽位数不能为负数")
+        if self.lane_bulk_max_wait <= 0:
+            raise ValueError("大文件最长等待时间必须大于0")
+        
+        # 验证历史回填配置
+        if self.backfill_provider not in ['telethon', 'fake']:
+            raise ValueError("BACKFILL_PROVIDER 必须是 telethon 或 fake")
+        if not 1 <= self.backfill_page_size <= 100:
+            raise ValueError("回填分页大小必须在1-100之间")
+        if self.backfill_fetch_concurrency < 1:
+            raise ValueError("回填并行获取数至少为1")
+        if self.backfill_max_per_minute <= 0:
+            raise ValueError("回填发布速率必须大于0")
+        
+        # 验证频道配置热重载
+        if self.channels_reload_interval <= 0:
+            raise ValueError("频道配置检查间隔必须大于0")
         
         # 验证时间格式
         if self.time_control_enabled:
@@ -195,6 +392,15 @@ class Config:
             except:
                 # 如果pytz不可用或时区无效，使用默认时区
                 self.timezone = 'Asia/Shanghai'
+            
+            # 预先计算时间窗口（缓存时区对象和下一次开启/关闭时刻）
+            try:
+                self.time_window = TimeWindow(self.start_time, self.end_time, self.timezone)
+            except Exception:
+                self.time_window = None
+        
+        if self.deferred_release_per_minute <= 0:
+            raise ValueError("延迟队列释放速率必须大于0")
     
     def get_proxy_config(self):
         """获取代理配置字典"""
@@ -215,24 +421,11 @@ class Config:
     
     def is_in_time_range(self):
         """检查当前时间是否在允许的时间范围内"""
-        if not self.time_control_enabled:
+        if not self.time_control_enabled or self.time_window is None:
             return True
         
         try:
-            from datetime import datetime
-            import pytz
-            
-            tz = pytz.timezone(self.timezone)
-            now = datetime.now(tz)
-            current_time = now.strftime('%H:%M')
-            
-            # 处理跨日情况
-            if self.start_time <= self.end_time:
-                # 同一天内的时间范围
-                return self.start_time <= current_time <= self.end_time
-            else:
-                # 跨日的时间范围
-                return current_time >= self.start_time or current_time <= self.end_time
+            return self.time_window.is_open()
         except Exception:
             # 如果时间检查失败，默认允许
             return True
@@ -248,6 +441,9 @@ class Config:
         
         download_info = f"超时:{self.download_timeout//60}分钟, 媒体组等待:{self.media_group_max_wait}s"
         network_info = f"连接:{self.upload_connect_timeout}s, 读写:{self.upload_read_timeout//60}分钟"
+        pool_info = ", ".join(
+            f"{name}:{pool['size']}{'(h2)' if pool['http2'] else ''}" for name, pool in self.http_pools.items()
+        )
         
         return f"""
 配置信息:
@@ -261,6 +457,7 @@ class Config:
 - 轮询控制: {polling_info}
 - 下载配置: {download_info}
 - 网络超时: {network_info}
+- 连接池: {pool_info}
 - 多频道模式: {'启用' if self.multi_channel_enabled else '禁用'}
 - 频道映射数量: {len(self.channel_mappings)}
 """
@@ -293,18 +490,66 @@ class Config:
             # 如果配置文件不存在，创建默认配置
             self._create_default_channels_config(config_file)
         
+        self.channel_mappings, self.global_channel_settings = self.read_channels_file()
+    
+    def read_channels_file(self) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+        """读取并验证频道配置文件，返回 (频道映射列表, 全局设置)，不修改当前配置（可在线程中调用）"""
+        config_file = Path(self.channels_config_file)
         try:
             with open(config_file, 'r', encoding='utf-8') as f:
                 config_data = json.load(f)
             
-            self.channel_mappings = config_data.get('channels', [])
-            self.global_channel_settings = config_data.get('global_settings', {})
+            channel_mappings = config_data.get('channels', [])
+            global_settings = config_data.get('global_settings', {})
             
             # 验证频道映射配置
-            self._validate_channel_mappings()
+            self._validate_channel_mappings(channel_mappings)
+            max_concurrent_channels = global_settings.get('max_concurrent_channels', 0)
+            if not isinstance(max_concurrent_channels, int) or max_concurrent_channels < 0:
+                raise ValueError(f"max_concurrent_channels 必须是非负整数: {max_concurrent_channels}")
             
         except Exception as e:
             raise ValueError(f"加载频道配置文件失败 {config_file}: {e}")
+        
+        return channel_mappings, global_settings
+    
+    def apply_channel_mappings(self, channel_mappings: List[Dict[str, Any]], global_settings: Dict[str, Any]) -> Dict[str, list]:
+        """原子替换路由表和全局设置，返回变更摘要 {'added': [...], 'removed': [...], 'changed': [...]}
+        
+        旧的映射对象不会被修改，正在处理中的媒体组/任务继续使用它们持有的旧映射。
+        """
+        old_mappings = {mapping['id']: mapping for mapping in self.channel_mappings}
+        new_mappings = {mapping['id']: mapping for mapping in channel_mappings}
+        
+        # 同步赋值（中间没有 await），事件循环上的其他协程只会看到完整的旧表或新表
+        self.channel_mappings = channel_mappings
+        self.global_channel_settings = global_settings
+        
+        return {
+            'added': [mapping_id for mapping_id in new_mappings if mapping_id not in old_mappings],
+            'removed': [mapping_id for mapping_id in old_mappings if mapping_id not in new_mappings],
+            'changed': [
+                mapping_id for mapping_id, mapping in new_mappings.items()
+                if mapping_id in old_mappings and old_mappings[mapping_id] != mapping
+            ],
+        }
+    
+    def _write_json_atomic(self, config_file: Path, data: dict):
+        """原子写入JSON文件：写入同目录临时文件后 rename，读取方不会看到写了一半的文件"""
+        config_file = config_file.resolve()
+        fd, tmp_path = tempfile.mkstemp(prefix=f".{config_file.name}.", suffix='.tmp', dir=config_file.parent)
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(data, f, indent=2, ensure_ascii=False)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, config_file)
+        except BaseException:
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+            raise
     
     def _create_default_channels_config(self, config_file: Path):
         """创建默认的频道配置文件"""
@@ -336,21 +581,20 @@ class Config:
         }
         
         try:
-            with open(config_file, 'w', encoding='utf-8') as f:
-                json.dump(default_config, f, indent=2, ensure_ascii=False)
+            self._write_json_atomic(config_file, default_config)
             print(f"✅ 已创建默认频道配置文件: {config_file}")
         except Exception as e:
             print(f"❌ 创建配置文件失败: {e}")
     
-    def _validate_channel_mappings(self):
+    def _validate_channel_mappings(self, channel_mappings: List[Dict[str, Any]]):
         """验证频道映射配置"""
-        if not self.channel_mappings:
+        if not channel_mappings:
             raise ValueError("至少需要配置一个频道映射")
         
         channel_ids = set()
         source_channels = set()
         
-        for mapping in self.channel_mappings:
+        for mapping in channel_mappings:
             # 验证必需字段
             required_fields = ['id', 'name', 'source_channel', 'target_channel']
             for field in required_fields:
@@ -380,6 +624,21 @@ class Config:
             mapping.setdefault('enabled', True)
             mapping.setdefault('description', '')
             mapping.setdefault('settings', {})
+            
+            # 验证公平调度设置
+            weight = mapping['settings'].get('weight', 1.0)
+            if not isinstance(weight, (int, float)) or weight <= 0:
+                raise ValueError(f"频道映射 {mapping_id} 的 weight 必须大于0: {weight}")
+            max_concurrent = mapping['settings'].get('max_concurrent', 0)
+            if not isinstance(max_concurrent, int) or max_concurrent < 0:
+                raise ValueError(f"频道映射 {mapping_id} 的 max_concurrent 必须是非负整数: {max_concurrent}")
+            
+            # 验证并预编译下载前过滤规则（配置错误时拒绝加载）
+            if mapping['settings'].get('filters'):
+                try:
+                    CompiledFilter(mapping['settings']['filters'])
+                except ValueError as e:
+                    raise ValueError(f"频道映射 {mapping_id} 的 filters 配置错误: {e}")
     
     def get_enabled_channel_mappings(self) -> List[Dict[str, Any]]:
         """获取启用的频道映射列表"""
@@ -429,66 +688,64 @@ class Config:
         """获取所有启用的源频道ID列表"""
         return [mapping['source_channel'] for mapping in self.get_enabled_channel_mappings()]
     
-    def save_channel_mappings(self) -> bool:
-        """保存频道映射配置到文件"""
+    async def save_channel_mappings(self, channel_mappings: List[Dict[str, Any]]) -> bool:
+        """把新的频道映射列表写入文件（在线程中），成功后通过 apply_channel_mappings 原子替换路由表"""
         if not self.multi_channel_enabled:
             return False
         
         try:
             config_data = {
-                'channels': self.channel_mappings,
+                'channels': channel_mappings,
                 'global_settings': self.global_channel_settings
             }
             
-            config_file = Path(self.channels_config_file)
-            with open(config_file, 'w', encoding='utf-8') as f:
-                json.dump(config_data, f, indent=2, ensure_ascii=False)
-            
-            return True
+            await asyncio.to_thread(self._write_json_atomic, Path(self.channels_config_file), config_data)
         except Exception as e:
             print(f"❌ 保存频道配置失败: {e}")
             return False
+        
+        self.apply_channel_mappings(channel_mappings, self.global_channel_settings)
+        return True
     
-    def add_channel_mapping(self, mapping: Dict[str, Any]) -> bool:
+    async def add_channel_mapping(self, mapping: Dict[str, Any]) -> bool:
         """添加新的频道映射"""
-        try:
-            # 验证映射数据
-            required_fields = ['id', 'name', 'source_channel', 'target_channel']
-            for field in required_fields:
-                if field not in mapping:
-                    raise ValueError(f"缺少必需字段: {field}")
-            
-            # 检查ID是否已存在
-            for existing in self.channel_mappings:
-                if existing['id'] == mapping['id']:
-                    raise ValueError(f"频道映射ID已存在: {mapping['id']}")
-            
-            # 设置默认值
-            mapping.setdefault('enabled', True)
-            mapping.setdefault('description', '')
-            mapping.setdefault('settings', {})
-            
-            # 添加到列表
-            self.channel_mappings.append(mapping)
-            
-            # 保存到文件
-            return self.save_channel_mappings()
+        async with self._mappings_update_lock:
+            try:
+                # 验证映射数据
+                required_fields = ['id', 'name', 'source_channel', 'target_channel']
+                for field in required_fields:
+                    if field not in mapping:
+                        raise ValueError(f"缺少必需字段: {field}")
+                
+                # 检查ID是否已存在
+                for existing in self.channel_mappings:
+                    if existing['id'] == mapping['id']:
+                        raise ValueError(f"频道映射ID已存在: {mapping['id']}")
+            except Exception as e:
+                print(f"❌ 添加频道映射失败: {e}")
+                return False
             
-        except Exception as e:
-            print(f"❌ 添加频道映射失败: {e}")
-            return False
+            # 设置默认值（不修改调用方传入的字典）
+            new_mapping = {'enabled': True, 'description': '', 'settings': {}, **mapping}
+            return await self.save_channel_mappings([*self.channel_mappings, new_mapping])
     
-    def remove_channel_mapping(self, mapping_id: str) -> bool:
+    async def remove_channel_mapping(self, mapping_id: str) -> bool:
         """删除频道映射"""
-        try:
-            # 查找并删除映射
-            for i, mapping in enumerate(self.channel_mappings):
-                if mapping['id'] == mapping_id:
-                    del self.channel_mappings[i]
-                    return self.save_channel_mappings()
-            
-            raise ValueError(f"找不到ID为 {mapping_id} 的频道映射")
-            
-        except Exception as e:
-            print(f"❌ 删除频道映射失败: {e}")
-            return False
\ No newline at end of file
+        async with self._mappings_update_lock:
+            channel_mappings = [mapping for mapping in self.channel_mappings if mapping['id'] != mapping_id]
+            if len(channel_mappings) == len(self.channel_mappings):
+                print(f"❌ 删除频道映射失败: 找不到ID为 {mapping_id} 的频道映射")
+                return False
+            return await self.save_channel_mappings(channel_mappings)
+    
+    async def set_channel_enabled(self, mapping_id: str, enabled: bool) -> bool:
+        """启用/禁用频道映射（替换为新的映射对象，正在处理的任务继续持有旧对象）"""
+        async with self._mappings_update_lock:
+            if not any(mapping['id'] == mapping_id for mapping in self.channel_mappings):
+                print(f"❌ 切换频道映射失败: 找不到ID为 {mapping_id} 的频道映射")
+                return False
+            channel_mappings = [
+                {**mapping, 'enabled': enabled} if mapping['id'] == mapping_id else mapping
+                for mapping in self.channel_mappings
+            ]
+            return await self.save_channel_mappings(channel_mappings)
\ No newline at end of file
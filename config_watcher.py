@@ -0,0 +1,131 @@
+"""
+频道配置热重载模块 - 监视 channels.json，变更后在线程中读取验证，再在事件循环上原子替换路由表
+优先使用 inotify（watchfiles），不可用时回退到 mtime 轮询
+"""
+
+import asyncio
+import logging
+from pathlib import Path
+from typing import Callable, Optional
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+logging.getLogger('watchfiles').setLevel(logging.WARNING)  # 每次文件变化都会打印INFO日志
+
+DEBOUNCE_SECONDS = 0.5  # 编辑器保存时可能连续触发多次事件，合并后再重新加载
+
+
+class ChannelsConfigWatcher:
+    """频道配置文件监视器"""
+
+    def __init__(self, config: Config, on_reload: Optional[Callable[[dict], None]] = None):
+        self.config = config
+        self.on_reload = on_reload
+        self.config_file = Path(config.channels_config_file).resolve()
+        self._task: Optional[asyncio.Task] = None
+        self._reload_lock = asyncio.Lock()
+        self._last_signature = self._file_signature()
+
+        # 统计信息
+        self.stats = {
+            'mode': None,
+            'reloads': 0,
+            'unchanged': 0,
+            'errors': 0,
+            'last_error': None,
+        }
+
+    def _file_signature(self):
+        try:
+            stat = self.config_file.stat()
+        except FileNotFoundError:
+            return None
+        return stat.st_mtime_ns, stat.st_size, stat.st_ino
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._watch())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _watch(self):
+        try:
+            import watchfiles
+        except ImportError:
+            watchfiles = None
+
+        if watchfiles is not None:
+            try:
+                await self._watch_inotify(watchfiles)
+            except Exception as e:
+                logger.warning(f"⚠️ inotify 监视失败，回退到轮询检查: {e}")
+        await self._watch_polling()
+
+    async def _watch_inotify(self, watchfiles):
+        self.stats['mode'] = 'inotify'
+        logger.info(f"👀 监视频道配置文件（inotify）: {self.config_file}")
+        # 监视所在目录：编辑器通常通过 rename 替换文件，直接监视文件会丢失后续事件
+        async for changes in watchfiles.awatch(
+            self.config_file.parent, recursive=False, debounce=int(DEBOUNCE_SECONDS * 1000)
+        ):
+            if any(Path(path) == self.config_file for _, path in changes):
+                await self.reload()
+
+    async def _watch_polling(self):
+        self.stats['mode'] = 'polling'
+        logger.info(f"👀 监视频道配置文件（每 {self.config.channels_reload_interval}s 检查）: {self.config_file}")
+        while True:
+            await asyncio.sleep(self.config.channels_reload_interval)
+            if self._file_signature() != self._last_signature:
+                await asyncio.sleep(DEBOUNCE_SECONDS)
+                await self.reload()
+
+    async def reload(self) -> Optional[dict]:
+        """重新加载配置文件；验证失败时保留当前配置，返回变更摘要或 None"""
+        async with self._reload_lock:
+            self._last_signature = self._file_signature()
+            if self._last_signature is None:
+                logger.warning(f"⚠️ 频道配置文件不存在，保留当前配置: {self.config_file}")
+                return None
+
+            try:
+                # 读取和验证在线程中完成，不阻塞事件循环
+                channel_mappings, global_settings = await asyncio.to_thread(self.config.read_channels_file)
+            except ValueError as e:
+                self.stats['errors'] += 1
+                self.stats['last_error'] = str(e)
+                logger.error(f"❌ 频道配置重新加载失败，继续使用当前配置: {e}")
+                return None
+
+            self.stats['last_error'] = None
+            if channel_mappings == self.config.channel_mappings and global_settings == self.config.global_channel_settings:
+                self.stats['unchanged'] += 1
+                return None
+
+            changes = self.config.apply_channel_mappings(channel_mappings, global_settings)
+            self.stats['reloads'] += 1
+            logger.info(
+                f"🔄 频道配置已重新加载: {len(channel_mappings)} 个映射 "
+                f"(新增 {changes['added'] or '无'}, 删除 {changes['removed'] or '无'}, 修改 {changes['changed'] or '无'})"
+            )
+
+            if self.on_reload:
+                self.on_reload(changes)
+            return changes
+
+    def format_status(self) -> str:
+        """格式化监视状态（用于 /status）"""
+        if self.stats['mode'] is None:
+            return "未启动"
+        status = f"{self.stats['mode']}, 重新加载 {self.stats['reloads']} 次, 失败 {self.stats['errors']} 次"
+        if self.stats['last_error']:
+            status += f" (最近错误: {self.stats['last_error'][:80]})"
+        return status
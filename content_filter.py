@@ -0,0 +1,264 @@
+"""
+内容过滤模块 - 按频道映射 settings.filters 中的规则在下载之前跳过不需要的内容
+规则在加载配置时编译一次（所有关键词合并为一个正则），判断只使用消息中已有的元数据
+（文本、媒体类型、文件大小、时长、转发来源），不发起任何请求；每条规则统计命中次数和节省的下载流量
+"""
+
+import logging
+import re
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from telegram import Message
+
+logger = logging.getLogger(__name__)
+
+# 媒体类型（animation 的消息同时带有 document，先判断 animation）
+MEDIA_TYPES = ('photo', 'video', 'animation', 'document', 'audio', 'voice', 'video_note', 'sticker')
+TEXT_TYPE = 'text'
+
+# 规则按判断开销排序：先比较数字和类型，最后匹配文本
+RULE_FORWARDED = 'skip_forwarded'
+RULE_FORWARDED_FROM = 'exclude_forwarded_from'
+RULE_MEDIA_TYPES = 'media_types'
+RULE_EXCLUDE_MEDIA_TYPES = 'exclude_media_types'
+RULE_MIN_SIZE = 'min_size'
+RULE_MAX_SIZE = 'max_size'
+RULE_MIN_DURATION = 'min_duration'
+RULE_MAX_DURATION = 'max_duration'
+RULE_INCLUDE_KEYWORDS = 'include_keywords'
+RULE_EXCLUDE_KEYWORDS = 'exclude_keywords'
+
+TEXT_RULES = (RULE_INCLUDE_KEYWORDS, RULE_EXCLUDE_KEYWORDS)
+KNOWN_RULES = (
+    RULE_FORWARDED, RULE_FORWARDED_FROM, RULE_MEDIA_TYPES, RULE_EXCLUDE_MEDIA_TYPES, RULE_MIN_SIZE, RULE_MAX_SIZE,
+    RULE_MIN_DURATION, RULE_MAX_DURATION,
+) + TEXT_RULES
+
+REGEX_PREFIX = 're:'  # 以 re: 开头的关键词按正则表达式匹配，其余按字面匹配
+
+
+def _parse_size(value) -> int:
+    """文件大小：字节数或 "500KB" / "20MB" / "2GB" """
+    if isinstance(value, bool):
+        raise ValueError(f"文件大小格式错误: {value!r}")
+    if isinstance(value, (int, float)):
+        return int(value)
+    text = str(value).upper().strip()
+    try:
+        for suffix, factor in (('KB', 1024), ('MB', 1024 ** 2), ('GB', 1024 ** 3)):
+            if text.endswith(suffix):
+                return int(float(text[:-2]) * factor)
+        return int(text)
+    except ValueError:
+        raise ValueError(f"文件大小格式错误: {value!r}")
+
+
+def _compile_keywords(keywords) -> Optional[re.Pattern]:
+    """所有关键词合并为一个不区分大小写的正则（一次扫描文本）"""
+    if not keywords:
+        return None
+    if not isinstance(keywords, list) or not all(isinstance(keyword, str) and keyword for keyword in keywords):
+        raise ValueError(f"关键词必须是非空字符串列表: {keywords!r}")
+    literals = sorted({keyword for keyword in keywords if not keyword.startswith(REGEX_PREFIX)}, key=len, reverse=True)
+    patterns = [keyword[len(REGEX_PREFIX):] for keyword in keywords if keyword.startswith(REGEX_PREFIX)]
+    alternatives = [re.escape(literal) for literal in literals] + [f"(?:{pattern})" for pattern in patterns]
+    try:
+        return re.compile('|'.join(alternatives), re.IGNORECASE)
+    except re.error as e:
+        raise ValueError(f"关键词正则表达式错误: {e}")
+
+
+def _media_types(value, name: str) -> Optional[frozenset]:
+    if value is None:
+        return None
+    if not isinstance(value, list) or not value:
+        raise ValueError(f"{name} 必须是非空列表: {value!r}")
+    unknown = [media_type for media_type in value if media_type not in MEDIA_TYPES + (TEXT_TYPE,)]
+    if unknown:
+        raise ValueError(f"{name} 中有未知的媒体类型: {', '.join(map(str, unknown))}（可选: {', '.join(MEDIA_TYPES + (TEXT_TYPE,))}）")
+    return frozenset(value)
+
+
+def message_media(message: Message) -> Tuple[str, int, Optional[int]]:
+    """消息的媒体类型、文件大小（照片取最大尺寸）和时长；没有媒体时为 ('text', 0, None)"""
+    for media_type in MEDIA_TYPES:
+        media = getattr(message, media_type)
+        if not media:
+            continue
+        if media_type == 'photo':
+            return media_type, max(photo.file_size or 0 for photo in media), None
+        return media_type, media.file_size or 0, getattr(media, 'duration', None)
+    return TEXT_TYPE, 0, None
+
+
+def _forward_sources(message: Message) -> List[str]:
+    """转发来源的各种写法（@用户名、数字ID）"""
+    sources = []
+    for chat in (message.forward_from_chat, message.forward_from):
+        if chat is None:
+            continue
+        sources.append(str(chat.id))
+        if chat.username:
+            sources.append(f"@{chat.username.lower()}")
+    return sources
+
+
+class CompiledFilter:
+    """一个频道映射编译后的过滤规则"""
+
+    __slots__ = (
+        'rules', 'skip_forwarded', 'exclude_forwarded_from', 'media_types', 'exclude_media_types',
+        'min_size', 'max_size', 'min_duration', 'max_duration', 'include_keywords', 'exclude_keywords',
+    )
+
+    def __init__(self, rules: dict):
+        if not isinstance(rules, dict):
+            raise ValueError(f"filters 必须是对象: {rules!r}")
+        unknown = [name for name in rules if name not in KNOWN_RULES]
+        if unknown:
+            raise ValueError(f"未知的过滤规则: {', '.join(unknown)}（可选: {', '.join(KNOWN_RULES)}）")
+        self.rules = rules
+        self.skip_forwarded = bool(rules.get(RULE_FORWARDED, False))
+        forwarded_from = rules.get(RULE_FORWARDED_FROM) or []
+        if not isinstance(forwarded_from, list):
+            raise ValueError(f"{RULE_FORWARDED_FROM} 必须是列表: {forwarded_from!r}")
+        self.exclude_forwarded_from = frozenset(
+            str(source).lower() if str(source).startswith('@') else str(source) for source in forwarded_from
+        )
+        self.media_types = _media_types(rules.get(RULE_MEDIA_TYPES), RULE_MEDIA_TYPES)
+        self.exclude_media_types = _media_types(rules.get(RULE_EXCLUDE_MEDIA_TYPES), RULE_EXCLUDE_MEDIA_TYPES)
+        self.min_size = _parse_size(rules[RULE_MIN_SIZE]) if rules.get(RULE_MIN_SIZE) is not None else None
+        self.max_size = _parse_size(rules[RULE_MAX_SIZE]) if rules.get(RULE_MAX_SIZE) is not None else None
+        self.min_duration = rules.get(RULE_MIN_DURATION)
+        self.max_duration = rules.get(RULE_MAX_DURATION)
+        for name, value in ((RULE_MIN_SIZE, self.min_size), (RULE_MAX_SIZE, self.max_size),
+                            (RULE_MIN_DURATION, self.min_duration), (RULE_MAX_DURATION, self.max_duration)):
+            if value is not None and (isinstance(value, bool) or not isinstance(value, (int, float)) or value < 0):
+                raise ValueError(f"{name} 必须是非负数: {value!r}")
+        self.include_keywords = _compile_keywords(rules.get(RULE_INCLUDE_KEYWORDS))
+        self.exclude_keywords = _compile_keywords(rules.get(RULE_EXCLUDE_KEYWORDS))
+
+    def check_message(self, message: Message, check_text: bool = True) -> Optional[str]:
+        """返回第一条不通过的规则名，全部通过时返回 None"""
+        if self.skip_forwarded or self.exclude_forwarded_from:
+            if message.forward_date is not None:
+                if self.skip_forwarded:
+                    return RULE_FORWARDED
+                if self.exclude_forwarded_from.intersection(_forward_sources(message)):
+                    return RULE_FORWARDED_FROM
+
+        media_type, size, duration = message_media(message)
+        if self.media_types is not None and media_type not in self.media_types:
+            return RULE_MEDIA_TYPES
+        if self.exclude_media_types is not None and media_type in self.exclude_media_types:
+            return RULE_EXCLUDE_MEDIA_TYPES
+        # 大小/时长未知（为0或没有）的文件不按大小/时长过滤
+        if size:
+            if self.min_size is not None and size < self.min_size:
+                return RULE_MIN_SIZE
+            if self.max_size is not None and size > self.max_size:
+                return RULE_MAX_SIZE
+        if duration is not None:
+            if self.min_duration is not None and duration < self.min_duration:
+                return RULE_MIN_DURATION
+            if self.max_duration is not None and duration > self.max_duration:
+                return RULE_MAX_DURATION
+
+        if check_text:
+            return self.check_text(message.text or message.caption or '')
+        return None
+
+    def check_text(self, text: str) -> Optional[str]:
+        if self.include_keywords is not None and not self.include_keywords.search(text):
+            return RULE_INCLUDE_KEYWORDS
+        if self.exclude_keywords is not None and self.exclude_keywords.search(text):
+            return RULE_EXCLUDE_KEYWORDS
+        return None
+
+    def describe(self) -> str:
+        """规则摘要（用于 /list_channels）"""
+        return ", ".join(
+            f"{name}={value}" for name, value in self.rules.items()
+            if value not in (None, [], False)
+        ) or "无"
+
+
+class ContentFilters:
+    """所有频道映射的过滤规则（按映射ID缓存编译结果，配置热重载后自动重新编译）和命中统计"""
+
+    def __init__(self):
+        self._compiled: Dict[str, Tuple[dict, CompiledFilter]] = {}
+        # 映射ID -> 规则名 -> {'hits': 次数, 'bytes': 节省的下载字节数}
+        self.stats: Dict[str, Dict[str, dict]] = {}
+
+    def get(self, channel_mapping: Optional[dict]) -> Optional[CompiledFilter]:
+        if not channel_mapping:
+            return None
+        rules = channel_mapping.get('settings', {}).get('filters')
+        if not rules:
+            return None
+        cached = self._compiled.get(channel_mapping['id'])
+        if cached is None or cached[0] is not rules:
+            cached = (rules, CompiledFilter(rules))  # 配置加载时已验证过
+            self._compiled[channel_mapping['id']] = cached
+        return cached[1]
+
+    def check_message(self, message: Message, channel_mapping: Optional[dict], check_text: bool = True) -> Optional[str]:
+        """判断一条消息，不通过时记录命中统计并返回规则名"""
+        compiled = self.get(channel_mapping)
+        if compiled is None:
+            return None
+        rule = compiled.check_message(message, check_text)
+        if rule:
+            self.record(channel_mapping['id'], rule, message_media(message)[1])
+        return rule
+
+    def check_text(self, text: str, channel_mapping: Optional[dict], skipped_bytes: int = 0) -> Optional[str]:
+        """判断媒体组的caption（整个媒体组收集完成后），不通过时记录命中统计"""
+        compiled = self.get(channel_mapping)
+        if compiled is None:
+            return None
+        rule = compiled.check_text(text)
+        if rule:
+            self.record(channel_mapping['id'], rule, skipped_bytes)
+        return rule
+
+    def record(self, mapping_id: str, rule: str, skipped_bytes: int):
+        counters = self.stats.setdefault(mapping_id, {}).setdefault(rule, {'hits': 0, 'bytes': 0})
+        counters['hits'] += 1
+        counters['bytes'] += skipped_bytes
+
+    def add_bytes(self, mapping_id: str, rule: str, skipped_bytes: int):
+        """媒体组整体被跳过时补充已收集文件的大小（不增加命中次数）"""
+        counters = self.stats.get(mapping_id, {}).get(rule)
+        if counters is not None:
+            counters['bytes'] += skipped_bytes
+
+    @staticmethod
+    def _format_rules(rules: Iterable[Tuple[str, dict]]) -> str:
+        return ", ".join(
+            f"{rule} {counters['hits']}次/{counters['bytes'] / 1024 / 1024:.1f}MB"
+            for rule, counters in sorted(rules, key=lambda entry: entry[1]['bytes'], reverse=True)
+        )
+
+    def format_mapping(self, channel_mapping: dict) -> str:
+        """一个映射的规则和命中统计（用于 /list_channels）"""
+        compiled = self.get(channel_mapping)
+        if compiled is None:
+            return "无"
+        hits = self.stats.get(channel_mapping['id'])
+        return compiled.describe() + (f"; 命中: {self._format_rules(hits.items())}" if hits else "")
+
+    def format_status(self) -> str:
+        """格式化统计（用于 /status）"""
+        totals: Dict[str, dict] = {}
+        for rules in self.stats.values():
+            for rule, counters in rules.items():
+                total = totals.setdefault(rule, {'hits': 0, 'bytes': 0})
+                total['hits'] += counters['hits']
+                total['bytes'] += counters['bytes']
+        if not totals:
+            return "未跳过任何内容"
+        hits = sum(total['hits'] for total in totals.values())
+        saved = sum(total['bytes'] for total in totals.values())
+        return f"跳过 {hits} 条, 节省下载 {saved / 1024 / 1024:.1f}MB ({self._format_rules(totals.items())})"
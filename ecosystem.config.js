@@ -21,7 +21,7 @@ module.exports = {
     restart_delay: 5000,
     max_restarts: 10,
     min_uptime: '10s',
-    kill_timeout: 5000,
+    kill_timeout: 75000,  // 留出 SHUTDOWN_DRAIN_TIMEOUT 排空时间
     wait_ready: true,
     listen_timeout: 10000
   }]
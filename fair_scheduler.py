@@ -0,0 +1,225 @@
+"""
+公平调度模块 - 在频道映射之间按加权差额轮询（Deficit Round Robin）分配下载处理名额
+限制同时处理的映射数量（global_settings.max_concurrent_channels）和单个映射的并发数，
+避免消息量很大的源频道占满全部下载能力，让消息少的映射保持低延迟
+"""
+
+import asyncio
+import logging
+import math
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAPPING = 'default'       # 单频道模式下的映射ID
+QUANTUM_BYTES = 1024 * 1024       # 每轮为权重1的映射增加的额度
+MIN_COST = 256 * 1024             # 纯文本和很小的文件按此成本计算
+
+
+class FairScheduler:
+    """按映射排队的加权公平调度器"""
+
+    def __init__(self, total_slots: int):
+        self.total_slots = total_slots
+        self.max_active_mappings = 0  # 0=不限制，由 update_limits 从全局设置更新
+        self._in_flight = 0
+        # {mapping_id: {'weight', 'max_concurrent', 'deficit', 'in_flight',
+        #               'waiters': deque[(cost, 入队时间, Future, ticket, 优先)], stats...}}
+        self._mappings: Dict[str, dict] = {}
+        self._round: deque = deque()  # 有等待任务的映射（轮询顺序）
+        self._turn_granted = False    # 队首映射本轮是否已获得额度
+
+    def update_limits(self, global_settings: dict):
+        """从频道全局设置读取同时处理的映射数量上限（配置热重载后调用）"""
+        self.max_active_mappings = int(global_settings.get('max_concurrent_channels') or 0)
+        self._dispatch()
+
+    def _get_mapping(self, mapping_id: str) -> dict:
+        state = self._mappings.get(mapping_id)
+        if state is None:
+            state = {
+                'weight': 1.0,
+                'max_concurrent': 0,   # 0=不限制
+                'deficit': 0.0,
+                'in_flight': 0,
+                'waiters': deque(),
+                'completed': 0,
+                'total_wait': 0.0,
+                'max_wait': 0.0,
+            }
+            self._mappings[mapping_id] = state
+        return state
+
+    @staticmethod
+    def estimate_cost(media_infos: List[dict]) -> int:
+        """按文件总大小估算处理成本"""
+        return max(MIN_COST, sum(media_info['file_size'] for media_info in media_infos))
+
+    def _active_mappings(self) -> int:
+        return sum(1 for state in self._mappings.values() if state['in_flight'])
+
+    def _can_start(self, state: dict) -> bool:
+        if self._in_flight >= self.total_slots:
+            return False
+        if state['max_concurrent'] and state['in_flight'] >= state['max_concurrent']:
+            return False
+        if not state['in_flight'] and self.max_active_mappings and self._active_mappings() >= self.max_active_mappings:
+            return False
+        return True
+
+    def _eligible(self) -> List[str]:
+        """清理已取消的等待者，返回当前可以开始任务的映射"""
+        eligible = []
+        for mapping_id in list(self._round):
+            state = self._mappings[mapping_id]
+            while state['waiters'] and state['waiters'][0][2].done():
+                state['waiters'].popleft()
+            if not state['waiters']:
+                self._round.remove(mapping_id)
+                state['deficit'] = 0.0
+            elif self._can_start(state):
+                eligible.append(mapping_id)
+        return eligible
+
+    def _skip_idle_rounds(self, eligible: List[str]):
+        """大文件需要多轮积累额度：直接补齐空转的轮次，而不是逐轮循环"""
+        rounds = min(
+            math.ceil((self._mappings[mapping_id]['waiters'][0][0] - self._mappings[mapping_id]['deficit'])
+                      / (QUANTUM_BYTES * self._mappings[mapping_id]['weight']))
+            for mapping_id in eligible
+        )
+        if rounds > 1:
+            for mapping_id in eligible:
+                state = self._mappings[mapping_id]
+                state['deficit'] += (rounds - 1) * QUANTUM_BYTES * state['weight']
+
+    @staticmethod
+    def _insert_priority(waiters: deque, waiter: tuple):
+        """优先的等待者排在队首（在已有的优先等待者之后）"""
+        index = 0
+        while index < len(waiters) and waiters[index][4]:
+            index += 1
+        waiters.insert(index, waiter)
+
+    def _grant(self, mapping_id: str, state: dict):
+        cost, enqueued, future, _, _ = state['waiters'].popleft()
+        if not state['waiters']:
+            # 队列清空后不保留额度（标准DRR），避免空闲映射积累突发额度
+            if self._round[0] == mapping_id:
+                self._turn_granted = False
+            self._round.remove(mapping_id)
+            state['deficit'] = 0.0
+        state['in_flight'] += 1
+        self._in_flight += 1
+        future.set_result(time.monotonic() - enqueued)
+
+    def _dispatch(self):
+        """有空闲名额时按差额轮询选出下一个任务（提升优先级的任务直接分配，不消耗额度）"""
+        while self._in_flight < self.total_slots:
+            eligible = self._eligible()
+            if not eligible:
+                return
+            bumped = next((mapping_id for mapping_id in eligible if self._mappings[mapping_id]['waiters'][0][4]), None)
+            if bumped is not None:
+                self._grant(bumped, self._mappings[bumped])
+                continue
+            self._skip_idle_rounds(eligible)
+
+            mapping_id = self._round[0]
+            state = self._mappings[mapping_id]
+            if mapping_id not in eligible:
+                self._round.rotate(-1)
+                self._turn_granted = False
+                continue
+            if not self._turn_granted:
+                # 轮到该映射：增加一份额度
+                state['deficit'] += QUANTUM_BYTES * state['weight']
+                self._turn_granted = True
+
+            cost = state['waiters'][0][0]
+            if state['deficit'] < cost:
+                self._round.rotate(-1)
+                self._turn_granted = False
+                continue
+
+            state['deficit'] -= cost
+            self._grant(mapping_id, state)
+
+    @asynccontextmanager
+    async def slot(self, mapping_id: Optional[str], cost: int, settings: Optional[dict] = None,
+                   ticket=None, priority: bool = False):
+        """为映射占用一个处理名额；settings 中的 weight / max_concurrent 控制该映射的份额
+
+        ticket 标识等待者所属的任务（bump 时查找），priority 为 True 时排在映射队首并优先分配。
+        """
+        mapping_id = mapping_id or DEFAULT_MAPPING
+        state = self._get_mapping(mapping_id)
+        settings = settings or {}
+        state['weight'] = max(0.1, float(settings.get('weight', 1.0)))
+        state['max_concurrent'] = int(settings.get('max_concurrent', 0))
+
+        future = asyncio.get_running_loop().create_future()
+        waiter = (cost, time.monotonic(), future, ticket, priority)
+        if priority:
+            self._insert_priority(state['waiters'], waiter)
+        else:
+            state['waiters'].append(waiter)
+        if mapping_id not in self._round:
+            self._round.append(mapping_id)
+        self._dispatch()
+
+        try:
+            waited = await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self._finish(state)
+            raise
+
+        state['total_wait'] += waited
+        state['max_wait'] = max(state['max_wait'], waited)
+        if waited > 5:
+            logger.info(f"⚖️ 映射 {mapping_id} 的任务等待 {waited:.1f}s 后开始处理（公平调度）")
+        try:
+            yield
+        finally:
+            state['completed'] += 1
+            self._finish(state)
+
+    def bump(self, ticket) -> int:
+        """提升任务的优先级：它的等待者移到所属映射队首，下一个空闲名额直接分配；返回找到的等待者数量"""
+        found = 0
+        for state in self._mappings.values():
+            waiters = [waiter for waiter in state['waiters'] if waiter[3] is ticket and not waiter[2].done()]
+            for waiter in waiters:
+                state['waiters'].remove(waiter)
+                self._insert_priority(state['waiters'], waiter[:4] + (True,))
+            found += len(waiters)
+        if found:
+            self._dispatch()
+        return found
+
+    def _finish(self, state: dict):
+        state['in_flight'] -= 1
+        self._in_flight -= 1
+        self._dispatch()
+
+    def queue_depth(self, mapping_id: Optional[str]) -> dict:
+        """映射的排队/处理中任务数（用于 /list_channels）"""
+        state = self._mappings.get(mapping_id or DEFAULT_MAPPING)
+        if state is None:
+            return {'queued': 0, 'in_flight': 0, 'completed': 0, 'average_wait': 0.0}
+        queued = sum(1 for waiter in state['waiters'] if not waiter[2].done())
+        average_wait = state['total_wait'] / state['completed'] if state['completed'] else 0.0
+        return {'queued': queued, 'in_flight': state['in_flight'], 'completed': state['completed'], 'average_wait': average_wait}
+
+    def format_status(self) -> str:
+        """格式化调度状态（用于 /status）"""
+        queued = sum(self.queue_depth(mapping_id)['queued'] for mapping_id in self._mappings)
+        limit = self.max_active_mappings or '不限'
+        return (
+            f"处理中 {self._in_flight}/{self.total_slots}, 排队 {queued}, "
+            f"活跃映射 {self._active_mappings()}/{limit}"
+        )
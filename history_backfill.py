@@ -0,0 +1,601 @@
+"""
+历史消息回填模块 - 通过 MTProto 用户会话读取源频道历史并镜像到目标频道
+Bot API 无法读取频道历史，因此使用 API_ID/API_HASH 登录的用户会话（Telethon）获取历史消息，
+再通过现有发送路径（TelegramBotHandler.publish_*）以机器人身份发布。
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import random
+import sqlite3
+import sys
+import threading
+import time
+from collections import deque
+from pathlib import Path
+from typing import List, Optional, Dict
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+
+class HistoryMessage:
+    """历史消息（与具体客户端无关的精简表示）"""
+
+    __slots__ = ('chat', 'message_id', 'grouped_id', 'media_type', 'media_key',
+                 'file_size', 'file_name', 'text', 'date', 'raw')
+
+    def __init__(self, chat: str, message_id: int, grouped_id=None, media_type: str = 'text',
+                 media_key: Optional[str] = None, file_size: int = 0, file_name: Optional[str] = None,
+                 text: str = '', date: int = 0, raw=None):
+        self.chat = chat
+        self.message_id = message_id
+        self.grouped_id = grouped_id
+        self.media_type = media_type
+        self.media_key = media_key    # 媒体在服务器上的唯一标识（用于去重）
+        self.file_size = file_size
+        self.file_name = file_name
+        self.text = text
+        self.date = date
+        self.raw = raw                # 客户端原始消息对象（下载时使用）
+
+    @property
+    def content_key(self) -> str:
+        """内容去重键：媒体按服务器ID，纯文本按内容哈希"""
+        if self.media_key:
+            return f"{self.media_type}:{self.media_key}"
+        return "text:" + hashlib.sha1(self.text.encode('utf-8')).hexdigest()
+
+
+class HistoryProvider:
+    """历史消息来源接口"""
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+    async def get_latest_message_id(self, chat: str) -> int:
+        raise NotImplementedError
+
+    async def fetch_range(self, chat: str, min_id: int, max_id: int) -> List[HistoryMessage]:
+        """获取 [min_id, max_id] 范围内存在的消息（按ID升序）"""
+        raise NotImplementedError
+
+    async def download(self, message: HistoryMessage, file_path: Path) -> Optional[Path]:
+        raise NotImplementedError
+
+
+class TelethonHistoryProvider(HistoryProvider):
+    """基于 Telethon 用户会话的历史消息来源"""
+
+    def __init__(self, config: Config):
+        self.config = config
+        self.client = None
+        self._entities = {}
+
+    def _build_client(self):
+        try:
+            from telethon import TelegramClient
+        except ImportError:
+            raise RuntimeError("历史回填需要安装 telethon: pip install telethon")
+
+        if not self.config.api_id or not self.config.api_hash:
+            raise RuntimeError("历史回填需要设置 API_ID 和 API_HASH")
+
+        proxy = None
+        proxy_config = self.config.get_proxy_config()
+        if proxy_config:
+            proxy = {
+                'proxy_type': proxy_config['proxy_type'],
+                'addr': proxy_config['host'],
+                'port': int(proxy_config['port']),
+                'username': proxy_config.get('username'),
+                'password': proxy_config.get('password'),
+            }
+
+        return TelegramClient(self.config.backfill_session_path, int(self.config.api_id), self.config.api_hash, proxy=proxy)
+
+    async def login(self):
+        """交互式登录并保存用户会话（首次使用前运行一次）"""
+        self.client = self._build_client()
+        await self.client.start()
+        me = await self.client.get_me()
+        logger.info(f"✅ 用户会话已登录: {me.first_name} (@{me.username})，会话文件: {self.config.backfill_session_path}")
+        await self.client.disconnect()
+
+    async def start(self):
+        if self.client is not None:
+            return
+        self.client = self._build_client()
+        await self.client.connect()
+        if not await self.client.is_user_authorized():
+            await self.client.disconnect()
+            self.client = None
+            raise RuntimeError("用户会话未登录，请先运行: python history_backfill.py login")
+
+    async def stop(self):
+        if self.client is not None:
+            await self.client.disconnect()
+            self.client = None
+
+    async def _get_entity(self, chat: str):
+        if chat not in self._entities:
+            self._entities[chat] = await self.client.get_entity(chat if chat.startswith('@') else int(chat))
+        return self._entities[chat]
+
+    async def get_latest_message_id(self, chat: str) -> int:
+        entity = await self._get_entity(chat)
+        messages = await self.client.get_messages(entity, limit=1)
+        return messages[0].id if messages else 0
+
+    async def fetch_range(self, chat: str, min_id: int, max_id: int) -> List[HistoryMessage]:
+        entity = await self._get_entity(chat)
+
+        while True:
+            try:
+                messages = await self.client.get_messages(entity, ids=list(range(min_id, max_id + 1)))
+                break
+            except Exception as e:
+                # FloodWaitError: 按服务器要求等待后重试
+                wait_seconds = getattr(e, 'seconds', None)
+                if type(e).__name__ == 'FloodWaitError' and wait_seconds:
+                    logger.warning(f"🔄 获取历史消息遇到频率限制，{wait_seconds}秒后重试")
+                    await asyncio.sleep(wait_seconds)
+                    continue
+                raise
+
+        return [self._convert(chat, m) for m in messages if m is not None and not getattr(m, 'action', None)]
+
+    def _convert(self, chat: str, message) -> HistoryMessage:
+        media_type = 'text'
+        media_key = None
+
+        if message.photo:
+            media_type, media_key = 'photo', str(message.photo.id)
+        elif message.document:
+            media_key = str(message.document.id)
+            if message.video_note:
+                media_type = 'video_note'
+            elif message.gif:
+                media_type = 'animation'
+            elif message.sticker:
+                media_type = 'sticker'
+            elif message.voice:
+                media_type = 'voice'
+            elif message.audio:
+                media_type = 'audio'
+            elif message.video:
+                media_type = 'video'
+            else:
+                media_type = 'document'
+
+        file_size = 0
+        file_name = None
+        if media_key and message.file:
+            file_size = message.file.size or 0
+            file_name = message.file.name or f"{media_type}_{message.id}{message.file.ext or ''}"
+
+        return HistoryMessage(
+            chat=chat,
+            message_id=message.id,
+            grouped_id=message.grouped_id,
+            media_type=media_type,
+            media_key=media_key,
+            file_size=file_size,
+            file_name=file_name,
+            text=message.message or '',
+            date=int(message.date.timestamp()) if message.date else 0,
+            raw=message
+        )
+
+    async def download(self, message: HistoryMessage, file_path: Path) -> Optional[Path]:
+        result = await self.client.download_media(message.raw, file=str(file_path))
+        return Path(result) if result else None
+
+
+class FakeHistoryProvider(HistoryProvider):
+    """本地假历史来源（用于测试和压测，不访问Telegram）
+
+    JSON格式: {"chats": {"@source": [{"id": 1, "type": "photo", "text": "...", "size": 1024,
+                                     "grouped_id": null, "date": 1700000000}]}}
+    """
+
+    def __init__(self, history_file: str, latency: float = 0.0, bandwidth: float = 0.0):
+        self.history_file = Path(history_file)
+        self.latency = latency        # 秒 - 每次请求的模拟延迟
+        self.bandwidth = bandwidth    # 字节/秒 - 模拟下载带宽（0表示不限速）
+        self._chats: Dict[str, List[HistoryMessage]] = {}
+
+    async def start(self):
+        with open(self.history_file, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+
+        for chat, items in data.get('chats', {}).items():
+            messages = []
+            for item in items:
+                media_type = item.get('type', 'text')
+                messages.append(HistoryMessage(
+                    chat=chat,
+                    message_id=int(item['id']),
+                    grouped_id=item.get('grouped_id'),
+                    media_type=media_type,
+                    media_key=item.get('media_key') or (f"fake-{chat}-{item['id']}" if media_type != 'text' else None),
+                    file_size=int(item.get('size', 0)),
+                    file_name=item.get('file_name') or f"{media_type}_{item['id']}",
+                    text=item.get('text', ''),
+                    date=int(item.get('date', 0))
+                ))
+            self._chats[chat] = sorted(messages, key=lambda m: m.message_id)
+
+    async def get_latest_message_id(self, chat: str) -> int:
+        await asyncio.sleep(self.latency)
+        messages = self._chats.get(chat, [])
+        return messages[-1].message_id if messages else 0
+
+    async def fetch_range(self, chat: str, min_id: int, max_id: int) -> List[HistoryMessage]:
+        await asyncio.sleep(self.latency)
+        return [m for m in self._chats.get(chat, []) if min_id <= m.message_id <= max_id]
+
+    async def download(self, message: HistoryMessage, file_path: Path) -> Optional[Path]:
+        await asyncio.sleep(self.latency)
+        if self.bandwidth > 0:
+            await asyncio.sleep(message.file_size / self.bandwidth)
+        with open(file_path, 'wb') as f:
+            f.write(b'\0' * max(message.file_size, 1))
+        return file_path
+
+
+def create_history_provider(config: Config) -> HistoryProvider:
+    """根据配置创建历史消息来源"""
+    if config.backfill_provider == 'fake':
+        return FakeHistoryProvider(config.backfill_fake_history_file)
+    return TelethonHistoryProvider(config)
+
+
+class BackfillState:
+    """回填检查点与已镜像内容（SQLite持久化，支持断点续传和去重）"""
+
+    def __init__(self, db_path: str):
+        Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS checkpoints (
+                mapping_id TEXT PRIMARY KEY,
+                source TEXT NOT NULL,
+                last_id INTEGER NOT NULL,
+                end_id INTEGER NOT NULL,
+                updated INTEGER NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS mirrored (
+                mapping_id TEXT NOT NULL,
+                content_key TEXT NOT NULL,
+                source_message_id INTEGER NOT NULL,
+                PRIMARY KEY (mapping_id, content_key)
+            );
+        """)
+        self._conn.commit()
+
+    def get_checkpoint(self, mapping_id: str) -> Optional[dict]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT source, last_id, end_id FROM checkpoints WHERE mapping_id = ?", (mapping_id,)
+            ).fetchone()
+        return {'source': row[0], 'last_id': row[1], 'end_id': row[2]} if row else None
+
+    def save_checkpoint(self, mapping_id: str, source: str, last_id: int, end_id: int):
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO checkpoints (mapping_id, source, last_id, end_id, updated) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT (mapping_id) DO UPDATE SET source = excluded.source, last_id = excluded.last_id, "
+                "end_id = excluded.end_id, updated = excluded.updated",
+                (mapping_id, source, last_id, end_id, int(time.time()))
+            )
+            self._conn.commit()
+
+    def clear_checkpoint(self, mapping_id: str):
+        with self._lock:
+            self._conn.execute("DELETE FROM checkpoints WHERE mapping_id = ?", (mapping_id,))
+            self._conn.commit()
+
+    def is_mirrored(self, mapping_id: str, content_key: str) -> bool:
+        with self._lock:
+            return self._conn.execute(
+                "SELECT 1 FROM mirrored WHERE mapping_id = ? AND content_key = ?", (mapping_id, content_key)
+            ).fetchone() is not None
+
+    def mark_mirrored(self, mapping_id: str, items: List[HistoryMessage]):
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO mirrored (mapping_id, content_key, source_message_id) VALUES (?, ?, ?)",
+                [(mapping_id, item.content_key, item.message_id) for item in items]
+            )
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class BackfillEngine:
+    """历史回填引擎：分页并行获取、按顺序发布、检查点续传、内容去重、速率控制"""
+
+    def __init__(self, config: Config, provider: HistoryProvider, bot_handler, state: BackfillState,
+                 message_map=None, chat_cache=None):
+        self.config = config
+        self.provider = provider
+        self.bot_handler = bot_handler
+        self.state = state
+        self.message_map = message_map  # 实时转发的发布记录（去重时一并检查）
+        self.chat_cache = chat_cache  # 源频道引用 -> 数字ID（查询消息映射使用）
+        self.download_path = Path(config.download_path)
+
+        self.page_size = config.backfill_page_size
+        self.fetch_concurrency = config.backfill_fetch_concurrency
+        self.min_publish_interval = 60.0 / config.backfill_max_per_minute
+        self._last_publish_time = 0.0
+
+        self.jobs: Dict[str, dict] = {}  # {mapping_id: 运行状态}
+        self._provider_started = False
+
+    async def _ensure_provider(self):
+        if not self._provider_started:
+            await self.provider.start()
+            self._provider_started = True
+
+    async def stop(self):
+        for job in self.jobs.values():
+            job['stop_requested'] = True
+        if self._provider_started:
+            await self.provider.stop()
+            self._provider_started = False
+
+    def is_running(self, mapping_id: str) -> bool:
+        job = self.jobs.get(mapping_id)
+        return bool(job and job['status'] == 'running')
+
+    def request_stop(self, mapping_id: str) -> bool:
+        job = self.jobs.get(mapping_id)
+        if not job or job['status'] != 'running':
+            return False
+        job['stop_requested'] = True
+        return True
+
+    async def run(self, channel_mapping: dict, bot, start_id: Optional[int] = None,
+                  end_id: Optional[int] = None, send_lock=None) -> dict:
+        """回填一个频道映射的历史消息（从检查点继续，或从 start_id 开始）"""
+        mapping_id = channel_mapping['id']
+        source = channel_mapping['source_channel']
+
+        if self.is_running(mapping_id):
+            raise RuntimeError(f"映射 {mapping_id} 的回填任务已在运行")
+
+        await self._ensure_provider()
+
+        checkpoint = self.state.get_checkpoint(mapping_id)
+        if start_id is None and checkpoint and checkpoint['source'] == source:
+            start_id = checkpoint['last_id'] + 1
+            end_id = end_id or checkpoint['end_id']
+            logger.info(f"📌 映射 {mapping_id} 从检查点继续回填: 消息 {start_id} -> {end_id}")
+        start_id = start_id or 1
+        end_id = end_id or await self.provider.get_latest_message_id(source)
+
+        job = {
+            'mapping_id': mapping_id,
+            'source': source,
+            'status': 'running',
+            'start_id': start_id,
+            'end_id': end_id,
+            'last_id': start_id - 1,
+            'fetched': 0,
+            'published': 0,
+            'skipped': 0,
+            'failed': 0,
+            'first_failed_id': None,
+            'started': time.time(),
+            'stop_requested': False,
+        }
+        self.jobs[mapping_id] = job
+
+        pages = deque((lo, min(lo + self.page_size - 1, end_id)) for lo in range(start_id, end_id + 1, self.page_size))
+        window = deque()
+
+        def schedule_fetches():
+            # 保持固定数量的分页请求并行进行
+            while pages and len(window) < self.fetch_concurrency:
+                lo, hi = pages.popleft()
+                window.append((hi, asyncio.create_task(self.provider.fetch_range(source, lo, hi))))
+
+        logger.info(f"🚀 开始回填映射 {mapping_id}: {source} 消息 {start_id}-{end_id}，共 {len(pages)} 页")
+
+        pending_group: List[HistoryMessage] = []
+        try:
+            schedule_fetches()
+            while window and not job['stop_requested']:
+                page_end, fetch_task = window.popleft()
+                page_messages = await fetch_task
+                schedule_fetches()
+                job['fetched'] += len(page_messages)
+
+                for item in page_messages:
+                    if job['stop_requested']:
+                        break
+                    if pending_group and item.grouped_id != pending_group[0].grouped_id:
+                        await self._mirror_items(job, pending_group, channel_mapping, bot, send_lock)
+                        pending_group = []
+                    if item.grouped_id:
+                        pending_group.append(item)
+                    else:
+                        await self._mirror_items(job, [item], channel_mapping, bot, send_lock)
+
+                # 整页处理完且没有跨页相册、也没有失败的消息时，检查点推进到页尾（跳过空页）
+                if not pending_group and not job['stop_requested'] and job['first_failed_id'] is None:
+                    job['last_id'] = max(job['last_id'], page_end)
+                    self.state.save_checkpoint(mapping_id, source, job['last_id'], end_id)
+
+            if pending_group and not job['stop_requested']:
+                await self._mirror_items(job, pending_group, channel_mapping, bot, send_lock)
+
+            if job['stop_requested']:
+                job['status'] = 'stopped'
+                logger.info(f"⏹️ 映射 {mapping_id} 回填已停止于消息 {job['last_id']}，可稍后继续")
+            elif job['first_failed_id'] is not None:
+                # 保留检查点：再次运行 /backfill 从第一条失败的消息继续（已发布的消息按去重跳过）
+                job['status'] = 'completed'
+                logger.warning(f"⚠️ 映射 {mapping_id} 回填结束，{job['failed']} 条失败，检查点保留在消息 {job['last_id']}")
+            else:
+                job['status'] = 'completed'
+                self.state.clear_checkpoint(mapping_id)
+                logger.info(f"✅ 映射 {mapping_id} 回填完成: 发布 {job['published']}，去重跳过 {job['skipped']}，失败 {job['failed']}")
+
+        except Exception as e:
+            job['status'] = 'failed'
+            job['error'] = str(e)
+            logger.error(f"❌ 映射 {mapping_id} 回填失败（检查点: {job['last_id']}）: {e}")
+        finally:
+            for _, fetch_task in window:
+                fetch_task.cancel()
+            job['finished'] = time.time()
+
+        return job
+
+    async def mirror_messages(self, channel_mapping: dict, items: List[HistoryMessage], bot, send_lock=None) -> dict:
+        """镜像指定的历史消息（不使用检查点，用于随机下载等场景）"""
+        await self._ensure_provider()
+        job = {'mapping_id': channel_mapping['id'], 'source': channel_mapping['source_channel'], 'status': 'running',
+               'last_id': 0, 'fetched': len(items), 'published': 0, 'skipped': 0, 'failed': 0, 'first_failed_id': None,
+               'started': time.time(), 'stop_requested': False, 'transient': True}
+        for item in items:
+            await self._mirror_items(job, [item], channel_mapping, bot, send_lock)
+        job['status'] = 'completed'
+        return job
+
+    async def fetch_recent(self, chat: str, count: int) -> List[HistoryMessage]:
+        """获取最近 count 个消息ID范围内的消息"""
+        await self._ensure_provider()
+        latest = await self.provider.get_latest_message_id(chat)
+        return await self.provider.fetch_range(chat, max(1, latest - count + 1), latest)
+
+    async def _throttle(self):
+        """发布速率控制（每分钟最多 BACKFILL_MAX_PER_MINUTE 条）"""
+        wait = self._last_publish_time + self.min_publish_interval - time.monotonic()
+        if wait > 0:
+            await asyncio.sleep(wait)
+        self._last_publish_time = time.monotonic()
+
+    async def _mirror_items(self, job: dict, items: List[HistoryMessage], channel_mapping: dict, bot, send_lock=None):
+        """镜像一条消息或一个相册（回填过或实时转发过的消息跳过）；检查点只推进到连续成功的最后一条消息"""
+        mapping_id = channel_mapping['id']
+        new_items = [
+            item for item in items
+            if not self.state.is_mirrored(mapping_id, item.content_key) and not await self._already_published(item)
+        ]
+
+        if not new_items:
+            job['skipped'] += len(items)
+        else:
+            job['skipped'] += len(items) - len(new_items)
+            await self._throttle()
+
+            source_text = next((item.text for item in items if item.text), "")
+            downloaded_files = []
+            try:
+                media_items = [item for item in new_items if item.media_type != 'text']
+                if media_items:
+                    # 超过大小限制或无法下载（已删除、内容为空）的文件重试也不会成功：跳过，检查点照常推进
+                    unavailable = 0
+                    for item in media_items:
+                        if item.file_size > self.config.max_file_size:
+                            logger.warning(f"⚠️ 历史消息 {item.message_id} 文件超过大小限制，跳过")
+                            unavailable += 1
+                            continue
+                        file_path = self.download_path / f"backfill_{mapping_id}_{item.message_id}_{item.file_name or item.media_type}"
+                        result = await self.provider.download(item, file_path)
+                        if result and result.exists() and result.stat().st_size > 0:
+                            downloaded_files.append({'path': result, 'type': item.media_type})
+                        else:
+                            logger.warning(f"⚠️ 历史消息 {item.message_id} 的文件无法下载，跳过")
+                            unavailable += 1
+                    job['skipped'] += unavailable
+
+                    if downloaded_files:
+                        await self.bot_handler.publish_media(downloaded_files, source_text, bot, channel_mapping, send_lock=send_lock)
+                        job['published'] += 1
+                    else:
+                        logger.warning(f"⚠️ 历史消息 {items[0].chat}/{items[0].message_id} 没有可下载的媒体文件，跳过")
+                else:
+                    await self.bot_handler.publish_text(source_text, bot, channel_mapping)
+                    job['published'] += 1
+
+                self.state.mark_mirrored(mapping_id, new_items)
+
+            except Exception as e:
+                # 下载或发布出错（网络、频率限制等）可以重试：检查点停在这里
+                job['failed'] += 1
+                if job['first_failed_id'] is None:
+                    job['first_failed_id'] = items[0].message_id
+                logger.error(f"❌ 回填消息 {items[0].chat}/{items[0].message_id} 失败: {e}")
+            finally:
+                await self.bot_handler._cleanup_files(downloaded_files)
+
+        # 之前有失败的消息时检查点停在失败前，重新运行时从失败的消息继续
+        if job['first_failed_id'] is not None:
+            return
+        job['last_id'] = max(job['last_id'], max(item.message_id for item in items))
+        if not job.get('transient'):
+            self.state.save_checkpoint(mapping_id, job['source'], job['last_id'], job['end_id'])
+
+    async def _already_published(self, item: HistoryMessage) -> bool:
+        """实时转发已经发布过的源消息（消息映射中有记录）"""
+        if not self.message_map or not self.chat_cache:
+            return False
+        chat_id = self.chat_cache.resolve_id(item.chat)
+        return chat_id is not None and bool(await self.message_map.find_by_message(chat_id, item.message_id))
+
+    def format_status(self) -> str:
+        """格式化回填任务状态（用于 /backfill_status）"""
+        if not self.jobs:
+            return "📭 暂无回填任务"
+
+        lines = ["📚 历史回填任务"]
+        for job in self.jobs.values():
+            elapsed = (job.get('finished') or time.time()) - job['started']
+            rate = job['fetched'] / elapsed if elapsed > 0 else 0.0
+            total = max(job['end_id'] - job['start_id'] + 1, 1)
+            progress = (job['last_id'] - job['start_id'] + 1) / total * 100
+            lines.append(
+                f"• {job['mapping_id']} [{job['status']}] {job['source']}\n"
+                f"  进度: {job['last_id']}/{job['end_id']} ({max(progress, 0):.1f}%)\n"
+                f"  获取 {job['fetched']} 条 ({rate:.1f}/s)，发布 {job['published']}，"
+                f"去重 {job['skipped']}，失败 {job['failed']}"
+            )
+            if job.get('error'):
+                lines.append(f"  错误: {job['error']}")
+        return "\n".join(lines)
+
+
+def pick_random_media(items: List[HistoryMessage], count: int) -> List[HistoryMessage]:
+    """从历史消息中随机挑选 count 条媒体消息（按ID排序返回）"""
+    media_items = [item for item in items if item.media_type != 'text']
+    selected = random.sample(media_items, min(count, len(media_items)))
+    return sorted(selected, key=lambda item: item.message_id)
+
+
+async def _login():
+    from dotenv import load_dotenv
+    load_dotenv()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    await TelethonHistoryProvider(Config()).login()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == 'login':
+        asyncio.run(_login())
+    else:
+        print("用法: python history_backfill.py login  # 登录用户会话（回填历史消息需要）")
@@ -0,0 +1,336 @@
+"""
+HTTP连接池模块 - 按流量类型分离连接池
+长轮询、元数据请求、下载、上传各自使用独立的 httpx 连接池，避免大文件上传占满连接导致命令无响应
+每个连接池记录实测吞吐量；大块写入拆成小块，写入超时即为"没有数据传输"的停滞时间
+读写的字节数记到当前任务正在进行的传输上（transfer_progress）
+按路径上传的大文件（sendfile_upload.FileInputFile）由上传连接池流式发送，不读入内存
+"""
+
+import asyncio
+import importlib.util
+import logging
+import time
+from typing import Dict, Optional
+
+import httpcore
+import httpx
+import telegram
+from telegram.error import NetworkError, TimedOut
+from telegram.request import BaseRequest, HTTPXRequest, RequestData
+
+from sendfile_upload import MODE_CHUNKED, MODE_SENDFILE, MultipartBody, contains_file_inputs, sendfile_request, sendfile_supported
+from transfer_progress import mark_body_sent, record_bytes
+
+logger = logging.getLogger(__name__)
+
+# 流量类型
+TRAFFIC_POLL = 'poll'          # getUpdates 长轮询
+TRAFFIC_API = 'api'            # get_file / get_chat / send_message 等小请求
+TRAFFIC_DOWNLOAD = 'download'  # 文件下载
+TRAFFIC_UPLOAD = 'upload'      # 带文件的 send* 请求
+
+
+WRITE_CHUNK_SIZE = 256 * 1024      # 单次socket写入的最大字节数
+MIN_THROUGHPUT_SAMPLE = 64 * 1024  # 小于此大小的请求不计入吞吐量（主要是延迟）
+
+
+class _ChunkedWriteStream(httpcore.AsyncNetworkStream):
+    """把一次大写入拆成多次小写入：httpcore 的写入超时作用于每一块，相当于停滞检测"""
+
+    def __init__(self, stream: httpcore.AsyncNetworkStream):
+        self._stream = stream
+
+    async def read(self, max_bytes: int, timeout: Optional[float] = None) -> bytes:
+        # HTTP/1.1 写完请求体才读取响应；HTTP/2 写入过程中也会读取（按已发出处理，宁可不重试）
+        mark_body_sent()
+        data = await self._stream.read(max_bytes, timeout)
+        record_bytes(len(data))
+        return data
+
+    async def write(self, buffer: bytes, timeout: Optional[float] = None) -> None:
+        view = memoryview(buffer)
+        for offset in range(0, len(view), WRITE_CHUNK_SIZE):
+            chunk = view[offset:offset + WRITE_CHUNK_SIZE]
+            await self._stream.write(chunk, timeout)
+            record_bytes(len(chunk))
+
+    async def aclose(self) -> None:
+        await self._stream.aclose()
+
+    async def start_tls(self, ssl_context, server_hostname: Optional[str] = None,
+                        timeout: Optional[float] = None) -> httpcore.AsyncNetworkStream:
+        return _ChunkedWriteStream(await self._stream.start_tls(ssl_context, server_hostname, timeout))
+
+    def get_extra_info(self, info: str):
+        return self._stream.get_extra_info(info)
+
+
+class _ChunkedWriteBackend(httpcore.AsyncNetworkBackend):
+    def __init__(self, backend: httpcore.AsyncNetworkBackend):
+        self._backend = backend
+
+    async def connect_tcp(self, host, port, timeout=None, local_address=None, socket_options=None):
+        return _ChunkedWriteStream(await self._backend.connect_tcp(host, port, timeout, local_address, socket_options))
+
+    async def connect_unix_socket(self, path, timeout=None, socket_options=None):
+        return _ChunkedWriteStream(await self._backend.connect_unix_socket(path, timeout, socket_options))
+
+    async def sleep(self, seconds: float) -> None:
+        await self._backend.sleep(seconds)
+
+
+class UnsupportedHTTPStack(RuntimeError):
+    """python-telegram-bot / httpx 的内部结构与已验证的版本不一致"""
+
+    def __init__(self, detail: str):
+        super().__init__(
+            f"{detail}（python-telegram-bot {telegram.__version__}, httpx {httpx.__version__}；"
+            f"连接池分离和上传停滞检测依赖 requirements.txt 中固定的版本）"
+        )
+
+
+def _check_request_internals(request: HTTPXRequest):
+    """启动时检查 HTTPXRequest 的内部接口：客户端参数和重建方法（升级 PTB 后不一致时立即报错）"""
+    if not isinstance(getattr(request, '_client_kwargs', None), dict) or not callable(getattr(request, '_build_client', None)):
+        raise UnsupportedHTTPStack("HTTPXRequest 缺少 _client_kwargs / _build_client")
+
+
+def _install_chunked_writes(client: httpx.AsyncClient):
+    """替换客户端各传输层（包括代理）的网络后端；httpx 内部结构不同时立即报错"""
+    transports = [getattr(client, '_transport', None), *getattr(client, '_mounts', {}).values()]
+    pools = [getattr(transport, '_pool', None) for transport in transports if transport is not None]
+    if not pools or not all(hasattr(pool, '_network_backend') for pool in pools):
+        raise UnsupportedHTTPStack("httpx 客户端的传输层没有 _pool._network_backend，无法启用分块写入")
+    for pool in pools:
+        if not isinstance(pool._network_backend, _ChunkedWriteBackend):
+            pool._network_backend = _ChunkedWriteBackend(pool._network_backend)
+
+
+class ThroughputEstimator:
+    """连接池的滚动吞吐量估计（指数加权平均，字节/秒）"""
+
+    def __init__(self, alpha: float = 0.3):
+        self.alpha = alpha
+        self.rate: Optional[float] = None
+        self.samples = 0
+
+    def record(self, size: int, seconds: float):
+        if size < MIN_THROUGHPUT_SAMPLE or seconds <= 0:
+            return
+        sample = size / seconds
+        self.rate = sample if self.rate is None else self.alpha * sample + (1 - self.alpha) * self.rate
+        self.samples += 1
+
+
+def _h2_available() -> bool:
+    """检查是否安装了HTTP/2依赖（h2）"""
+    return importlib.util.find_spec('h2') is not None
+
+
+class TrafficClassRequest(HTTPXRequest):
+    """单一流量类型的请求对象：独立连接池 + 饱和度统计"""
+
+    def __init__(self, traffic_class: str, settings: dict, proxy_url: Optional[str] = None, sendfile: bool = True):
+        self.traffic_class = traffic_class
+        self.pool_size = settings['size']
+        self.proxy_url = proxy_url
+        self.sendfile = sendfile
+
+        http_version = '1.1'
+        if settings['http2']:
+            if _h2_available():
+                http_version = '2'
+            else:
+                logger.warning(f"⚠️ 连接池 {traffic_class} 配置了HTTP/2，但未安装 h2，回退到 HTTP/1.1")
+
+        super().__init__(
+            connection_pool_size=settings['size'],
+            proxy=proxy_url,
+            connect_timeout=settings['connect_timeout'],
+            read_timeout=settings['read_timeout'],
+            write_timeout=settings['write_timeout'],
+            pool_timeout=settings['pool_timeout'],
+            http_version=http_version
+        )
+
+        # HTTPXRequest 不直接暴露 keep-alive 配置，这里替换连接池限制后重建客户端
+        _check_request_internals(self)
+        self._client_kwargs['limits'] = httpx.Limits(
+            max_connections=settings['size'],
+            max_keepalive_connections=settings['size'],
+            keepalive_expiry=settings['keepalive']
+        )
+        self._client = self._build_client()
+
+        # 实测吞吐量（用于按文件大小计算传输截止时间）
+        self.throughput = ThroughputEstimator()
+
+        # 饱和度统计
+        self.active_requests = 0
+        self.peak_active = 0
+        self.total_requests = 0
+        self.saturated_requests = 0  # 发起时连接池已满、需要排队的请求数
+        self.pool_timeouts = 0       # 等待空闲连接超时的次数
+        
+        # 流式上传：sendfile 连接在 httpx 连接池之外建立，用信号量限制同样的连接数
+        self.streamed_uploads = {MODE_SENDFILE: 0, MODE_CHUNKED: 0}
+        self._sendfile_slots = asyncio.Semaphore(settings['size'])
+
+    def _build_client(self) -> httpx.AsyncClient:
+        client = super()._build_client()
+        _install_chunked_writes(client)
+        return client
+
+    async def do_request(self, url: str, method: str, request_data: Optional[RequestData] = None, **kwargs):
+        """发送请求并记录连接池占用情况和吞吐量"""
+        if self.active_requests >= self.pool_size:
+            self.saturated_requests += 1
+        self.active_requests += 1
+        self.total_requests += 1
+        self.peak_active = max(self.peak_active, self.active_requests)
+
+        started = time.monotonic()
+        try:
+            if contains_file_inputs(request_data):
+                status_code, payload = await self._do_streamed_upload(url, method, request_data, **kwargs)
+            else:
+                status_code, payload = await super().do_request(url, method, request_data, **kwargs)
+            sent = sum(len(part[1]) for part in request_data.multipart_data.values()) if request_data and request_data.contains_files else 0
+            self.throughput.record(sent + len(payload), time.monotonic() - started)
+            return status_code, payload
+        except TimedOut as e:
+            if isinstance(e.__cause__, httpx.PoolTimeout) or 'pool timeout' in str(e).lower():
+                self.pool_timeouts += 1
+                logger.warning(f"⚠️ 连接池 {self.traffic_class} 已饱和，等待空闲连接超时")
+            raise
+        finally:
+            self.active_requests -= 1
+
+    def _resolve_timeouts(self, read_timeout=BaseRequest.DEFAULT_NONE, write_timeout=BaseRequest.DEFAULT_NONE,
+                          connect_timeout=BaseRequest.DEFAULT_NONE, pool_timeout=BaseRequest.DEFAULT_NONE) -> httpx.Timeout:
+        """未指定的超时使用连接池的默认值（与 HTTPXRequest 一致）"""
+        defaults = self._client.timeout
+        return httpx.Timeout(
+            connect=defaults.connect if connect_timeout is BaseRequest.DEFAULT_NONE else connect_timeout,
+            read=defaults.read if read_timeout is BaseRequest.DEFAULT_NONE else read_timeout,
+            write=defaults.write if write_timeout is BaseRequest.DEFAULT_NONE else write_timeout,
+            pool=defaults.pool if pool_timeout is BaseRequest.DEFAULT_NONE else pool_timeout,
+        )
+
+    async def _do_streamed_upload(self, url: str, method: str, request_data: RequestData, **kwargs):
+        """按路径上传的文件：直连 http:// 时用 sendfile，经过代理或 TLS 时按块读取后通过连接池发送"""
+        body = MultipartBody(request_data)
+        timeout = self._resolve_timeouts(**kwargs)
+
+        if self.sendfile and sendfile_supported(url, self.proxy_url):
+            try:
+                await asyncio.wait_for(self._sendfile_slots.acquire(), timeout.pool)
+            except asyncio.TimeoutError as e:
+                self.pool_timeouts += 1
+                raise TimedOut("Pool timeout: 所有上传连接都在使用中") from e
+            try:
+                self.streamed_uploads[MODE_SENDFILE] += 1
+                return await sendfile_request(url, body, self.USER_AGENT, timeout.connect, timeout.read, timeout.write)
+            finally:
+                self._sendfile_slots.release()
+
+        self.streamed_uploads[MODE_CHUNKED] += 1
+        try:
+            res = await self._client.request(
+                method=method,
+                url=url,
+                headers={'User-Agent': self.USER_AGENT, 'Content-Type': body.content_type, 'Content-Length': str(len(body))},
+                timeout=timeout,
+                content=body.iter_chunks(),
+            )
+        except httpx.TimeoutException as e:
+            raise TimedOut(str(e) or "上传超时") from e
+        except httpx.HTTPError as e:
+            raise NetworkError(f"httpx.{e.__class__.__name__}: {e}") from e
+        return res.status_code, res.content
+
+    def get_stats(self) -> dict:
+        """获取连接池统计信息"""
+        return {
+            'traffic_class': self.traffic_class,
+            'pool_size': self.pool_size,
+            'http_version': self.http_version,
+            'active': self.active_requests,
+            'peak_active': self.peak_active,
+            'total_requests': self.total_requests,
+            'saturated_requests': self.saturated_requests,
+            'pool_timeouts': self.pool_timeouts,
+            'utilization': self.active_requests / self.pool_size if self.pool_size else 0.0,
+            'throughput': self.throughput.rate,
+            'streamed_uploads': dict(self.streamed_uploads)
+        }
+
+
+class TrafficRoutedRequest(BaseRequest):
+    """按请求类型把Bot API调用分发到对应的连接池"""
+
+    def __init__(self, requests: Dict[str, TrafficClassRequest], manage_lifecycle: bool = True):
+        self.requests = requests
+        # 多租户共享的连接池由宿主统一初始化和关闭，单个租户的 Application 关闭时不能关闭它们
+        self.manage_lifecycle = manage_lifecycle
+
+    @property
+    def read_timeout(self) -> Optional[float]:
+        """默认读取超时（以元数据请求池为准）"""
+        return self.requests[TRAFFIC_API].read_timeout
+
+    async def initialize(self) -> None:
+        if self.manage_lifecycle:
+            for request in self.requests.values():
+                await request.initialize()
+
+    async def shutdown(self) -> None:
+        if self.manage_lifecycle:
+            for request in self.requests.values():
+                await request.shutdown()
+
+    def classify(self, url: str, request_data: Optional[RequestData] = None) -> str:
+        """根据URL和请求数据判断流量类型"""
+        if '/file/bot' in url:
+            return TRAFFIC_DOWNLOAD
+
+        endpoint = url.rstrip('/').rsplit('/', 1)[-1]
+        if endpoint == 'getUpdates' and TRAFFIC_POLL in self.requests:
+            return TRAFFIC_POLL
+        if request_data is not None and request_data.contains_files:
+            return TRAFFIC_UPLOAD
+        return TRAFFIC_API
+
+    async def do_request(self, url: str, method: str, request_data: Optional[RequestData] = None, **kwargs):
+        traffic_class = self.classify(url, request_data)
+        return await self.requests[traffic_class].do_request(url, method, request_data, **kwargs)
+
+
+def build_traffic_requests(pool_settings: Dict[str, dict], proxy_url: Optional[str] = None,
+                           sendfile: bool = True) -> Dict[str, TrafficClassRequest]:
+    """按配置创建各流量类型的请求对象（sendfile: 流式上传在直连 http:// 时是否使用 sendfile）"""
+    requests = {}
+    for traffic_class, settings in pool_settings.items():
+        requests[traffic_class] = TrafficClassRequest(traffic_class, settings, proxy_url, sendfile)
+        logger.info(
+            f"🌐 连接池 {traffic_class}: {settings['size']} 连接, 保活 {settings['keepalive']:.0f}s, "
+            f"HTTP/{requests[traffic_class].http_version}, 读取超时 {settings['read_timeout']:.0f}s"
+        )
+    return requests
+
+
+def format_pool_stats(requests: Dict[str, TrafficClassRequest]) -> str:
+    """格式化连接池饱和度信息（用于 /status）"""
+    lines = []
+    for traffic_class, request in requests.items():
+        stats = request.get_stats()
+        lines.append(
+            f"• {traffic_class}: {stats['active']}/{stats['pool_size']} 活跃 "
+            f"(峰值 {stats['peak_active']}, 排队 {stats['saturated_requests']}次, "
+            f"池超时 {stats['pool_timeouts']}次, HTTP/{stats['http_version']})"
+        )
+        streamed = stats['streamed_uploads']
+        if any(streamed.values()):
+            lines[-1] += f", 流式上传 sendfile {streamed[MODE_SENDFILE]}次/分块 {streamed[MODE_CHUNKED]}次"
+
+    return "\n".join(lines)
@@ -0,0 +1,222 @@
+"""
+图片优化模块 - 在进程池中重新编码/缩放图片、去除元数据、生成缩略图
+所有 Pillow 操作都在子进程中执行，不阻塞事件循环
+"""
+
+import asyncio
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import List, Optional
+
+from config import Config
+from memory_staging import staged_buffer
+
+logger = logging.getLogger(__name__)
+
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.webp'}
+
+# Telegram 缩略图限制：JPEG，宽高不超过320，小于200KB
+THUMBNAIL_SIZE = 320
+THUMBNAIL_QUALITY = 80
+
+
+def optimize_image_file(path_str: str, settings: dict, media_type: str) -> dict:
+    """优化单个图片文件（在子进程中运行）
+
+    结果更小（或被缩放）时用优化后的文件替换原文件，否则保留原文件。
+    """
+    from PIL import Image, ImageOps
+
+    path = Path(path_str)
+    original_size = path.stat().st_size
+    result = {
+        'path': path_str,
+        'original_size': original_size,
+        'new_size': original_size,
+        'thumbnail': None,
+        'changed': False
+    }
+
+    with Image.open(path) as source:
+        source.load()
+        source_format = source.format
+
+        # 动图（GIF/动态WebP）不处理，避免丢帧
+        if getattr(source, 'is_animated', False):
+            return result
+
+        image = ImageOps.exif_transpose(source) or source
+        info = dict(source.info)
+
+        resized = False
+        max_dimension = settings.get('max_dimension')
+        if max_dimension and max(image.size) > max_dimension:
+            image.thumbnail((max_dimension, max_dimension), Image.LANCZOS)
+            resized = True
+
+        if media_type == 'photo' or source_format == 'JPEG':
+            output_format, extension = 'JPEG', '.jpg'
+            if image.mode not in ('RGB', 'L'):
+                image = image.convert('RGB')
+            save_kwargs = {'quality': settings['quality'], 'optimize': True, 'progressive': True}
+        elif source_format == 'PNG':
+            output_format, extension = 'PNG', '.png'
+            save_kwargs = {'optimize': True}
+        elif source_format == 'WEBP':
+            output_format, extension = 'WEBP', '.webp'
+            save_kwargs = {'quality': settings['quality'], 'method': 4}
+        else:
+            return result
+
+        # 色彩配置文件始终保留，EXIF等元数据按设置决定是否保留
+        if info.get('icc_profile'):
+            save_kwargs['icc_profile'] = info['icc_profile']
+        if not settings['strip_metadata'] and info.get('exif'):
+            save_kwargs['exif'] = info['exif']
+
+        output_path = path.with_name(f"{path.stem}_opt{extension}")
+        image.save(output_path, output_format, **save_kwargs)
+
+        if settings['thumbnail'] and media_type == 'document':
+            thumbnail = image.convert('RGB') if image.mode not in ('RGB', 'L') else image.copy()
+            thumbnail.thumbnail((THUMBNAIL_SIZE, THUMBNAIL_SIZE), Image.LANCZOS)
+            thumbnail_path = path.with_name(f"{path.stem}_thumb.jpg")
+            thumbnail.save(thumbnail_path, 'JPEG', quality=THUMBNAIL_QUALITY, optimize=True)
+            result['thumbnail'] = str(thumbnail_path)
+
+    new_size = output_path.stat().st_size
+    if new_size < original_size or resized:
+        path.unlink()
+        result.update(path=str(output_path), new_size=new_size, changed=True)
+    else:
+        output_path.unlink()
+
+    return result
+
+
+class ImageProcessor:
+    """图片优化处理阶段（进程池）"""
+
+    def __init__(self, config: Config):
+        self.config = config
+        self.default_settings = {
+            'enabled': config.image_optimization_enabled,
+            'max_dimension': config.image_max_dimension,
+            'quality': config.image_quality,
+            'strip_metadata': config.image_strip_metadata,
+            'thumbnail': config.image_thumbnails,
+            'documents': config.image_optimize_documents,
+            'min_size': config.image_min_size,
+        }
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self.executor_source: Optional['ImageProcessor'] = None  # 多租户模式下共用宿主的进程池
+        self._available = True
+
+        # 统计信息
+        self.stats = {
+            'files_processed': 0,
+            'files_changed': 0,
+            'bytes_before': 0,
+            'bytes_after': 0,
+            'errors': 0,
+        }
+
+    def get_settings(self, channel_mapping: dict = None) -> dict:
+        """合并全局默认设置和频道映射的 settings.image_optimization"""
+        settings = dict(self.default_settings)
+        if channel_mapping:
+            settings.update(channel_mapping.get('settings', {}).get('image_optimization') or {})
+        return settings
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self.executor_source is not None:
+            return self.executor_source._get_executor()
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.config.image_workers)
+        return self._executor
+
+    def _should_process(self, file_info: dict, settings: dict) -> bool:
+        if file_info.get('optimized'):
+            return False  # 下载阶段已经处理过
+        staged = staged_buffer(file_info)
+        path = staged.file_name if staged else file_info.get('path')
+        if not path:
+            return False
+        if file_info['type'] == 'document':
+            if not settings['documents'] or Path(path).suffix.lower() not in IMAGE_EXTENSIONS:
+                return False
+        elif file_info['type'] != 'photo':
+            return False
+        size = len(staged.data) if staged else Path(path).stat().st_size
+        return size >= settings['min_size']
+
+    async def process_files(self, downloaded_files: List[dict], channel_mapping: dict = None) -> List[dict]:
+        """优化已下载的图片文件（原地更新文件信息中的 path，并添加 thumbnail；处理过的文件标记 optimized，不重复处理）"""
+        settings = self.get_settings(channel_mapping)
+        if not settings['enabled'] or not self._available:
+            return downloaded_files
+
+        candidates = [f for f in downloaded_files if self._should_process(f, settings)]
+        if not candidates:
+            return downloaded_files
+
+        # 内存暂存的图片先写入下载目录，由工作进程按文件处理
+        for file_info in candidates:
+            staged = file_info.pop('staged', None)
+            if staged:
+                file_info['path'] = staged.spill(self.config.download_path)
+
+        loop = asyncio.get_running_loop()
+        executor = self._get_executor()
+        results = await asyncio.gather(
+            *(loop.run_in_executor(executor, optimize_image_file, str(f['path']), settings, f['type']) for f in candidates),
+            return_exceptions=True
+        )
+
+        for file_info, result in zip(candidates, results):
+            file_info['optimized'] = True
+            if isinstance(result, ImportError):
+                logger.warning("⚠️ 未安装 Pillow，图片优化已禁用")
+                self._available = False
+                break
+            if isinstance(result, Exception):
+                self.stats['errors'] += 1
+                logger.error(f"图片优化失败 {file_info['path']}: {result}")
+                continue
+
+            self.stats['files_processed'] += 1
+            self.stats['bytes_before'] += result['original_size']
+            self.stats['bytes_after'] += result['new_size']
+            if result['changed']:
+                self.stats['files_changed'] += 1
+                file_info['path'] = Path(result['path'])
+            if result['thumbnail']:
+                file_info['thumbnail'] = Path(result['thumbnail'])
+
+            saved = result['original_size'] - result['new_size']
+            logger.info(
+                f"🖼️ 图片优化: {Path(result['path']).name} "
+                f"{result['original_size'] / 1024:.0f}KB -> {result['new_size'] / 1024:.0f}KB (节省 {saved / 1024:.0f}KB)"
+            )
+
+        return downloaded_files
+
+    def get_bytes_saved(self) -> int:
+        return self.stats['bytes_before'] - self.stats['bytes_after']
+
+    def format_stats(self) -> str:
+        """格式化统计信息（用于 /status）"""
+        if not self.default_settings['enabled'] and not self.stats['files_processed']:
+            return "禁用"
+        saved_mb = self.get_bytes_saved() / (1024 * 1024)
+        ratio = (self.get_bytes_saved() / self.stats['bytes_before'] * 100) if self.stats['bytes_before'] else 0.0
+        return (
+            f"处理 {self.stats['files_processed']} 个, 优化 {self.stats['files_changed']} 个, "
+            f"节省 {saved_mb:.1f}MB ({ratio:.0f}%), 失败 {self.stats['errors']} 个"
+        )
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
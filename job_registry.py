@@ -0,0 +1,144 @@
+"""
+任务登记模块 - 记录每条消息/每个媒体组从收到到发布的处理阶段
+/queue 查看排队和处理中的任务，/cancel 取消任务（释放下载槽位、带宽和磁盘），/bump 让任务优先获得下载槽位
+关闭排空也按这里的阶段决定等待完成还是保存到检查点
+"""
+
+import asyncio
+import logging
+import time
+from typing import Dict, List, Optional
+
+from telegram import Message
+
+logger = logging.getLogger(__name__)
+
+# 处理阶段
+STAGE_COLLECTING = 'collecting'    # 媒体组收集中（还没有处理任务）
+STAGE_QUEUED = 'queued'            # 等待下载槽位
+STAGE_DOWNLOADING = 'downloading'
+STAGE_SCHEDULED = 'scheduled'      # 已下载，等待发布时间
+STAGE_PUBLISHING = 'publishing'
+
+STAGE_NAMES = {
+    STAGE_COLLECTING: '收集中',
+    STAGE_QUEUED: '排队',
+    STAGE_DOWNLOADING: '下载中',
+    STAGE_SCHEDULED: '等待发布',
+    STAGE_PUBLISHING: '发布中',
+}
+
+
+class Job:
+    """一条消息或一个媒体组的处理任务"""
+
+    __slots__ = (
+        'id', 'channel_mapping', 'chat_id', 'message_id', 'message', 'group', '_size',
+        'stage', 'created', 'stage_since', 'task', 'bumped', 'files', 'sent',
+    )
+
+    def __init__(self, job_id: int, channel_mapping: Optional[dict], chat_id: int, message_id: int,
+                 size: int, stage: str, message: Optional[Message] = None, group=None):
+        self.id = job_id
+        self.channel_mapping = channel_mapping
+        self.chat_id = chat_id
+        self.message_id = message_id
+        self.message = message      # 单条消息（关闭排空时保存到检查点）
+        self.group = group          # 媒体组（MediaGroup）
+        self._size = size
+        self.stage = stage
+        self.created = time.monotonic()
+        self.stage_since = self.created
+        self.task: Optional[asyncio.Task] = None
+        self.bumped = False
+        self.files: List[dict] = []  # 已下载的文件（取消时清理）
+        self.sent: List[tuple] = []  # 媒体组已发出的批次 (文件列表, 消息列表)，关闭排空时只保存没发出的部分
+
+    def set_stage(self, stage: str):
+        self.stage = stage
+        self.stage_since = time.monotonic()
+
+    @property
+    def size(self) -> int:
+        """媒体文件总大小（媒体组按当前收集到的文件计算）"""
+        return self.group.total_size() if self.group is not None else self._size
+
+    @property
+    def label(self) -> str:
+        if self.group is not None:
+            return f"媒体组 {self.group.media_group_id} ({len(self.group.items)}个文件)"
+        return f"消息 {self.message_id}"
+
+    @property
+    def mapping_name(self) -> str:
+        if not self.channel_mapping:
+            return '默认'
+        return self.channel_mapping.get('name') or self.channel_mapping['id']
+
+
+class JobRegistry:
+    """内存中的任务表（按创建顺序）"""
+
+    def __init__(self):
+        self._jobs: Dict[int, Job] = {}
+        self._next_id = 1
+        self.stats = {'completed': 0, 'cancelled': 0, 'bumped': 0}
+
+    def add(self, channel_mapping: Optional[dict], chat_id: int, message_id: int, size: int, stage: str,
+            message: Optional[Message] = None, group=None) -> Job:
+        job = Job(self._next_id, channel_mapping, chat_id, message_id, size, stage, message, group)
+        self._next_id += 1
+        self._jobs[job.id] = job
+        return job
+
+    def remove(self, job: Job, cancelled: bool = False):
+        """任务结束（重复调用无副作用）"""
+        if self._jobs.pop(job.id, None) is not None:
+            self.stats['cancelled' if cancelled else 'completed'] += 1
+
+    def get(self, job_id: int) -> Optional[Job]:
+        return self._jobs.get(job_id)
+
+    def jobs(self) -> List[Job]:
+        return list(self._jobs.values())
+
+    def __len__(self) -> int:
+        return len(self._jobs)
+
+    def stage_counts(self) -> Dict[str, int]:
+        counts = dict.fromkeys(STAGE_NAMES, 0)
+        for job in self._jobs.values():
+            counts[job.stage] += 1
+        return counts
+
+    def format_queue(self, limit: int = 30) -> str:
+        """格式化任务列表（用于 /queue）"""
+        if not self._jobs:
+            return "📭 当前没有排队或处理中的任务"
+        now = time.monotonic()
+        counts = self.stage_counts()
+        lines = [
+            f"📋 任务: {len(self._jobs)} 个 (" +
+            ", ".join(f"{STAGE_NAMES[stage]} {count}" for stage, count in counts.items() if count) + ")"
+        ]
+        for job in list(self._jobs.values())[:limit]:
+            line = (
+                f"#{job.id} {job.label} [{job.mapping_name}] {STAGE_NAMES[job.stage]} {now - job.stage_since:.0f}s, "
+                f"{job.size / 1024 / 1024:.1f}MB, 已存在 {now - job.created:.0f}s"
+            )
+            if job.bumped:
+                line += " ⏫"
+            lines.append(line)
+        if len(self._jobs) > limit:
+            lines.append(f"... 还有 {len(self._jobs) - limit} 个")
+        lines.append("\n/cancel <任务号> 取消任务，/bump <任务号> 优先下载")
+        return "\n".join(lines)
+
+    def format_status(self) -> str:
+        """格式化统计（用于 /status）"""
+        counts = self.stage_counts()
+        active = ", ".join(f"{STAGE_NAMES[stage]} {count}" for stage, count in counts.items() if count) or "无"
+        return (
+            f"{active}; 完成 {self.stats['completed']}, 取消 {self.stats['cancelled']}, "
+            f"提升 {self.stats['bumped']}"
+        )
@@ -9,46 +9,129 @@ import logging
 import os
 import signal
 import sys
-import random
+import time
+from contextlib import asynccontextmanager, nullcontext
 from pathlib import Path
-from typing import Optional
+from typing import Dict, List, Optional, Tuple
 from datetime import datetime, timedelta
 
 from dotenv import load_dotenv
 from telegram import Update, Message, ChatMember
 from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes
-from telegram.error import TelegramError
+from telegram.error import BadRequest, TelegramError
 
 from bot_handler import TelegramBotHandler
 from media_downloader import MediaDownloader
 from config import Config
+from message_index import MessageIndex
+from image_processor import ImageProcessor
+from update_recorder import UpdateRecorder
+from chat_cache import ChatMetadataCache
+from content_filter import TEXT_RULES, ContentFilters, message_media
+from message_map import KIND_MEDIA, KIND_TEXT, MessageMap, message_key, source_key
+from config_watcher import ChannelsConfigWatcher
+from time_window import DeferredQueue
+from publish_scheduler import PublishScheduler, PublishTicket
+from http_pools import TRAFFIC_DOWNLOAD, TRAFFIC_POLL, TrafficRoutedRequest, build_traffic_requests, format_pool_stats
+from work_lanes import LANE_EXPRESS, WorkLanes
+from fair_scheduler import DEFAULT_MAPPING, FairScheduler
+from memory_staging import staged_buffer
+from transfer_timeouts import TransferTimeouts
+from transfer_progress import TransferProgress, render_transfer_metrics
+from metrics_server import MetricsServer
+from media_group import AlbumItem, GroupTombstones, MediaGroup
+from album_planner import AlbumSendError
+from job_registry import (
+    STAGE_COLLECTING, STAGE_DOWNLOADING, STAGE_PUBLISHING, STAGE_QUEUED, STAGE_SCHEDULED, Job, JobRegistry
+)
+from history_backfill import BackfillEngine, BackfillState, create_history_provider, pick_random_media
+from tenants import SharedResources, TenantLogFilter, TenantQuota, current_tenant, load_tenants, tenant_env
+
+# 时间控制的判断结果（_time_gate）
+GATE_OPEN = 'open'
+GATE_DEFER = 'defer'
+GATE_CLOSED = 'closed'
 
 # 加载环境变量
 load_dotenv()
 
-# 配置日志
+# 配置日志（多租户模式下每行带租户ID）
 logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    format='%(asctime)s - %(tenant)s%(name)s - %(levelname)s - %(message)s',
     level=logging.INFO,
     handlers=[
         logging.FileHandler('bot.log'),
         logging.StreamHandler(sys.stdout)
     ]
 )
+for _handler in logging.getLogger().handlers:
+    _handler.addFilter(TenantLogFilter())
 logger = logging.getLogger(__name__)
 
 
+def build_proxy_url(config: Config) -> Optional[str]:
+    """按配置生成 httpx 使用的代理地址（未启用或配置有误时返回 None，使用直连）"""
+    proxy_url = None
+    proxy_config = config.get_proxy_config()
+    if proxy_config:
+        logger.info(f"🌐 配置代理: {proxy_config['proxy_type']}://{proxy_config['host']}:{proxy_config['port']}")
+        try:
+            # 为 httpx 配置代理
+            if proxy_config['proxy_type'] == 'socks5':
+                proxy_url = f"socks5://{proxy_config.get('username', '')}:{proxy_config.get('password', '')}@{proxy_config['host']}:{proxy_config['port']}"
+                if not proxy_config.get('username'):
+                    proxy_url = f"socks5://{proxy_config['host']}:{proxy_config['port']}"
+            elif proxy_config['proxy_type'] == 'http':
+                proxy_url = f"http://{proxy_config.get('username', '')}:{proxy_config.get('password', '')}@{proxy_config['host']}:{proxy_config['port']}"
+                if not proxy_config.get('username'):
+                    proxy_url = f"http://{proxy_config['host']}:{proxy_config['port']}"
+            
+            logger.info(f"✅ 代理配置成功: {proxy_url.split('@')[-1] if '@' in proxy_url else proxy_url}")
+            
+        except Exception as e:
+            logger.error(f"❌ 代理配置失败: {e}")
+            logger.warning("⚠️ 将使用直连模式")
+            proxy_url = None
+    else:
+        logger.info("🔗 使用直连模式（未配置代理）")
+    return proxy_url
+
+
 class CompleteTelegramMediaBot:
-    def __init__(self):
-        self.config = Config()
+    def __init__(self, config: Optional[Config] = None, tenant_id: Optional[str] = None,
+                 shared: Optional[SharedResources] = None, quota: Optional[TenantQuota] = None):
+        self.config = config or Config()
+        # 多租户模式：租户ID、与其他租户共享的资源和本租户的下载配额（单机器人模式下均为 None）
+        self.tenant_id = tenant_id
+        self.shared = shared
+        self.quota = quota
         self.application = None
         self.bot_handler = None
         self.media_downloader = None
+        self.message_index = None
+        self.message_map = None
+        self.content_filters = ContentFilters()  # 下载前过滤（规则在 channels.json 各映射的 settings.filters 中）
+        self.update_recorder = None
+        self.config_watcher = None
+        self.deferred_queue = None
+        self.deferred_task = None
+        self._deferred_wakeup = asyncio.Event()
+        self.backfill_engine = None
+        self.backfill_tasks = set()  # 正在运行的 /backfill 任务
         self.running = False
         self.shutdown_flag = False
         
+        # 关闭排空：正在处理的任务和检查点
+        self.draining = False
+        self.jobs = JobRegistry()  # 收到到发布之间的所有任务（/queue /cancel /bump，关闭排空）
+        self.chat_cache = ChatMetadataCache(self.config)  # 频道标题、ID/用户名、管理员权限（/status、路由）
+        self.drain_checkpoint = None
+        self.drain_report = None
+        
         # 原始功能：媒体组缓存
-        self.media_groups = {}  # {media_group_id: {'messages': [], 'timer': asyncio.Task, 'last_message_time': float, 'status': str, 'download_start_time': float}}
+        self.media_groups: Dict[Tuple[int, str], MediaGroup] = {}  # {(源频道ID, media_group_id): MediaGroup}（按创建顺序）
+        self.media_group_stats = {'early_flushes': 0, 'prefetched': 0, 'prefetch_discarded': 0}
+        self.media_group_tombstones = GroupTombstones(self.config.media_group_tombstone_ttl, self.config.media_group_tombstone_max)
         self.media_group_timeout = self.config.media_group_timeout  # 等待更多消息的时间
         self.media_group_max_wait = self.config.media_group_max_wait  # 等待新消息的最大时间
         self.download_timeout = self.config.download_timeout  # 下载超时时间（支持大文件）
@@ -67,6 +150,27 @@ class CompleteTelegramMediaBot:
         
         # 全局发送锁，确保同时只有一个媒体组在发送，避免429错误
         self.send_lock = asyncio.Lock()
+        
+        # 发布调度（按目标频道预约随机化的发布时间，下载不再等待人工延迟）
+        self.publish_scheduler = PublishScheduler()
+        
+        if shared:
+            # 多租户：所有租户的映射在共享的下载槽位上公平调度
+            self.work_lanes = shared.work_lanes
+            self.fair_scheduler = shared.fair_scheduler
+        else:
+            # 下载槽位按预估成本分为快速通道和大文件通道，避免小消息排在大文件后面
+            self.work_lanes = WorkLanes(self.config, self.config.http_pools[TRAFFIC_DOWNLOAD]['size'])
+            # 映射之间的公平调度：名额多于下载槽位，让优先级通道仍有选择余地
+            self.fair_scheduler = FairScheduler(self.config.http_pools[TRAFFIC_DOWNLOAD]['size'] * 2)
+            self.fair_scheduler.update_limits(self.config.global_channel_settings)
+        
+        # 按流量类型分离的HTTP连接池 {traffic_class: TrafficClassRequest}
+        self.http_requests = {}
+        self.transfer_timeouts = None
+        # 上传/下载的字节级进度（/transfers 查看，METRICS_PORT 开启时导出）
+        self.transfer_progress = TransferProgress()
+        self.metrics_server = None
 
     async def start_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """处理 /start 命令"""
@@ -87,10 +191,18 @@ class CompleteTelegramMediaBot:
             "• /set_interval <秒数> - 设置轮询间隔\n\n"
             "🛠️ 手动命令:\n"
             "• /status - 查看机器人状态\n"
+            "• /transfers - 查看正在进行的上传/下载进度\n"
+            "• /queue - 查看排队和处理中的任务\n"
+            "• /cancel <任务号> - 取消任务\n"
+            "• /bump <任务号> - 优先下载该任务\n"
+            "• /unpublish [源频道] <源消息ID> - 删除已发布到目标频道的消息\n"
             "• /random_download <数量> - 随机下载N条历史消息\n"
             "• /selective_forward keyword <关键词> - 按关键词转发\n"
             "• /selective_forward type <类型> - 按消息类型转发\n"
-            "• /selective_forward recent <数量> - 转发最近N条消息\n\n"
+            "• /selective_forward recent <数量> - 转发最近N条消息\n"
+            "• /backfill <映射ID> [起始ID] [结束ID] - 回填历史消息\n"
+            "• /backfill_status - 查看回填进度\n"
+            "• /backfill_stop <映射ID> - 停止回填（保留检查点）\n\n"
             "📝 Caption管理命令:\n"
             "• /set_fixed_caption <内容> - 设置固定caption（替换所有消息的内容）\n"
             "• /set_append_caption <内容> - 设置追加caption（在原内容后追加）\n"
@@ -100,7 +212,8 @@ class CompleteTelegramMediaBot:
             "• /list_channels - 列出所有频道映射\n"
             "• /add_channel <ID> <名称> <源频道> <目标频道> - 添加新频道\n"
             "• /remove_channel <ID> - 删除频道映射\n"
-            "• /toggle_channel <ID> - 切换频道启用/禁用\n\n"
+            "• /toggle_channel <ID> - 切换频道启用/禁用\n"
+            "• /reload_channels - 重新加载频道配置文件\n\n"
             "📝 使用示例:\n"
             "• /random_download 5\n"
             "• /selective_forward keyword 新品\n"
@@ -151,6 +264,14 @@ class CompleteTelegramMediaBot:
         
         if self.config.time_control_enabled:
             time_info = f"\n⏰ 时间控制: {self.config.start_time}-{self.config.end_time} ({self.config.timezone})"
+            if self.config.time_window:
+                time_info += f"\n⏭️ 窗口将{self.config.time_window.format_next_change()}"
+            if self.deferred_queue:
+                queue_stats = self.deferred_queue.stats
+                time_info += (
+                    f"\n📦 延迟队列: 待释放 {self.deferred_queue.pending_count()} 条 "
+                    f"(已延迟 {queue_stats['deferred']}, 已释放 {queue_stats['released']}, 已丢弃 {queue_stats['dropped']})"
+                )
         else:
             time_info = "\n⏰ 时间控制: 禁用"
         
@@ -210,22 +331,26 @@ class CompleteTelegramMediaBot:
     async def status_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """处理 /status 命令"""
         try:
-            # 获取机器人信息
-            bot_info = await update.get_bot().get_me()
-            
-            # 检查源频道
-            try:
-                source_chat = await update.get_bot().get_chat(self.config.source_channel_id)
-                source_status = f"✅ 已连接: {source_chat.title}"
-            except Exception as e:
-                source_status = f"❌ 连接失败: {str(e)}"
-            
-            # 检查目标频道
-            try:
-                target_chat = await update.get_bot().get_chat(self.config.target_channel_id)
-                target_status = f"✅ 已连接: {target_chat.title}"
-            except Exception as e:
-                target_status = f"❌ 连接失败: {str(e)}"
+            # 机器人信息（启动时已获取）
+            bot_info = update.get_bot()
+            
+            # 频道信息来自元数据缓存（后台刷新，不在这里请求）
+            if self.config.multi_channel_enabled:
+                problems = [
+                    f"• {reference}: {self.chat_cache.format_chat(reference)}"
+                    for reference in self.chat_cache.references()
+                    if not (self.chat_cache.get(reference) and self.chat_cache.get(reference).is_admin)
+                ]
+                channel_status = (
+                    f"📡 频道: {self.chat_cache.format_status()}\n"
+                    + ("\n".join(problems[:10]) + "\n" if problems else "")
+                    + "（/list_channels 查看每个映射的频道）\n"
+                )
+            else:
+                channel_status = (
+                    f"📱 源频道: {self.chat_cache.format_chat(self.config.source_channel_id)}\n"
+                    f"🎯 目标频道: {self.chat_cache.format_chat(self.config.target_channel_id)}\n"
+                )
             
             # 检查下载目录
             download_path = Path(self.config.download_path)
@@ -235,20 +360,37 @@ class CompleteTelegramMediaBot:
                 download_status = f"❌ 目录不存在: {download_path.absolute()}"
             
             polling_status = "🟢 运行中" if self.polling_active else "🔴 已停止"
+            pool_status = format_pool_stats(self.http_requests) if self.http_requests else "• 未初始化"
             
             status_message = (
                 f"🤖 机器人状态报告\n\n"
                 f"🔹 机器人: {bot_info.first_name} (@{bot_info.username})\n"
                 f"🔹 Bot应用: {'✅ 正常运行' if self.running else '❌ 未运行'}\n"
                 f"🔹 消息轮询: {polling_status}\n\n"
-                f"📱 源频道: {source_status}\n"
-                f"🎯 目标频道: {target_status}\n"
+                f"{channel_status}"
                 f"📁 下载目录: {download_status}\n\n"
+                f"🌐 连接池:\n{pool_status}\n\n"
                 f"⚙️ 配置信息:\n"
                 f"• 代理: {'启用' if self.config.proxy_enabled else '禁用'}\n"
                 f"• 延迟: {'启用' if self.config.delay_enabled else '禁用'}\n"
                 f"• 时间控制: {'启用' if self.config.time_control_enabled else '禁用'}\n"
-                f"• Caption模式: {'固定' if self.config.fixed_caption else '追加' if self.config.append_caption else '原始'}\n\n"
+                f"• Caption模式: {'固定' if self.config.fixed_caption else '追加' if self.config.append_caption else '原始'}\n"
+                f"• 图片优化: {self.bot_handler.image_processor.format_stats() if self.bot_handler and self.bot_handler.image_processor else '禁用'}\n"
+                f"• 内存暂存: {self.media_downloader.staging_budget.format_status() if self.media_downloader and self.media_downloader.staging_budget else '禁用'}\n"
+                f"• 频道配置热重载: {self.config_watcher.format_status() if self.config_watcher else '禁用'}\n"
+                f"• 发布调度: {self.publish_scheduler.format_status()}\n"
+                f"• 下载通道: {self.work_lanes.format_status()}\n"
+                f"• 公平调度: {self.fair_scheduler.format_status()}\n"
+                f"• 传输超时: {self.transfer_timeouts.format_status() if self.transfer_timeouts else '未初始化'}\n"
+                f"• 传输进度: {self.transfer_progress.format_status()}\n"
+                f"• 任务: {self.jobs.format_status()}\n"
+                f"• 消息映射: {await self.message_map.format_status() if self.message_map else '禁用'}\n"
+                f"• 下载前过滤: {self.content_filters.format_status()}\n"
+                + (f"• 租户: {self.tenant_id}, 下载配额 {self.quota.format_status()}\n" if self.tenant_id else "") +
+                f"• 媒体组: 处理中 {len(self.media_groups)}/{self.config.media_group_max_open}, "
+                f"提前处理 {self.media_group_stats['early_flushes']} 次, "
+                f"预取命中 {self.media_group_stats['prefetched']} 个, 预取放弃 {self.media_group_stats['prefetch_discarded']} 个\n"
+                f"• 已完成媒体组: {self.media_group_tombstones.format_status()}\n\n"
                 f"⏰ 检查时间: {update.message.date}"
             )
             
@@ -257,6 +399,101 @@ class CompleteTelegramMediaBot:
         except Exception as e:
             await update.message.reply_text(f"❌ 获取状态失败: {str(e)}")
 
+    async def transfers_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """处理 /transfers 命令 - 查看正在进行的上传/下载进度"""
+        await update.message.reply_text(self.transfer_progress.format_transfers())
+
+    async def queue_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """处理 /queue 命令 - 查看排队和处理中的任务"""
+        await update.message.reply_text(self.jobs.format_queue())
+
+    def _job_from_args(self, context: ContextTypes.DEFAULT_TYPE) -> Optional[Job]:
+        if not context.args or len(context.args) != 1:
+            return None
+        try:
+            return self.jobs.get(int(context.args[0].lstrip('#')))
+        except ValueError:
+            return None
+
+    async def cancel_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """处理 /cancel 命令 - 取消任务（停止下载/上传，清理已下载的文件）"""
+        job = self._job_from_args(context)
+        if job is None:
+            await update.message.reply_text("❌ 使用方法: /cancel <任务号>（任务号见 /queue）")
+            return
+        self._cancel_job(job)
+        await update.message.reply_text(f"🛑 已取消任务 #{job.id}: {job.label}")
+
+    async def bump_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """处理 /bump 命令 - 让任务优先获得下载槽位"""
+        job = self._job_from_args(context)
+        if job is None:
+            await update.message.reply_text("❌ 使用方法: /bump <任务号>（任务号见 /queue）")
+            return
+        if job.stage in (STAGE_SCHEDULED, STAGE_PUBLISHING):
+            await update.message.reply_text(f"ℹ️ 任务 #{job.id} 已下载完成，按预约顺序发布，无需提升")
+            return
+        waiting = self._bump_job(job)
+        await update.message.reply_text(
+            f"⏫ 任务 #{job.id} 已提升优先级" + (f"（{waiting} 个下载立即排到队首）" if waiting else "（后续下载优先）")
+        )
+
+    async def unpublish_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """处理 /unpublish 命令 - 删除源消息已发布到目标频道的消息（Bot API 不推送删除事件，需要手动同步）"""
+        if not self.message_map:
+            await update.message.reply_text("❌ 消息映射未启用（MESSAGE_MAP_ENABLED=false）")
+            return
+        args = context.args or []
+        if len(args) == 1 and not self.config.multi_channel_enabled:
+            args = [self.config.source_channel_id, args[0]]
+        source_chat = self.chat_cache.resolve_id(args[0]) if len(args) == 2 else None
+        if len(args) != 2 or not args[1].isdigit() or source_chat is None:
+            await update.message.reply_text(
+                "❌ 使用方法: /unpublish <源频道> <源消息ID>\n"
+                "源频道可以是 @用户名 或 -100… 数字ID（@用户名需要频道元数据已获取）"
+            )
+            return
+        
+        entries = await self.message_map.find_by_message(source_chat, int(args[1]))
+        if not entries:
+            await update.message.reply_text(f"❌ 没有找到源消息 {args[1]} 的发布记录（未发布或已超过保留天数）")
+            return
+        deleted, failed = 0, 0
+        for entry in entries:
+            for message_id in entry['target_ids']:
+                try:
+                    await context.bot.delete_message(chat_id=entry['target_chat'], message_id=message_id)
+                    deleted += 1
+                except TelegramError as e:
+                    failed += 1
+                    logger.warning(f"⚠️ 删除目标消息 {entry['target_chat']}/{message_id} 失败: {e}")
+            self.message_map.remove(source_chat, entry['source_key'])
+        self.message_map.stats['deleted'] += deleted
+        logger.info(f"🗑️ 已删除源消息 {source_chat}/{args[1]} 发布的 {deleted} 条目标消息")
+        await update.message.reply_text(
+            f"🗑️ 已删除 {deleted} 条目标消息" + (f"，{failed} 条删除失败（可能已被删除或超过48小时）" if failed else "")
+        )
+
+    def _cancel_job(self, job: Job):
+        """取消任务：处理中的任务取消后自行清理文件和发布预约；收集中的媒体组直接移除（晚到的消息按已完成丢弃）"""
+        self.jobs.remove(job, cancelled=True)
+        if job.task is not None:
+            job.task.cancel()
+        elif job.group is not None:
+            group = job.group
+            if group.timer:
+                group.timer.cancel()
+            self._drop_media_group((group.chat_id, group.media_group_id))
+        logger.info(f"🛑 已取消任务 #{job.id}: {job.label} ({job.mapping_name})")
+
+    def _bump_job(self, job: Job) -> int:
+        """提升任务优先级：正在等待的下载立即排到队首，之后的下载（媒体组的其余文件）也优先"""
+        job.bumped = True
+        self.jobs.stats['bumped'] += 1
+        waiting = self.fair_scheduler.bump(job) + self.work_lanes.bump(job)
+        logger.info(f"⏫ 任务 #{job.id} 已提升优先级: {job.label} ({job.mapping_name})")
+        return waiting
+
     async def random_download_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """处理 /random_download 命令 - 随机下载N个历史消息"""
         try:
@@ -280,34 +517,25 @@ class CompleteTelegramMediaBot:
             
             await update.message.reply_text(f"🔄 开始随机下载 {count} 条历史消息...")
             
-            if not self.media_downloader:
-                self.media_downloader = MediaDownloader(self.config)
+            channel_mapping = self._get_default_channel_mapping()
+            if not channel_mapping:
+                await update.message.reply_text("❌ 没有启用的频道映射")
+                return
             
-            # 获取源频道的历史消息
+            # Bot API 无法读取频道历史，通过用户会话（API_ID/API_HASH）获取
             try:
-                # 获取频道最近的消息
-                async for message in update.get_bot().iter_history(
-                    chat_id=self.config.source_channel_id,
-                    limit=count * 3  # 获取更多消息以供随机选择
-                ):
-                    # 只处理有媒体的消息
-                    if self.bot_handler.has_media(message):
-                        downloaded_files = await self.media_downloader.download_media(message, update.get_bot())
-                        if downloaded_files:
-                            # 转发消息
-                            await self.bot_handler.forward_message(message, downloaded_files, update.get_bot())
-                            # 清理文件
-                            await self._cleanup_files(downloaded_files)
-                            count -= 1
-                            if count <= 0:
-                                break
-                            
-                            # 添加随机延迟
-                            if self.config.delay_enabled:
-                                delay = random.uniform(self.config.forward_delay_min, self.config.forward_delay_max)
-                                await asyncio.sleep(delay)
+                engine = self._get_backfill_engine()
+                history = await engine.fetch_recent(channel_mapping['source_channel'], count * 3)  # 获取更多消息以供随机选择
+                selected = pick_random_media(history, count)
+                
+                if not selected:
+                    await update.message.reply_text("📭 最近的历史消息中没有媒体消息")
+                    return
                 
-                await update.message.reply_text(f"✅ 随机下载完成！")
+                result = await engine.mirror_messages(channel_mapping, selected, update.get_bot(), send_lock=self.send_lock)
+                await update.message.reply_text(
+                    f"✅ 随机下载完成！成功 {result['published']} 条，去重跳过 {result['skipped']} 条，失败 {result['failed']} 条"
+                )
                 
             except Exception as e:
                 logger.error(f"获取历史消息失败: {e}")
@@ -317,6 +545,103 @@ class CompleteTelegramMediaBot:
             logger.error(f"随机下载失败: {e}")
             await update.message.reply_text(f"❌ 随机下载失败: {str(e)}")
 
+    def _get_default_channel_mapping(self) -> Optional[dict]:
+        """获取默认频道映射（优先匹配配置的源频道，否则取第一个启用的映射）"""
+        channel_mapping = self.config.get_channel_mapping_by_source(self.config.source_channel_id)
+        if channel_mapping:
+            return channel_mapping
+        enabled_mappings = self.config.get_enabled_channel_mappings()
+        return enabled_mappings[0] if enabled_mappings else None
+    
+    def _get_backfill_engine(self) -> BackfillEngine:
+        """懒加载历史回填引擎"""
+        if not self.backfill_engine:
+            self.backfill_engine = BackfillEngine(
+                self.config,
+                create_history_provider(self.config),
+                self.bot_handler,
+                BackfillState(self.config.backfill_state_path),
+                message_map=self.message_map,
+                chat_cache=self.chat_cache
+            )
+        return self.backfill_engine
+    
+    async def backfill_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """处理 /backfill 命令 - 回填源频道历史消息到目标频道"""
+        try:
+            if not context.args:
+                await update.message.reply_text(
+                    "❌ 请指定频道映射ID\n"
+                    "用法: /backfill <映射ID> [起始消息ID] [结束消息ID]\n"
+                    "• 不指定起始ID时从上次检查点继续（无检查点则从头开始）\n"
+                    "例如: /backfill tech_news\n"
+                    "例如: /backfill tech_news 1000 2000"
+                )
+                return
+            
+            mapping_id = context.args[0]
+            channel_mapping = next((m for m in self.config.channel_mappings if m['id'] == mapping_id), None)
+            if not channel_mapping:
+                await update.message.reply_text(f"❌ 找不到ID为 '{mapping_id}' 的频道映射")
+                return
+            
+            try:
+                start_id = int(context.args[1]) if len(context.args) > 1 else None
+                end_id = int(context.args[2]) if len(context.args) > 2 else None
+            except ValueError:
+                await update.message.reply_text("❌ 消息ID必须是数字")
+                return
+            
+            engine = self._get_backfill_engine()
+            if engine.is_running(mapping_id):
+                await update.message.reply_text(f"⚠️ 映射 {mapping_id} 的回填任务已在运行，使用 /backfill_status 查看进度")
+                return
+            
+            await update.message.reply_text(f"🚀 开始回填映射 {mapping_id} 的历史消息，使用 /backfill_status 查看进度")
+            
+            async def run_backfill():
+                try:
+                    job = await engine.run(channel_mapping, update.get_bot(), start_id, end_id, send_lock=self.send_lock)
+                    await update.message.reply_text(
+                        f"📚 映射 {mapping_id} 回填结束 [{job['status']}]\n"
+                        f"• 发布: {job['published']}\n"
+                        f"• 去重跳过: {job['skipped']}\n"
+                        f"• 失败: {job['failed']}\n"
+                        f"• 检查点: 消息 {job['last_id']}"
+                        + (f"\n• 错误: {job['error']}" if job.get('error') else "")
+                    )
+                except Exception as e:
+                    logger.error(f"❌ 映射 {mapping_id} 回填任务出错: {e}")
+                    await update.message.reply_text(f"❌ 映射 {mapping_id} 回填出错: {str(e)}")
+            
+            # 保留任务引用（避免被垃圾回收），关闭时等待回填停止
+            task = asyncio.create_task(run_backfill())
+            self.backfill_tasks.add(task)
+            task.add_done_callback(self.backfill_tasks.discard)
+            
+        except Exception as e:
+            logger.error(f"启动回填失败: {e}")
+            await update.message.reply_text(f"❌ 启动回填失败: {str(e)}")
+    
+    async def backfill_status_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """处理 /backfill_status 命令"""
+        if not self.backfill_engine:
+            await update.message.reply_text("📭 暂无回填任务")
+            return
+        await update.message.reply_text(self.backfill_engine.format_status())
+    
+    async def backfill_stop_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """处理 /backfill_stop 命令 - 停止回填（保留检查点）"""
+        if not context.args:
+            await update.message.reply_text("❌ 用法: /backfill_stop <映射ID>")
+            return
+        
+        mapping_id = context.args[0]
+        if self.backfill_engine and self.backfill_engine.request_stop(mapping_id):
+            await update.message.reply_text(f"⏹️ 正在停止映射 {mapping_id} 的回填任务，检查点已保存")
+        else:
+            await update.message.reply_text(f"⚠️ 映射 {mapping_id} 没有正在运行的回填任务")
+    
     async def selective_forward_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """处理 /selective_forward 命令 - 选择性转发"""
         try:
@@ -374,18 +699,105 @@ class CompleteTelegramMediaBot:
     async def _selective_forward_by_keyword(self, update, keyword):
         """按关键词选择性转发"""
         await update.message.reply_text(f"🔍 搜索包含关键词 '{keyword}' 的消息...")
-        # 实现关键词搜索逻辑
-        # 这里可以添加具体的搜索和转发逻辑
+        if not self.message_index:
+            await update.message.reply_text("❌ 消息索引未启用（MESSAGE_INDEX_ENABLED=false）")
+            return
+        
+        query_start = time.perf_counter()
+        records = await self.message_index.search_keyword(keyword, limit=50)
+        await self._republish_records(update, records, time.perf_counter() - query_start)
         
     async def _selective_forward_by_type(self, update, media_type):
         """按类型选择性转发"""
         await update.message.reply_text(f"🔍 搜索类型为 '{media_type}' 的消息...")
-        # 实现类型筛选逻辑
+        if not self.message_index:
+            await update.message.reply_text("❌ 消息索引未启用（MESSAGE_INDEX_ENABLED=false）")
+            return
+        
+        query_start = time.perf_counter()
+        records = await self.message_index.search_type(media_type, limit=50)
+        await self._republish_records(update, records, time.perf_counter() - query_start)
         
     async def _selective_forward_recent(self, update, count):
         """转发最近N条消息"""
         await update.message.reply_text(f"🔍 转发最近 {count} 条消息...")
-        # 实现最近消息转发逻辑
+        if not self.message_index:
+            await update.message.reply_text("❌ 消息索引未启用（MESSAGE_INDEX_ENABLED=false）")
+            return
+        
+        query_start = time.perf_counter()
+        records = await self.message_index.recent(count)
+        await self._republish_records(update, records, time.perf_counter() - query_start)
+    
+    async def _republish_records(self, update, records: list, query_time: float):
+        """通过现有发送路径重新发布索引中的消息（同一媒体组合并为相册）"""
+        if not records:
+            await update.message.reply_text(f"📭 没有找到匹配的消息（查询耗时 {query_time * 1000:.1f}ms）")
+            return
+        
+        # 按时间正序发布，媒体组展开为完整相册
+        groups = []
+        seen_groups = set()
+        for record in sorted(records, key=lambda r: (r['date'], r['message_id'])):
+            if record['media_group_id']:
+                group_key = (record['chat'], record['media_group_id'])
+                if group_key in seen_groups:
+                    continue
+                seen_groups.add(group_key)
+                groups.append(await self.message_index.get_media_group(*group_key))
+            else:
+                groups.append([record])
+        
+        await update.message.reply_text(
+            f"📋 找到 {len(records)} 条匹配消息，合并为 {len(groups)} 条待发布内容（查询耗时 {query_time * 1000:.1f}ms）"
+        )
+        
+        bot = update.get_bot()
+        published = 0
+        failed = 0
+        
+        for group in groups:
+            channel_mapping = self._find_channel_mapping(group[0]['chat'])
+            if not channel_mapping:
+                logger.warning(f"⚠️ 索引消息 {group[0]['chat']}/{group[0]['message_id']} 没有对应的启用映射，跳过")
+                failed += 1
+                continue
+            
+            source_text = next((record['caption'] for record in group if record['caption']), "")
+            ticket = self._reserve_publish(channel_mapping, self.config.forward_delay_min, self.config.forward_delay_max)
+            published_group = False
+            
+            try:
+                if group[0]['media_type'] == 'text':
+                    await self.publish_scheduler.wait_turn(ticket)
+                    await self.bot_handler.publish_text(source_text, bot, channel_mapping)
+                else:
+                    downloaded_files = []
+                    for record in group:
+                        downloaded_files.extend(await self.media_downloader.download_indexed_media(record, bot))
+                    
+                    if not downloaded_files:
+                        logger.warning(f"⚠️ 索引消息 {group[0]['chat']}/{group[0]['message_id']} 没有可下载的媒体文件")
+                        failed += 1
+                        continue
+                    
+                    try:
+                        await self.bot_handler.prepare_media(downloaded_files, channel_mapping)
+                        await self.publish_scheduler.wait_turn(ticket)
+                        await self.bot_handler.publish_media(downloaded_files, source_text, bot, channel_mapping, send_lock=self.send_lock)
+                    finally:
+                        await self._cleanup_files(downloaded_files)
+                
+                published_group = True
+                published += 1
+                
+            except Exception as e:
+                logger.error(f"❌ 重新发布索引消息 {group[0]['chat']}/{group[0]['message_id']} 失败: {e}")
+                failed += 1
+            finally:
+                self.publish_scheduler.release(ticket, published_group)
+        
+        await update.message.reply_text(f"✅ 选择性转发完成！成功 {published} 条，失败 {failed} 条")
     
     async def set_fixed_caption_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """设置固定caption命令 - 替换所有消息的caption为指定内容"""
@@ -486,18 +898,23 @@ class CompleteTelegramMediaBot:
             
             for i, mapping in enumerate(self.config.channel_mappings, 1):
                 status = "🟢 启用" if mapping.get('enabled', True) else "🔴 禁用"
+                depth = self.fair_scheduler.queue_depth(self._scheduler_key(mapping['id']))
                 message_parts.append(
                     f"{i}. {mapping['name']} {status}\n"
                     f"   ID: {mapping['id']}\n"
-                    f"   源频道: {mapping['source_channel']}\n"
-                    f"   目标频道: {mapping['target_channel']}\n"
+                    f"   源频道: {mapping['source_channel']} {self.chat_cache.format_chat(mapping['source_channel'])}\n"
+                    f"   目标频道: {mapping['target_channel']} {self.chat_cache.format_chat(mapping['target_channel'])}\n"
                     f"   描述: {mapping.get('description', '无')}\n"
+                    f"   过滤: {self.content_filters.format_mapping(mapping)}\n"
+                    f"   队列: 排队 {depth['queued']}, 处理中 {depth['in_flight']}, "
+                    f"已完成 {depth['completed']} (平均等待 {depth['average_wait']:.1f}s)\n"
                 )
             
             message_parts.append("\n🔧 管理命令:")
             message_parts.append("• /add_channel - 添加新频道映射")
             message_parts.append("• /remove_channel <ID> - 删除频道映射")
             message_parts.append("• /toggle_channel <ID> - 切换频道状态")
+            message_parts.append("• /reload_channels - 重新加载配置文件")
             
             result_message = "\n".join(message_parts)
             await update.message.reply_text(result_message)
@@ -506,6 +923,39 @@ class CompleteTelegramMediaBot:
             logger.error(f"列出频道失败: {e}")
             await update.message.reply_text(f"❌ 列出频道失败: {str(e)}")
     
+    def _on_channels_reloaded(self, changes: dict):
+        """频道配置重新加载后应用新的全局设置（多租户模式下调度器共享，只按第一个租户的设置修改）"""
+        if not self.shared or self.config is self.shared.config:
+            self.fair_scheduler.update_limits(self.config.global_channel_settings)
+        self.chat_cache.request_refresh()
+    
+    async def reload_channels_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """手动重新加载频道配置文件"""
+        try:
+            if not self.config.multi_channel_enabled:
+                await update.message.reply_text("❌ 未启用多频道模式，没有可重新加载的频道配置文件")
+                return
+            
+            watcher = self.config_watcher or ChannelsConfigWatcher(self.config, on_reload=self._on_channels_reloaded)
+            errors_before = watcher.stats['errors']
+            changes = await watcher.reload()
+            
+            if watcher.stats['errors'] > errors_before:
+                await update.message.reply_text(f"❌ 配置文件验证失败，继续使用当前配置:\n{watcher.stats['last_error']}")
+            elif changes is None:
+                await update.message.reply_text("ℹ️ 频道配置没有变化")
+            else:
+                await update.message.reply_text(
+                    f"✅ 频道配置已重新加载（{len(self.config.channel_mappings)} 个映射）\n"
+                    f"• 新增: {', '.join(changes['added']) or '无'}\n"
+                    f"• 删除: {', '.join(changes['removed']) or '无'}\n"
+                    f"• 修改: {', '.join(changes['changed']) or '无'}"
+                )
+        
+        except Exception as e:
+            logger.error(f"重新加载频道配置失败: {e}")
+            await update.message.reply_text(f"❌ 重新加载频道配置失败: {str(e)}")
+    
     async def add_channel_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """添加新频道映射命令"""
         try:
@@ -553,7 +1003,8 @@ class CompleteTelegramMediaBot:
             }
             
             # 添加映射
-            if self.config.add_channel_mapping(new_mapping):
+            if await self.config.add_channel_mapping(new_mapping):
+                self.chat_cache.request_refresh()
                 await update.message.reply_text(
                     f"✅ 成功添加频道映射:\n"
                     f"🏷️ ID: {mapping_id}\n"
@@ -597,7 +1048,8 @@ class CompleteTelegramMediaBot:
                 return
             
             # 删除映射
-            if self.config.remove_channel_mapping(mapping_id):
+            if await self.config.remove_channel_mapping(mapping_id):
+                self.chat_cache.request_refresh()
                 await update.message.reply_text(
                     f"✅ 成功删除频道映射:\n"
                     f"🏷️ ID: {mapping_id}\n"
@@ -639,13 +1091,9 @@ class CompleteTelegramMediaBot:
                 await update.message.reply_text(f"❌ 找不到ID为 '{mapping_id}' 的频道映射")
                 return
             
-            # 切换状态
-            current_status = mapping_to_toggle.get('enabled', True)
-            mapping_to_toggle['enabled'] = not current_status
-            new_status = mapping_to_toggle['enabled']
-            
-            # 保存配置
-            if self.config.save_channel_mappings():
+            # 切换状态（保存成功后替换路由表）
+            new_status = not mapping_to_toggle.get('enabled', True)
+            if await self.config.set_channel_enabled(mapping_id, new_status):
                 status_text = "🟢 启用" if new_status else "🔴 禁用"
                 await update.message.reply_text(
                     f"✅ 成功切换频道状态:\n"
@@ -664,6 +1112,10 @@ class CompleteTelegramMediaBot:
     async def handle_message(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """处理消息"""
         try:
+            # 录制原始更新（回放压测用）
+            if self.update_recorder:
+                self.update_recorder.record(update)
+            
             # 检查消息是否来自配置的源频道
             source_chat = update.effective_chat
             if source_chat is None:
@@ -677,7 +1129,8 @@ class CompleteTelegramMediaBot:
                 current_source_channel = str(source_chat.id)
             
             # 查找匹配的频道映射
-            channel_mapping = self.config.get_channel_mapping_by_source(current_source_channel)
+            self.chat_cache.observe(source_chat)
+            channel_mapping = self._find_channel_mapping(current_source_channel, source_chat.id)
             if not channel_mapping:
                 # 如果没有匹配的频道映射，跳过此消息
                 return
@@ -685,37 +1138,191 @@ class CompleteTelegramMediaBot:
             # 记录找到的频道映射
             logger.info(f"📝 消息来自源频道: {current_source_channel} -> 目标频道: {channel_mapping['target_channel']} (映射: {channel_mapping['name']})")
             
+            # 记录到本地消息索引（不论当前是否转发）
+            if self.message_index and update.effective_message:
+                indexed_message = update.effective_message
+                self.message_index.record_message(
+                    current_source_channel,
+                    indexed_message,
+                    self.media_downloader._get_all_media_info(indexed_message)
+                )
+            
+            # 源消息被编辑：同步编辑已发布的目标消息（不重新下载和上传媒体）
+            if update.edited_channel_post or update.edited_message:
+                if self.config.message_sync_edits and self.message_map:
+                    await self._sync_edit(update.effective_message, channel_mapping, context.bot)
+                return
+            
+            # 下载前过滤：按映射的过滤规则跳过不需要的内容（只用消息中已有的元数据，不发起请求）
+            if update.effective_message and self._filter_message(update.effective_message, channel_mapping):
+                return
+            
+            # 正在关闭：已拉取但还没处理的消息保存到检查点，重启后恢复
+            if self.draining and update.effective_message:
+                self._checkpoint_message(update.effective_message, channel_mapping)
+                return
+            
             # 如果自定义轮询未激活，不处理源频道消息
             if not self.polling_active:
                 logger.info("⏸️ 自定义轮询未启动，跳过源频道消息处理")
                 return
             
-            # 检查时间控制
-            if not self.config.is_in_time_range():
-                logger.info(f"⏰ 当前时间不在允许范围内，跳过消息处理")
-                return
-            
             message = update.effective_message
             if not message:
                 return
             
+            # 检查时间控制：时间段外的消息进入延迟队列；队列中还有该映射的积压时也排队，保持顺序
+            gate = self._time_gate(channel_mapping['id'])
+            if gate == GATE_DEFER:
+                self.deferred_queue.push(channel_mapping['id'], current_source_channel, update)
+                self._deferred_wakeup.set()
+                logger.info(
+                    f"⏰ 消息 {message.message_id} 已加入延迟队列 "
+                    f"(映射 {channel_mapping['id']} 积压 {self.deferred_queue.pending_count(channel_mapping['id'])} 条)"
+                )
+                return
+            if gate == GATE_CLOSED:
+                logger.info(f"⏰ 当前时间不在允许范围内，跳过消息处理")
+                return
+            
             logger.info(f"📥 收到来自源频道的消息 {message.message_id}")
+            await self._dispatch_message(message, context, channel_mapping)
             
+        except Exception as e:
+            logger.error(f"处理消息失败: {e}")
+
+    def _find_channel_mapping(self, source_channel: str, chat_id: Optional[int] = None) -> Optional[dict]:
+        """按源频道查找启用的映射：配置中的 @用户名/数字ID 与消息中的写法不同时按缓存的数字ID匹配"""
+        channel_mapping = self.config.get_channel_mapping_by_source(source_channel)
+        if channel_mapping:
+            return channel_mapping
+        if chat_id is None:
+            chat_id = self.chat_cache.resolve_id(source_channel)
+        if chat_id is None:
+            return None
+        return self.chat_cache.mapping_for_chat(chat_id, self.config.get_enabled_channel_mappings())
+
+    def _time_gate(self, mapping_id: str) -> str:
+        """时间控制：GATE_OPEN 立即处理；GATE_DEFER 进入延迟队列（时间段外，或该映射还有积压，保持顺序）；
+        GATE_CLOSED 时间段外且没有延迟队列"""
+        if not self.config.time_control_enabled:
+            return GATE_OPEN
+        in_time_range = self.config.is_in_time_range()
+        if self.deferred_queue:
+            if not in_time_range or self.deferred_queue.pending_count(mapping_id):
+                return GATE_DEFER
+            return GATE_OPEN
+        return GATE_OPEN if in_time_range else GATE_CLOSED
+
+    def _filter_message(self, message: Message, channel_mapping: dict) -> bool:
+        """按过滤规则判断消息，返回 True 表示跳过；媒体组中只有带caption的消息判断关键词（没有caption的媒体组收集完成后判断）"""
+        check_text = not message.media_group_id or bool(message.caption)
+        rule = self.content_filters.check_message(message, channel_mapping, check_text)
+        if rule is None:
+            return False
+        
+        media_type, size, _ = message_media(message)
+        if message.media_group_id:
+            if rule in TEXT_RULES:
+                # caption不通过：整个媒体组跳过（已收集的文件不再下载，晚到的同组消息按已完成丢弃）
+                self._reject_media_group((message.chat_id, message.media_group_id), channel_mapping, rule)
+                logger.info(f"🚫 媒体组 {message.media_group_id} 的caption不符合过滤规则 {rule}，跳过整个媒体组 (映射 {channel_mapping['id']})")
+                return True
+            if message.caption:
+                # 文件不通过但caption仍属于媒体组：交给媒体组收集，只丢弃文件
+                logger.info(f"🚫 媒体组 {message.media_group_id} 的文件 {message.message_id} ({media_type}) 不符合过滤规则 {rule}，只保留caption")
+                return False
+        logger.info(
+            f"🚫 消息 {message.message_id} ({media_type}) 不符合过滤规则 {rule}，跳过"
+            f"{f'（节省下载 {size / 1024 / 1024:.1f}MB）' if size else ''} (映射 {channel_mapping['id']})"
+        )
+        return True
+
+    def _pending_album_bytes(self, group: MediaGroup) -> int:
+        """媒体组中还没有预取完成的文件大小（跳过后节省的下载流量）"""
+        return sum(item.file_size or 0 for item in group.items if item.prefetch is None or not item.prefetch.done())
+
+    def _reject_media_group(self, group_key: Tuple[int, str], channel_mapping: dict, rule: str):
+        """过滤规则跳过整个媒体组"""
+        group = self.media_groups.get(group_key)
+        if group is None:
+            target_channel = channel_mapping['target_channel'] if channel_mapping else self.config.target_channel_id
+            self.media_group_tombstones.add(group_key, target_channel, None, False)
+            return
+        self.content_filters.add_bytes(channel_mapping['id'], rule, self._pending_album_bytes(group))
+        if group.timer:
+            group.timer.cancel()
+        self._drop_media_group(group_key)
+
+    def _record_published(self, message: Message, channel_mapping: Optional[dict], sent_messages: List[Message], kind: str):
+        """记录单条消息发布后的目标消息ID（编辑同步、/unpublish）"""
+        if self.message_map and sent_messages:
+            target_channel = channel_mapping['target_channel'] if channel_mapping else self.config.target_channel_id
+            self.message_map.record(message.chat_id, message_key(message), target_channel, sent_messages, kind)
+
+    async def _sync_edit(self, message: Message, channel_mapping: Optional[dict], bot):
+        """把源消息的文本/caption编辑同步到已发布的目标消息（媒体本身的替换不同步）"""
+        entries = await self.message_map.lookup(message.chat_id, message_key(message))
+        if not entries:
+            self.message_map.stats['edits_missed'] += 1
+            logger.info(f"✏️ 源消息 {message.message_id} 被编辑，但没有找到发布记录（还未发布或已超过保留天数），忽略")
+            return
+        
+        new_text = self.bot_handler._get_source_text(message)
+        forward_text = self.bot_handler._build_forward_text(message, channel_mapping)
+        for entry in entries:
+            if message.media_group_id and entry['caption_source_id'] not in (None, message.message_id):
+                # 媒体组的caption来自另一条消息：这条消息的caption没有发布
+                continue
+            if message.media_group_id and entry['caption_source_id'] is None and not new_text:
+                continue
+            try:
+                if entry['kind'] == KIND_TEXT:
+                    await bot.edit_message_text(
+                        chat_id=entry['target_chat'],
+                        message_id=entry['target_ids'][0],
+                        text=forward_text,
+                        parse_mode='HTML',
+                        disable_web_page_preview=False
+                    )
+                else:
+                    await bot.edit_message_caption(
+                        chat_id=entry['target_chat'],
+                        message_id=entry['target_ids'][0],
+                        caption=forward_text,
+                        parse_mode='HTML'
+                    )
+            except BadRequest as e:
+                if 'not modified' in str(e).lower():
+                    self.message_map.stats['edits_unchanged'] += 1
+                    continue
+                logger.warning(f"⚠️ 同步编辑源消息 {message.message_id} 失败: {e}")
+                continue
+            except TelegramError as e:
+                logger.warning(f"⚠️ 同步编辑源消息 {message.message_id} 失败: {e}")
+                continue
+            if message.media_group_id and entry['caption_source_id'] is None:
+                # 发布时没有caption的媒体组：之后的编辑以这条消息为准
+                self.message_map.set_caption_source(message.chat_id, entry['source_key'], message.message_id)
+            self.message_map.stats['edits_synced'] += 1
+            logger.info(f"✏️ 源消息 {message.message_id} 的编辑已同步到目标消息 {entry['target_chat']}/{entry['target_ids'][0]}")
+
+    async def _dispatch_message(self, message: Message, context: ContextTypes.DEFAULT_TYPE, channel_mapping: dict):
+        """把已路由的消息交给媒体组收集或单条消息处理流程"""
+        if self.draining:
+            self._checkpoint_message(message, channel_mapping)
+            return
+        try:
             # 检查是否是媒体组消息
             if message.media_group_id:
                 logger.info(f"消息 {message.message_id} 属于媒体组: {message.media_group_id}")
                 await self._handle_media_group_message(message, context, channel_mapping)
             else:
-                # 处理单独的消息，在这里添加整个消息的延迟
-                logger.info(f"📝 处理单独消息 {message.message_id}")
-                
-                # 添加消息级延迟模拟人工操作
-                if self.config.delay_enabled:
-                    delay = random.uniform(self.config.min_delay, self.config.max_delay)
-                    logger.info(f"⏱️ 单独消息处理前等待 {delay:.1f}s（模拟人工操作）")
-                    await asyncio.sleep(delay)
-                
-                await self._handle_single_message(message, context, channel_mapping)
+                # 处理单独的消息：到达时预约发布时间，下载在后台立即开始，处理器不等待
+                lane = self.work_lanes.classify(self.media_downloader._get_all_media_info(message))
+                logger.info(f"📝 处理单独消息 {message.message_id} ({lane} 通道)")
+                ticket = self._reserve_publish(channel_mapping, lane=lane)
+                self.application.create_task(self._handle_single_message(message, context, channel_mapping, ticket, lane))
             
             # 更新统计
             self.polling_stats['messages_processed'] += 1
@@ -724,27 +1331,130 @@ class CompleteTelegramMediaBot:
         except Exception as e:
             logger.error(f"处理消息失败: {e}")
 
-    async def _handle_single_message(self, message: Message, context: ContextTypes.DEFAULT_TYPE, channel_mapping: dict = None):
-        """处理单独的消息"""
+    async def _deferred_release_loop(self):
+        """时间窗口开启后按速率释放延迟队列中的帖子（媒体组整体释放）"""
+        release_interval = 60.0 / self.config.deferred_release_per_minute
+        try:
+            while not self.shutdown_flag:
+                if not self.deferred_queue.pending_count() or not self.polling_active:
+                    self._deferred_wakeup.clear()
+                    try:
+                        await asyncio.wait_for(self._deferred_wakeup.wait(), 30)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+                
+                window = self.config.time_window
+                if window and not self.config.is_in_time_range():
+                    # 直接睡到窗口开启（最多60秒后重新检查，以便响应关闭和配置变化）
+                    await asyncio.sleep(min(window.seconds_until_change(), 60))
+                    continue
+                
+                mapping_id, rows = self.deferred_queue.peek_post()
+                if not rows:
+                    continue
+                row_ids = [row_id for row_id, _ in rows]
+                
+                # 按当前路由表查找映射（热重载后映射可能已被删除或禁用）
+                channel_mapping = next(
+                    (m for m in self.config.get_enabled_channel_mappings() if m['id'] == mapping_id), None
+                )
+                if channel_mapping is None:
+                    logger.warning(f"⚠️ 映射 {mapping_id} 已不存在或已禁用，丢弃 {len(rows)} 条延迟消息")
+                    self.deferred_queue.remove(mapping_id, row_ids, released=False)
+                    continue
+                
+                context = self.application.context_types.context(self.application)
+                logger.info(
+                    f"⏰ 释放延迟消息 {len(rows)} 条 (映射 {mapping_id}, 剩余 {self.deferred_queue.pending_count() - len(rows)} 条)"
+                )
+                for _, update_data in rows:
+                    message = Update.de_json(update_data, self.application.bot).effective_message
+                    await self._dispatch_message(message, context, channel_mapping)
+                self.deferred_queue.remove(mapping_id, row_ids)
+                
+                await asyncio.sleep(release_interval)
+        except asyncio.CancelledError:
+            pass
+
+    def _reserve_publish(self, channel_mapping: dict = None, min_delay: float = None, max_delay: float = None,
+                         lane: str = None) -> PublishTicket:
+        """为目标频道预约下一个发布位置（默认使用消息级随机延迟）
+        
+        映射设置 preserve_order 为 false 时，每个通道单独排序，小消息不必等待之前的大文件发布。
+        """
+        target_channel = channel_mapping['target_channel'] if channel_mapping else self.config.target_channel_id
+        preserve_order = (channel_mapping or {}).get('settings', {}).get('preserve_order', True)
+        chain = PublishScheduler.DEFAULT_CHAIN if preserve_order or lane is None else lane
+        
+        if not self.config.delay_enabled:
+            return self.publish_scheduler.reserve(target_channel, chain=chain)
+        return self.publish_scheduler.reserve(
+            target_channel,
+            self.config.min_delay if min_delay is None else min_delay,
+            self.config.max_delay if max_delay is None else max_delay,
+            chain=chain
+        )
+
+    def _scheduler_key(self, mapping_id: Optional[str]) -> str:
+        """公平调度中的映射ID（多租户共享调度器时加上租户ID前缀）"""
+        mapping_id = mapping_id or DEFAULT_MAPPING
+        return f"{self.tenant_id}:{mapping_id}" if self.tenant_id else mapping_id
+
+    @asynccontextmanager
+    async def _download_slot(self, channel_mapping: Optional[dict], media_infos: List[dict], lane: str, job: Job):
+        """先占用租户配额，再在映射之间公平分配处理名额，最后按优先级通道占用下载槽位（/bump 过的任务优先）"""
+        mapping_id = self._scheduler_key(channel_mapping['id'] if channel_mapping else None)
+        settings = channel_mapping.get('settings', {}) if channel_mapping else None
+        cost = FairScheduler.estimate_cost(media_infos)
+        async with self.quota.download_slot() if self.quota else nullcontext():
+            async with self.fair_scheduler.slot(mapping_id, cost, settings, ticket=job, priority=job.bumped):
+                async with self.work_lanes.slot(lane, ticket=job, priority=job.bumped):
+                    if job.stage == STAGE_QUEUED:
+                        job.set_stage(STAGE_DOWNLOADING)
+                    yield
+
+    async def _handle_single_message(self, message: Message, context: ContextTypes.DEFAULT_TYPE, channel_mapping: dict = None,
+                                     ticket: PublishTicket = None, lane: str = LANE_EXPRESS):
+        """处理单独的消息（下载立即进行，发布前等待预约的发布时间）"""
+        published = False
+        if self.draining:
+            # 关闭排空开始后才启动的任务：不再处理，保存到检查点
+            self._checkpoint_message(message, channel_mapping)
+            if ticket:
+                self.publish_scheduler.release(ticket, False)
+            return
+        media_infos = self.media_downloader._get_all_media_info(message)
+        job = self.jobs.add(channel_mapping, message.chat_id, message.message_id,
+                            sum(media_info['file_size'] for media_info in media_infos), STAGE_QUEUED, message=message)
+        job.task = asyncio.current_task()
         try:
             # 检查消息是否包含媒体
             if self.bot_handler.has_media(message):
                 logger.info(f"📥 消息 {message.message_id} 包含媒体，开始下载...")
                 
-                # 消息级延迟已在上层处理，这里直接下载
-                
                 # 下载媒体文件
-                downloaded_files = await self.media_downloader.download_media(message, context.bot)
+                async with self._download_slot(channel_mapping, media_infos, lane, job):
+                    job.files = await self.media_downloader.download_media(message, context.bot)
+                downloaded_files = job.files
                 
                 if downloaded_files:
                     logger.info(f"📥 消息 {message.message_id} 下载完成，共 {len(downloaded_files)} 个文件")
+                    # 图片优化属于下载阶段，不占用发布时间
+                    await self.bot_handler.prepare_media(downloaded_files, channel_mapping)
                     
-                    # 消息级延迟已在上层处理，这里直接转发
+                    # 等待轮到该消息发布（保持目标频道内的顺序和随机间隔）
+                    job.set_stage(STAGE_SCHEDULED)
+                    if ticket:
+                        await self.publish_scheduler.wait_turn(ticket)
+                    job.set_stage(STAGE_PUBLISHING)
                     
                     logger.info(f"📤 开始转发消息 {message.message_id} 到目标频道...")
                     
                     # 转发消息到目标频道
-                    await self.bot_handler.forward_message(message, downloaded_files, context.bot, channel_mapping)
+                    sent_messages = await self.bot_handler.forward_message(message, downloaded_files, context.bot, channel_mapping)
+                    published = True
+                    self._record_published(message, channel_mapping, sent_messages, KIND_MEDIA)
                     logger.info(f"🎉 成功转发消息 {message.message_id} 到目标频道")
                     
                     # 自动清理已成功发布的文件
@@ -757,100 +1467,166 @@ class CompleteTelegramMediaBot:
             else:
                 logger.info(f"📝 消息 {message.message_id} 是纯文本消息")
                 
-                # 消息级延迟已在上层处理，这里直接转发
+                # 等待轮到该消息发布
+                job.set_stage(STAGE_SCHEDULED)
+                if ticket:
+                    await self.publish_scheduler.wait_turn(ticket)
+                job.set_stage(STAGE_PUBLISHING)
                 
                 # 转发纯文本消息
-                await self.bot_handler.forward_text_message(message, context.bot, channel_mapping)
+                sent_messages = await self.bot_handler.forward_text_message(message, context.bot, channel_mapping)
+                published = True
+                self._record_published(message, channel_mapping, sent_messages, KIND_TEXT)
                 logger.info(f"🎉 成功转发文本消息 {message.message_id} 到目标频道")
                 
+        except asyncio.CancelledError:
+            # /cancel 或关闭排空：清理已下载的文件
+            await self._cleanup_files(job.files)
+            raise
         except Exception as e:
             logger.error(f"❌ 处理消息 {message.message_id} 失败: {e}")
+        finally:
+            self.jobs.remove(job)
+            if ticket:
+                self.publish_scheduler.release(ticket, published)
 
     async def _handle_media_group_message(self, message: Message, context: ContextTypes.DEFAULT_TYPE, channel_mapping: dict = None):
         """处理媒体组消息"""
         media_group_id = message.media_group_id
+        group_key = (message.chat_id, media_group_id)
         current_time = asyncio.get_event_loop().time()
+        media_infos = self.media_downloader._get_all_media_info(message)
+        compiled_filter = self.content_filters.get(channel_mapping)
+        if compiled_filter and compiled_filter.check_message(message, check_text=False):
+            media_infos = []  # 文件不符合过滤规则（已在路由后记录），只保留caption
         
-        # 如果媒体组不存在，创建新的
-        if media_group_id not in self.media_groups:
-            self.media_groups[media_group_id] = {
-                'messages': [],
-                'timer': None,
-                'last_message_time': current_time,
-                'start_time': current_time,
-                'status': 'collecting',  # collecting, downloading, completed
-                'download_start_time': None,
-                'channel_mapping': channel_mapping,  # 保存频道映射信息
-            }
+        # 如果媒体组不存在，创建新的（已完成的媒体组晚到的消息按策略处理，不再单独发布）
+        group = self.media_groups.get(group_key)
+        if group is None:
+            tombstone = self.media_group_tombstones.get(group_key)
+            if tombstone is not None:
+                await self._handle_late_media_group_message(message, tombstone, context, channel_mapping)
+                return
+            
+            self._enforce_media_group_cap(context)
+            
+            group = MediaGroup(message.chat_id, media_group_id, channel_mapping, current_time)
+            # 按第一条消息到达的顺序预约发布
+            group.publish_ticket = self._reserve_publish(channel_mapping, lane=self.work_lanes.classify(media_infos))
+            group.job = self.jobs.add(channel_mapping, message.chat_id, message.message_id, 0, STAGE_COLLECTING, group=group)
+            self.media_groups[group_key] = group
             
             # 只在新建媒体组时设置定时器
             logger.info(f"📦 创建新媒体组 {media_group_id}")
-            self.media_groups[media_group_id]['timer'] = asyncio.create_task(
-                self._process_media_group_after_timeout(media_group_id, context)
+            group.timer = asyncio.create_task(
+                self._process_media_group_after_timeout(group_key, context)
             )
         
-        # 如果媒体组已经完成，忽略新消息
-        if self.media_groups[media_group_id]['status'] == 'completed':
-            logger.info(f"媒体组 {media_group_id} 已完成，忽略新消息")
+        # 媒体组已经开始发布，文件列表已确定：按晚到的消息处理（不单独发布）
+        if group.status in ('publishing', 'completed'):
+            self.media_group_tombstones.stats['dropped'] += 1
+            logger.info(f"🪦 媒体组 {media_group_id} 已开始发布，丢弃晚到的消息 {message.message_id}（不单独发布）")
             return
         
-        # 如果媒体组正在下载，说明这是延迟到达的消息，应该添加到当前媒体组
-        if self.media_groups[media_group_id]['status'] == 'downloading':
-            logger.info(f"媒体组 {media_group_id} 正在下载，将延迟消息 {message.message_id} 加入当前组")
-            # 直接添加到当前媒体组的消息列表，而不是等待队列
-            self.media_groups[media_group_id]['messages'].append(message)
-            self.media_groups[media_group_id]['last_message_time'] = current_time
-            logger.info(f"媒体组 {media_group_id} 现在有 {len(self.media_groups[media_group_id]['messages'])} 条消息（包含延迟消息）")
+        # 如果媒体组正在下载或等待发布，说明这是延迟到达的消息，应该添加到当前媒体组（发布前一起下载）
+        if group.status in ('downloading', 'scheduled'):
+            logger.info(f"媒体组 {media_group_id} 正在下载或等待发布，将延迟消息 {message.message_id} 加入当前组")
+            # 直接添加到当前媒体组的文件列表，而不是等待队列
+            self._start_album_prefetch(group, group.add(message, media_infos, current_time), context)
+            logger.info(f"媒体组 {media_group_id} 现在有 {len(group.items)} 个文件（包含延迟消息）")
             return
         
-        # 添加消息到媒体组
-        self.media_groups[media_group_id]['messages'].append(message)
-        self.media_groups[media_group_id]['last_message_time'] = current_time
-        logger.info(f"媒体组 {media_group_id} 现在有 {len(self.media_groups[media_group_id]['messages'])} 条消息")
+        # 添加消息到媒体组（只保存需要的字段，不保留 Message 对象）
+        self._start_album_prefetch(group, group.add(message, media_infos, current_time), context)
+        logger.info(f"媒体组 {media_group_id} 现在有 {len(group.items)} 个文件")
         
         # 关键修复：不再重复取消和重新设置定时器！
         # 让原始定时器继续运行，它会在超时后检查 last_message_time
 
-    async def _process_media_group_after_timeout(self, media_group_id: str, context: ContextTypes.DEFAULT_TYPE):
+    async def _handle_late_media_group_message(self, message: Message, tombstone, context: ContextTypes.DEFAULT_TYPE,
+                                               channel_mapping: dict = None):
+        """处理已完成媒体组晚到的消息：默认丢弃；edit 策略下，如果晚到的消息带有caption而已发布的相册没有，补充到已发布的相册"""
+        media_group_id = message.media_group_id
+        if (self.config.media_group_late_policy == 'edit' and message.caption
+                and not tombstone.has_caption and tombstone.first_message_id):
+            try:
+                await context.bot.edit_message_caption(
+                    chat_id=tombstone.target_chat,
+                    message_id=tombstone.first_message_id,
+                    caption=self.bot_handler.build_caption(message.caption, channel_mapping),
+                    parse_mode='HTML'
+                )
+                tombstone.has_caption = True
+                self.media_group_tombstones.stats['edited'] += 1
+                logger.info(f"✏️ 媒体组 {media_group_id} 晚到的消息 {message.message_id} 带有caption，已补充到已发布的相册")
+                return
+            except TelegramError as e:
+                logger.warning(f"⚠️ 补充媒体组 {media_group_id} 的caption失败: {e}")
+        
+        self.media_group_tombstones.stats['dropped'] += 1
+        logger.info(f"🪦 媒体组 {media_group_id} 已完成，丢弃晚到的消息 {message.message_id}（不单独发布）")
+
+    def _enforce_media_group_cap(self, context: ContextTypes.DEFAULT_TYPE):
+        """同时收集的媒体组达到上限时，提前开始处理最早的媒体组（不丢弃消息）"""
+        if len(self.media_groups) < self.config.media_group_max_open:
+            return
+        
+        for group_key, group in self.media_groups.items():  # 字典按创建顺序，最早的在前
+            if group.status == 'collecting':
+                media_group_id = group_key[1]
+                logger.warning(
+                    f"⚠️ 同时收集的媒体组达到上限 {self.config.media_group_max_open}，"
+                    f"提前处理最早的媒体组 {media_group_id} ({len(group.items)} 个文件)"
+                )
+                if group.timer:
+                    group.timer.cancel()
+                group.status = 'downloading'  # 立即标记，避免重复提前处理
+                self.media_group_stats['early_flushes'] += 1
+                self.application.create_task(self._start_media_group_download(group_key, context))
+                return
+
+    async def _process_media_group_after_timeout(self, group_key: Tuple[int, str], context: ContextTypes.DEFAULT_TYPE):
         """智能处理媒体组超时"""
+        media_group_id = group_key[1]
         try:
             # 等待超时（收集阶段用短间隔，下载阶段用长间隔）
-            sleep_time = self.media_group_timeout if media_group_id not in self.media_groups or self.media_groups[media_group_id]['status'] == 'collecting' else self.download_progress_check_interval
+            group = self.media_groups.get(group_key)
+            sleep_time = self.media_group_timeout if group is None or group.status == 'collecting' else self.download_progress_check_interval
             await asyncio.sleep(sleep_time)
             
-            if media_group_id not in self.media_groups:
+            group = self.media_groups.get(group_key)
+            if group is None:
                 return
                 
             current_time = asyncio.get_event_loop().time()
-            group_data = self.media_groups[media_group_id]
             
             # 状态机处理
-            if group_data['status'] == 'collecting':
+            if group.status == 'collecting':
                 # 检查是否最近有新消息
-                time_since_last_message = current_time - group_data['last_message_time']
-                total_wait_time = current_time - group_data['start_time']
+                time_since_last_message = current_time - group.last_message_time
+                total_wait_time = current_time - group.start_time
                 
                 logger.info(f"📦 媒体组 {media_group_id} 检查: 距上次消息 {time_since_last_message:.1f}s, 总等待 {total_wait_time:.1f}s")
                 
                 if time_since_last_message < self.media_group_timeout and total_wait_time < self.media_group_max_wait:
                     # 还有新消息且未超过最大等待时间，继续等待
                     logger.info(f"📦 媒体组 {media_group_id} 继续等待新消息...")
-                    group_data['timer'] = asyncio.create_task(
-                        self._process_media_group_after_timeout(media_group_id, context)
+                    group.timer = asyncio.create_task(
+                        self._process_media_group_after_timeout(group_key, context)
                     )
                     return
                 else:
                     # 没有新消息或超过最大等待时间，开始下载
                     reason = "超过最大等待时间" if total_wait_time >= self.media_group_max_wait else "没有新消息"
-                    logger.info(f"📦 媒体组 {media_group_id} {reason}，开始下载 ({len(group_data['messages'])} 条消息)")
-                    await self._start_media_group_download(media_group_id, context)
+                    logger.info(f"📦 媒体组 {media_group_id} {reason}，开始下载 ({len(group.items)} 个文件)")
+                    await self._start_media_group_download(group_key, context)
                     
-            elif group_data['status'] == 'downloading':
+            elif group.status == 'downloading':
                 # 下载阶段：检查下载超时
-                download_time = current_time - group_data['download_start_time']
+                download_time = current_time - group.download_start_time
                 if download_time > self.download_timeout:
                     logger.error(f"❌ 媒体组 {media_group_id} 下载超时（{download_time:.1f}秒），放弃处理")
-                    del self.media_groups[media_group_id]
+                    self._drop_media_group(group_key)
                 else:
                     # 继续等待下载完成
                     minutes = int(download_time // 60)
@@ -861,8 +1637,8 @@ class CompleteTelegramMediaBot:
                         time_str = f"{seconds}秒"
                     
                     logger.info(f"📥 媒体组 {media_group_id} 正在下载中，已用时 {time_str} (超时时间: {self.download_timeout//60}分钟)")
-                    group_data['timer'] = asyncio.create_task(
-                        self._process_media_group_after_timeout(media_group_id, context)
+                    group.timer = asyncio.create_task(
+                        self._process_media_group_after_timeout(group_key, context)
                     )
                 
         except asyncio.CancelledError:
@@ -870,92 +1646,200 @@ class CompleteTelegramMediaBot:
         except Exception as e:
             logger.error(f"❌ 处理媒体组 {media_group_id} 时出错: {e}")
             # 清理媒体组缓存
-            if media_group_id in self.media_groups:
-                del self.media_groups[media_group_id]
+            self._drop_media_group(group_key)
+
+    def _drop_media_group(self, group_key: Tuple[int, str], published: bool = False):
+        """移除媒体组缓存并释放其发布预约（避免阻塞同一目标频道的后续内容），留下墓碑记录识别晚到的消息"""
+        group = self.media_groups.pop(group_key, None)
+        if group is None:
+            return
+        self._discard_album_prefetch(group)
+        self.transfer_progress.finish_album(group.label)
+        self.jobs.remove(group.job)
+        if group.publish_ticket:
+            self.publish_scheduler.release(group.publish_ticket, published)
+        target_channel = group.channel_mapping['target_channel'] if group.channel_mapping else self.config.target_channel_id
+        self.media_group_tombstones.add(group_key, target_channel, group.published_message_id, bool(group.caption))
+
+    def _start_album_prefetch(self, group: MediaGroup, items: List[AlbumItem], context: ContextTypes.DEFAULT_TYPE):
+        """媒体文件到达后立即开始下载（与收集并行），结果由 _start_media_group_download 直接使用"""
+        if not self.config.media_group_prefetch:
+            return
+        for item in items:
+            item.prefetch = asyncio.create_task(self._prefetch_album_item(group, item, context))
+
+    async def _prefetch_album_item(self, group: MediaGroup, item: AlbumItem, context: ContextTypes.DEFAULT_TYPE) -> List[dict]:
+        # 收集期间还不知道整个媒体组的大小，按单个文件选择通道
+        media_infos = [item.media_info()]
+        async with self._download_slot(group.channel_mapping, media_infos, self.work_lanes.classify(media_infos), group.job):
+            with self.transfer_progress.album(group.label, group.total_size()):
+                return await self.media_downloader.download_media_infos(item.message_id, media_infos, context.bot)
+
+    async def _take_album_prefetch(self, item: AlbumItem) -> Optional[List[dict]]:
+        """等待并取出预取结果；没有预取或预取失败时返回 None（调用方正常下载）"""
+        task, item.prefetch = item.prefetch, None
+        if task is None:
+            return None
+        try:
+            # shield：调用方被取消时不直接取消预取任务，而是由下面统一放弃并清理
+            downloaded_files = await asyncio.shield(task)
+        except asyncio.CancelledError:
+            if task.cancelled():
+                return None
+            self._discard_prefetch_task(task)
+            raise
+        except Exception as e:
+            logger.warning(f"⚠️ 媒体组文件 {item.file_name} 预取失败，重新下载: {e}")
+            return None
+        self.media_group_stats['prefetched'] += 1
+        return downloaded_files
+
+    def _discard_album_prefetch(self, group: MediaGroup):
+        """放弃媒体组中未使用的预取任务（取消下载，已下载的文件清理掉）"""
+        for item in group.items:
+            task, item.prefetch = item.prefetch, None
+            if task is not None:
+                self._discard_prefetch_task(task)
+
+    def _discard_prefetch_task(self, task: asyncio.Task):
+        self.media_group_stats['prefetch_discarded'] += 1
+        task.add_done_callback(self._cleanup_prefetch_result)
+        task.cancel()
+
+    def _cleanup_prefetch_result(self, task: asyncio.Task):
+        if not task.cancelled() and task.exception() is None and task.result():
+            asyncio.ensure_future(self._cleanup_files(task.result()))
+
+    async def _download_album_items(self, group: MediaGroup, start: int, lane: str, context: ContextTypes.DEFAULT_TYPE) -> int:
+        """按顺序下载媒体组从 start 开始的文件（下载过程中新加入的文件也一起下载），返回下一个待下载的位置"""
+        media_group_id = group.media_group_id
+        all_downloaded_files = group.job.files
+        i = start
+        while i < len(group.items):
+            item = group.items[i]
+            current_total = len(group.items)
+            
+            logger.info(f"📥 下载媒体组 {media_group_id} 第 {i+1}/{current_total} 个文件")
+            # 收集期间已开始的预取直接使用结果，否则现在下载
+            downloaded_files = await self._take_album_prefetch(item)
+            if downloaded_files is None:
+                media_infos = [item.media_info()]
+                async with self._download_slot(group.channel_mapping, media_infos, lane, group.job):
+                    with self.transfer_progress.album(group.label, group.total_size()):
+                        downloaded_files = await self.media_downloader.download_media_infos(item.message_id, media_infos, context.bot)
+            for file_info in downloaded_files:
+                file_info['message_id'] = item.message_id  # 关闭排空时按源消息区分已发出和未发出的文件
+            all_downloaded_files.extend(downloaded_files)
+            logger.info(f"✅ 完成下载第 {i+1}/{current_total} 个文件，共获得 {len(downloaded_files)} 个文件")
+            
+            i += 1
+            
+            # 检查是否有新消息在下载过程中添加
+            if len(group.items) > current_total:
+                logger.info(f"📦 下载过程中发现新消息，媒体组 {media_group_id} 现在有 {len(group.items)} 个文件")
+        return i
 
-    async def _start_media_group_download(self, media_group_id: str, context: ContextTypes.DEFAULT_TYPE):
+    async def _start_media_group_download(self, group_key: Tuple[int, str], context: ContextTypes.DEFAULT_TYPE):
         """开始媒体组下载"""
+        media_group_id = group_key[1]
+        if self.draining:
+            return  # 收集中的媒体组由关闭排空保存到检查点
         try:
-            if media_group_id not in self.media_groups:
+            group = self.media_groups.get(group_key)
+            if group is None:
+                return
+            
+            # 下载前过滤：没有caption的媒体组在这里判断关键词；文件全部被过滤时跳过
+            rule = self.content_filters.check_text(group.caption, group.channel_mapping, self._pending_album_bytes(group))
+            if rule or not group.items:
+                reason = f"不符合过滤规则 {rule}" if rule else "所有文件都被过滤规则跳过"
+                logger.info(f"🚫 媒体组 {media_group_id} {reason}，不下载")
+                self._drop_media_group(group_key)
                 return
-                
-            group_data = self.media_groups[media_group_id]
-            messages = group_data['messages']
+            
+            job = group.job
+            job.task = asyncio.current_task()
+            job.set_stage(STAGE_QUEUED)
             
             # 更新状态
-            group_data['status'] = 'downloading'
-            group_data['download_start_time'] = asyncio.get_event_loop().time()
+            group.status = 'downloading'
+            group.download_start_time = asyncio.get_event_loop().time()
             
-            logger.info(f"开始处理媒体组 {media_group_id}，包含 {len(messages)} 条消息")
+            logger.info(f"开始处理媒体组 {media_group_id}，包含 {len(group.items)} 个文件")
             
-            # 添加消息级延迟（以整个媒体组为单位）
-            if self.config.delay_enabled:
-                delay = random.uniform(self.config.min_delay, self.config.max_delay)
-                logger.info(f"⏱️ 媒体组 {media_group_id} 处理前等待 {delay:.1f}s（模拟人工操作）")
-                await asyncio.sleep(delay)
+            # 消息级延迟（以整个媒体组为单位）由发布调度器在发布前处理，这里直接下载
             
             # 设置下载进度监控
-            group_data['timer'] = asyncio.create_task(
-                self._process_media_group_after_timeout(media_group_id, context)
+            group.timer = asyncio.create_task(
+                self._process_media_group_after_timeout(group_key, context)
             )
             
-            # 下载所有媒体文件（动态更新消息列表）
-            all_downloaded_files = []
+            # 下载所有媒体文件（动态更新文件列表），按整个媒体组的大小选择通道
+            all_downloaded_files = job.files
+            lane = self.work_lanes.classify(group.media_infos())
             
             logger.info(f"📥 开始下载媒体组 {media_group_id} 的所有文件...")
             
-            i = 0
-            while i < len(group_data['messages']):
-                message = group_data['messages'][i]
-                current_total = len(group_data['messages'])
-                
-                if self.bot_handler.has_media(message):
-                    logger.info(f"📥 下载媒体组 {media_group_id} 第 {i+1}/{current_total} 个文件")
-                    downloaded_files = await self.media_downloader.download_media(message, context.bot)
-                    all_downloaded_files.extend(downloaded_files)
-                    logger.info(f"✅ 完成下载第 {i+1}/{current_total} 个文件，共获得 {len(downloaded_files)} 个文件")
-                
-                i += 1
-                
-                # 检查是否有新消息在下载过程中添加
-                if len(group_data['messages']) > current_total:
-                    logger.info(f"📦 下载过程中发现新消息，媒体组 {media_group_id} 现在有 {len(group_data['messages'])} 条消息")
-            
+            downloaded_count = await self._download_album_items(group, 0, lane, context)
             logger.info(f"📥 媒体组 {media_group_id} 所有文件下载完成，共 {len(all_downloaded_files)} 个文件")
+            self.transfer_progress.finish_album(group.label)
             
             # 取消进度监控定时器
-            if group_data['timer']:
-                group_data['timer'].cancel()
+            if group.timer:
+                group.timer.cancel()
             
             # 转发消息（消息级延迟已在上层处理）
             if all_downloaded_files:
-                
-                # 使用第一条消息作为代表进行转发
-                representative_message = messages[0]
-                for msg in messages:
-                    if self.bot_handler.has_media(msg):
-                        representative_message = msg
-                        break
-                
-                logger.info(f"📤 开始转发媒体组 {media_group_id} 到目标频道...")
-                
                 try:
-                    # 使用保存的频道映射信息进行转发
-                    channel_mapping = group_data.get('channel_mapping')
-                    await self.bot_handler.forward_message(representative_message, all_downloaded_files, context.bot, channel_mapping=channel_mapping, send_lock=self.send_lock)
+                    # 图片优化属于下载阶段，不占用发布时间
+                    await self.bot_handler.prepare_media(all_downloaded_files, group.channel_mapping)
+                    
+                    # 等待轮到该媒体组发布（保持目标频道内的顺序和随机间隔）
+                    group.status = 'scheduled'
+                    job.set_stage(STAGE_SCHEDULED)
+                    await self.publish_scheduler.wait_turn(group.publish_ticket)
+                    group.status = 'publishing'
+                    job.set_stage(STAGE_PUBLISHING)
+                    
+                    # 等待发布期间晚到的文件（已开始预取）一起发布
+                    if len(group.items) > downloaded_count:
+                        logger.info(f"📥 媒体组 {media_group_id} 等待发布期间新增 {len(group.items) - downloaded_count} 个文件，发布前下载")
+                        await self._download_album_items(group, downloaded_count, lane, context)
+                        self.transfer_progress.finish_album(group.label)
+                    
+                    logger.info(f"📤 开始转发媒体组 {media_group_id} 到目标频道...")
+                    
+                    # 使用保存的频道映射信息和caption进行转发
+                    channel_mapping = group.channel_mapping
+                    sent_messages = await self.bot_handler.publish_media(all_downloaded_files, group.caption, context.bot, channel_mapping,
+                                                                         send_lock=self.send_lock, progress=job.sent)
+                    group.published_message_id = sent_messages[0].message_id if sent_messages else None
+                    self.publish_scheduler.release(group.publish_ticket)
                     
                     target_channel = channel_mapping['target_channel'] if channel_mapping else self.config.target_channel_id
-                    download_time = asyncio.get_event_loop().time() - group_data['download_start_time']
+                    if self.message_map:
+                        self.message_map.record(
+                            group.chat_id, source_key(0, media_group_id), target_channel, sent_messages, KIND_MEDIA,
+                            group.caption_message_id, sorted({item.message_id for item in group.items})
+                        )
+                    download_time = asyncio.get_event_loop().time() - group.download_start_time
                     logger.info(f"🎉 成功转发媒体组 {media_group_id} 到目标频道 {target_channel}！包含 {len(all_downloaded_files)} 个文件，总耗时 {download_time:.1f} 秒")
                     
                     # 更新状态为完成
-                    group_data['status'] = 'completed'
+                    group.status = 'completed'
                     
                     # 自动清理已成功发布的文件
                     logger.info(f"🧹 开始清理媒体组 {media_group_id} 的本地文件...")
                     await self._cleanup_files(all_downloaded_files)
                     logger.info(f"🧹 媒体组 {media_group_id} 文件清理完成")
                     
+                except AlbumSendError as e:
+                    # 部分批次可能已经发布：不记录为已发布，只清理已发出的文件，保留没有发出的文件
+                    logger.error(f"❌ 转发媒体组 {media_group_id} 失败（已发布 {len(e.sent_messages)} 条消息）: {e}")
+                    await self._cleanup_files(e.sent_files)
+                    kept = self._keep_unsent_files(e.unsent_files)
+                    logger.warning(f"📁 媒体组 {media_group_id} 保留未发出的 {len(kept)} 个文件: {', '.join(kept)}")
+                    raise
                 except Exception as e:
                     logger.error(f"❌ 转发媒体组 {media_group_id} 失败: {e}")
                     logger.info(f"🧹 转发失败，清理本地文件...")
@@ -966,20 +1850,218 @@ class CompleteTelegramMediaBot:
             
             # 不再需要处理等待队列，因为延迟消息已经直接加入当前媒体组
             
-            # 清理媒体组缓存
-            del self.media_groups[media_group_id]
+            # 清理媒体组缓存（未发布时释放预约，避免阻塞后续内容）
+            self._drop_media_group(group_key)
             
+        except asyncio.CancelledError:
+            # /cancel 或关闭排空：清理已下载的文件，停止预取
+            if group is not None:
+                await self._cleanup_files(group.job.files)
+                if group.timer:
+                    group.timer.cancel()
+            self._drop_media_group(group_key)
+            raise
         except Exception as e:
             logger.error(f"下载媒体组 {media_group_id} 时出错: {e}")
             # 清理媒体组缓存
-            if media_group_id in self.media_groups:
-                del self.media_groups[media_group_id]
+            self._drop_media_group(group_key)
+
+    def _checkpoint_message(self, message: Message, channel_mapping: Optional[dict]):
+        """把单条消息保存到关闭检查点"""
+        mapping_id = channel_mapping['id'] if channel_mapping else DEFAULT_MAPPING
+        self.drain_checkpoint.push_data(mapping_id, str(message.chat_id), {'update_id': 0, 'channel_post': message.to_dict()}, message.media_group_id)
+
+    def _checkpoint_group(self, group: MediaGroup):
+        """把媒体组（重建为原始消息）保存到关闭检查点"""
+        mapping_id = group.channel_mapping['id'] if group.channel_mapping else DEFAULT_MAPPING
+        for update_data in group.to_update_dicts():
+            self.drain_checkpoint.push_data(mapping_id, str(group.chat_id), update_data, group.media_group_id)
+
+    def _checkpoint_job(self, job: Job) -> bool:
+        """保存任务到检查点；发布中途取消的媒体组只保存还没发出的文件（已发出的批次记录到消息映射），
+        全部已发出时不保存，返回 False"""
+        group = job.group
+        if group is None:
+            self._checkpoint_message(job.message, job.channel_mapping)
+            return True
+        if job.sent:
+            sent_ids = {file_info.get('message_id') for files, _ in job.sent for file_info in files}
+            sent_messages = [message for _, messages in job.sent for message in messages]
+            if self.message_map:
+                target_channel = group.channel_mapping['target_channel'] if group.channel_mapping else self.config.target_channel_id
+                self.message_map.record(
+                    group.chat_id, source_key(0, group.media_group_id), target_channel, sent_messages, KIND_MEDIA,
+                    group.caption_message_id, sorted(sent_ids)
+                )
+            if any(message.caption for message in sent_messages):
+                group.caption = ""  # caption 已经随发出的批次发布
+                group.caption_entities = ()
+            group.items = [item for item in group.items if item.message_id not in sent_ids]
+            logger.info(f"🚰 媒体组 {group.media_group_id} 已发出 {len(sent_ids)} 条源消息，检查点只保存剩余的 {len(group.items)} 条")
+            if not group.items:
+                return False
+        self._checkpoint_group(group)
+        return True
+
+    async def _drain(self):
+        """关闭排空：停止接收新消息，等待正在发布的内容完成（最多 SHUTDOWN_DRAIN_TIMEOUT 秒），
+        其余内容（收集中的媒体组、下载中或等待发布时间的消息）保存到检查点，重启后恢复"""
+        started = time.monotonic()
+        self.draining = True
+        self.polling_active = False  # 立即停止处理新消息（后续已拉取的消息进入检查点）
+        report = {'published': 0, 'failed': 0, 'checkpointed_messages': 0, 'checkpointed_albums': 0, 'backfills_stopped': 0}
+        
+        # 回填任务：请求停止（当前消息发布完后停在检查点，下次 /backfill 继续），下面统一等待
+        backfill_tasks = set(self.backfill_tasks)
+        if self.backfill_engine:
+            for mapping_id in list(self.backfill_engine.jobs):
+                if self.backfill_engine.request_stop(mapping_id):
+                    report['backfills_stopped'] += 1
+        
+        def checkpoint(job: Job):
+            if not self._checkpoint_job(job):
+                return
+            if job.group is not None:
+                report['checkpointed_albums'] += 1
+            else:
+                report['checkpointed_messages'] += 1
+        
+        # 1. 还没有处理任务的媒体组（收集中，或提前处理但还没开始）：停止定时器，整体保存
+        unfinished = []
+        for job in self.jobs.jobs():
+            if job.task is None:
+                group = job.group
+                if group.timer:
+                    group.timer.cancel()
+                self._discard_album_prefetch(group)
+                unfinished.append(job)
+                self.media_groups.pop((group.chat_id, group.media_group_id), None)
+                self.jobs.remove(job)
+        
+        # 2. 还没开始发布的任务（下载中/等待发布时间）：取消，和媒体组一起按源消息顺序保存
+        waiting = {job.task: job for job in self.jobs.jobs() if job.task is not None and job.stage != STAGE_PUBLISHING}
+        for task, job in waiting.items():
+            unfinished.append(job)
+            task.cancel()
+        unfinished.sort(key=lambda job: (job.chat_id, job.message_id))
+        for job in unfinished:
+            checkpoint(job)
+        
+        # 3. 正在发布的任务：等待完成，超过截止时间后取消并保存
+        publishing = {job.task: job for job in self.jobs.jobs() if job.task is not None and job.task not in waiting}
+        timed_out = []
+        if publishing:
+            logger.info(f"🚰 关闭排空: 等待 {len(publishing)} 个正在发布的任务完成（最多 {self.config.shutdown_drain_timeout:.0f}s）")
+            done, pending = await asyncio.wait(publishing, timeout=self.config.shutdown_drain_timeout)
+            for task in done:
+                report['published' if not task.cancelled() and task.exception() is None else 'failed'] += 1
+            for task in pending:
+                task.cancel()
+                timed_out.append(publishing[task])
+        await asyncio.gather(*waiting, *publishing, return_exceptions=True)
+        # 取消完成后再保存：媒体组可能已经发出了部分批次
+        for job in timed_out:
+            checkpoint(job)
+        
+        # 4. 回填任务：在剩余的排空时间内等待停止，超时后取消（检查点只推进到已发布的消息）
+        if backfill_tasks:
+            remaining = max(0.0, self.config.shutdown_drain_timeout - (time.monotonic() - started))
+            logger.info(f"🚰 关闭排空: 等待 {len(backfill_tasks)} 个回填任务停止（最多 {remaining:.0f}s）")
+            _, pending = await asyncio.wait(backfill_tasks, timeout=remaining)
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*backfill_tasks, return_exceptions=True)
+        
+        # 剩余媒体组的进度监控定时器和预取任务
+        for group in self.media_groups.values():
+            if group.timer:
+                group.timer.cancel()
+            self._discard_album_prefetch(group)
+        
+        report['elapsed'] = time.monotonic() - started
+        self.drain_report = report
+        logger.info(
+            f"🚰 关闭排空完成 ({report['elapsed']:.1f}s): 完成发布 {report['published']} 个, 失败 {report['failed']} 个, "
+            f"保存到检查点 {report['checkpointed_messages']} 条消息 + {report['checkpointed_albums']} 个媒体组 "
+            f"(检查点共 {self.drain_checkpoint.pending_count()} 条), 停止回填 {report['backfills_stopped']} 个"
+        )
+
+    async def _restore_drain_checkpoint(self):
+        """按原顺序恢复上次关闭时保存到检查点的消息"""
+        if not self.drain_checkpoint.pending_count():
+            return
+        logger.info(f"♻️ 恢复上次关闭时保存的 {self.drain_checkpoint.pending_count()} 条未完成消息")
+        if not self.polling_active:
+            logger.info("⏸️ 自定义轮询未启动，检查点中的消息在轮询启动后恢复")
+        context = self.application.context_types.context(self.application)
+        try:
+            await self._replay_checkpoint(context)
+        except Exception as e:
+            logger.error(f"❌ 恢复检查点消息失败（未恢复的消息保留在检查点中）: {e}")
+
+    async def _replay_checkpoint(self, context: ContextTypes.DEFAULT_TYPE):
+        """和实时消息走同样的入口：轮询停止时等待，时间段外或映射有积压时转入延迟队列"""
+        restored = 0
+        while not self.draining:
+            if not self.polling_active:
+                await asyncio.sleep(1)
+                continue
+            mapping_id, rows = self.drain_checkpoint.peek_post()
+            if not rows:
+                break
+            row_ids = [row_id for row_id, _ in rows]
+            channel_mapping = None
+            if mapping_id != DEFAULT_MAPPING:
+                channel_mapping = next(
+                    (m for m in self.config.get_enabled_channel_mappings() if m['id'] == mapping_id), None
+                )
+                if channel_mapping is None:
+                    logger.warning(f"⚠️ 映射 {mapping_id} 已不存在或已禁用，丢弃检查点中的 {len(rows)} 条消息")
+                    self.drain_checkpoint.remove(mapping_id, row_ids, released=False)
+                    continue
+            gate = self._time_gate(mapping_id)
+            if gate == GATE_CLOSED:
+                # 时间段外且没有延迟队列：保留在检查点中，窗口开启后再恢复
+                window = self.config.time_window
+                await asyncio.sleep(min(window.seconds_until_change(), 60) if window else 60)
+                continue
+            for _, update_data in rows:
+                message = Update.de_json(update_data, self.application.bot).effective_message
+                if self.message_map and await self.message_map.find_by_message(message.chat_id, message.message_id):
+                    # 关闭前已经发布（发布超时被取消时可能已经发出）：不重复发布
+                    logger.info(f"♻️ 检查点消息 {message.chat_id}/{message.message_id} 已经发布过，跳过")
+                    continue
+                if gate == GATE_DEFER:
+                    # 时间段外或映射还有积压：转入延迟队列，窗口开启后按顺序释放
+                    post = update_data['channel_post']
+                    self.deferred_queue.push_data(mapping_id, str(post['chat']['id']), update_data, post.get('media_group_id'))
+                    self._deferred_wakeup.set()
+                    continue
+                await self._dispatch_message(message, context, channel_mapping)
+            self.drain_checkpoint.remove(mapping_id, row_ids)
+            restored += len(rows)
+        logger.info(f"♻️ 已恢复 {restored} 条检查点消息")
+
+    def _keep_unsent_files(self, file_infos: List[dict]) -> List[str]:
+        """保留发送失败的文件：内存暂存的文件写入下载目录，返回文件路径"""
+        paths = []
+        for file_info in file_infos:
+            staged = file_info.pop('staged', None)
+            if staged:
+                file_info['path'] = staged.spill(self.config.download_path)
+            paths.append(str(file_info['path']))
+        return paths
 
     async def _cleanup_files(self, file_infos: list):
         """清理已成功发布的文件"""
         import os
         for file_info in file_infos:
             try:
+                # 内存暂存的文件：释放内存预算
+                staged = staged_buffer(file_info)
+                if staged:
+                    staged.release()
+                
                 # 处理文件格式 {'path': Path, 'type': str}
                 if isinstance(file_info, dict):
                     file_path = file_info['path']
@@ -987,9 +2069,14 @@ class CompleteTelegramMediaBot:
                     # 向后兼容旧格式
                     file_path = file_info
                     
-                if os.path.exists(file_path):
+                if file_path and os.path.exists(file_path):
                     os.remove(file_path)
                     logger.info(f"已清理文件: {file_path}")
+                
+                # 清理优化阶段生成的缩略图
+                thumbnail_path = file_info.get('thumbnail') if isinstance(file_info, dict) else None
+                if thumbnail_path and os.path.exists(thumbnail_path):
+                    os.remove(thumbnail_path)
             except Exception as e:
                 logger.error(f"清理文件 {file_info} 失败: {e}")
 
@@ -1003,18 +2090,27 @@ class CompleteTelegramMediaBot:
         # 命令处理器
         self.application.add_handler(CommandHandler("start", self.start_command))
         self.application.add_handler(CommandHandler("status", self.status_command))
+        self.application.add_handler(CommandHandler("transfers", self.transfers_command))
+        self.application.add_handler(CommandHandler("queue", self.queue_command))
+        self.application.add_handler(CommandHandler("cancel", self.cancel_command))
+        self.application.add_handler(CommandHandler("bump", self.bump_command))
+        self.application.add_handler(CommandHandler("unpublish", self.unpublish_command))
         self.application.add_handler(CommandHandler("start_polling", self.start_polling_command))
         self.application.add_handler(CommandHandler("stop_polling", self.stop_polling_command))
         self.application.add_handler(CommandHandler("polling_status", self.polling_status_command))
         self.application.add_handler(CommandHandler("set_interval", self.set_interval_command))
         self.application.add_handler(CommandHandler("random_download", self.random_download_command))
         self.application.add_handler(CommandHandler("selective_forward", self.selective_forward_command))
+        self.application.add_handler(CommandHandler("backfill", self.backfill_command))
+        self.application.add_handler(CommandHandler("backfill_status", self.backfill_status_command))
+        self.application.add_handler(CommandHandler("backfill_stop", self.backfill_stop_command))
         self.application.add_handler(CommandHandler("set_fixed_caption", self.set_fixed_caption_command))
         self.application.add_handler(CommandHandler("set_append_caption", self.set_append_caption_command))
         self.application.add_handler(CommandHandler("list_channels", self.list_channels_command))
         self.application.add_handler(CommandHandler("add_channel", self.add_channel_command))
         self.application.add_handler(CommandHandler("remove_channel", self.remove_channel_command))
         self.application.add_handler(CommandHandler("toggle_channel", self.toggle_channel_command))
+        self.application.add_handler(CommandHandler("reload_channels", self.reload_channels_command))
         
         # 消息处理器
         self.application.add_handler(MessageHandler(
@@ -1064,6 +2160,7 @@ class CompleteTelegramMediaBot:
         
         # 创建轮询任务
         self.polling_task = asyncio.create_task(self._polling_loop())
+        self._deferred_wakeup.set()
 
     async def stop_custom_polling(self):
         """停止自定义轮询"""
@@ -1129,38 +2226,42 @@ class CompleteTelegramMediaBot:
 
     async def run(self):
         """运行机器人"""
-        # 设置信号处理器
-        signal.signal(signal.SIGTERM, self.signal_handler)
-        signal.signal(signal.SIGINT, self.signal_handler)
+        if self.shared:
+            # 多租户：信号由宿主统一处理，本任务及其创建的任务的日志带租户ID
+            current_tenant.set(self.tenant_id)
+        else:
+            # 设置信号处理器
+            signal.signal(signal.SIGTERM, self.signal_handler)
+            signal.signal(signal.SIGINT, self.signal_handler)
         
         try:
             # 创建应用构建器
-            app_builder = Application.builder().token(self.config.bot_token)
+            app_builder = (
+                Application.builder()
+                .token(self.config.bot_token)
+                .base_url(self.config.bot_api_base_url)
+                .base_file_url(self.config.bot_api_base_file_url)
+            )
             
             # 配置代理
-            proxy_config = self.config.get_proxy_config()
-            if proxy_config:
-                logger.info(f"🌐 配置代理: {proxy_config['proxy_type']}://{proxy_config['host']}:{proxy_config['port']}")
-                try:
-                    # 为 httpx 配置代理
-                    if proxy_config['proxy_type'] == 'socks5':
-                        proxy_url = f"socks5://{proxy_config.get('username', '')}:{proxy_config.get('password', '')}@{proxy_config['host']}:{proxy_config['port']}"
-                        if not proxy_config.get('username'):
-                            proxy_url = f"socks5://{proxy_config['host']}:{proxy_config['port']}"
-                    elif proxy_config['proxy_type'] == 'http':
-                        proxy_url = f"http://{proxy_config.get('username', '')}:{proxy_config.get('password', '')}@{proxy_config['host']}:{proxy_config['port']}"
-                        if not proxy_config.get('username'):
-                            proxy_url = f"http://{proxy_config['host']}:{proxy_config['port']}"
-                    
-                    # 设置代理
-                    app_builder = app_builder.proxy(proxy_url)
-                    logger.info(f"✅ 代理配置成功: {proxy_url.split('@')[-1] if '@' in proxy_url else proxy_url}")
-                    
-                except Exception as e:
-                    logger.error(f"❌ 代理配置失败: {e}")
-                    logger.warning("⚠️ 将使用直连模式")
+            proxy_url = build_proxy_url(self.config)
+            
+            # 按流量类型创建独立连接池（长轮询/元数据/下载/上传互不抢占连接）
+            if self.shared:
+                # 多租户：长轮询连接独立，其余连接池共享（由宿主初始化和关闭）
+                self.http_requests = {
+                    **build_traffic_requests({TRAFFIC_POLL: self.config.http_pools[TRAFFIC_POLL]}, proxy_url),
+                    **self.shared.http_requests
+                }
             else:
-                logger.info("🔗 使用直连模式（未配置代理）")
+                self.http_requests = build_traffic_requests(self.config.http_pools, proxy_url, self.config.upload_sendfile_enabled)
+            app_builder = app_builder.get_updates_request(self.http_requests[TRAFFIC_POLL]).request(
+                TrafficRoutedRequest({
+                    traffic_class: request
+                    for traffic_class, request in self.http_requests.items()
+                    if traffic_class != TRAFFIC_POLL
+                }, manage_lifecycle=not self.shared)
+            )
             
             # 创建应用
             self.application = app_builder.build()
@@ -1168,8 +2269,32 @@ class CompleteTelegramMediaBot:
             # 初始化处理器
             if not self.bot_handler:
                 self.bot_handler = TelegramBotHandler(self.config)
+                self.bot_handler.image_processor = ImageProcessor(self.config)
+                self.bot_handler.publish_scheduler = self.publish_scheduler
             if not self.media_downloader:
                 self.media_downloader = MediaDownloader(self.config)
+            if self.shared:
+                # 多租户：共用内存暂存预算和图片处理进程池
+                self.media_downloader.staging_budget = self.shared.staging_budget
+                self.bot_handler.image_processor.executor_source = self.shared.image_processor
+            # 上传/下载共用按连接池实测吞吐量计算的截止时间
+            self.transfer_timeouts = TransferTimeouts(self.config, self.http_requests)
+            self.bot_handler.transfer_timeouts = self.transfer_timeouts
+            self.media_downloader.transfer_timeouts = self.transfer_timeouts
+            self.bot_handler.transfer_progress = self.transfer_progress
+            self.media_downloader.transfer_progress = self.transfer_progress
+            if self.config.message_index_enabled and not self.message_index:
+                self.message_index = MessageIndex(self.config.message_index_path)
+            if self.config.message_map_enabled and not self.message_map:
+                self.message_map = MessageMap(self.config.message_map_path, self.config.message_map_max_age_days)
+            if self.config.time_control_enabled and self.config.deferred_queue_enabled and not self.deferred_queue:
+                self.deferred_queue = DeferredQueue(self.config.deferred_queue_path)
+                if self.deferred_queue.pending_count():
+                    logger.info(f"⏰ 延迟队列中有 {self.deferred_queue.pending_count()} 条待释放消息")
+            if not self.drain_checkpoint:
+                self.drain_checkpoint = DeferredQueue(self.config.drain_checkpoint_path)
+            if self.config.update_record_enabled and not self.update_recorder:
+                self.update_recorder = UpdateRecorder(self.config.update_record_path)
             
             # 设置处理器
             self.setup_handlers()
@@ -1180,7 +2305,7 @@ class CompleteTelegramMediaBot:
             
             # 创建下载目录
             download_path = Path(self.config.download_path)
-            download_path.mkdir(exist_ok=True)
+            download_path.mkdir(parents=True, exist_ok=True)
             
             logger.info("🤖 Telegram媒体转发机器人启动成功！")
             logger.info(f"源频道: {self.config.source_channel_id}")
@@ -1205,6 +2330,23 @@ class CompleteTelegramMediaBot:
                     drop_pending_updates=True
                 )
                 
+                # 监视频道配置文件（热重载，不中断正在处理的消息）
+                if self.config.multi_channel_enabled and self.config.channels_hot_reload:
+                    self.config_watcher = ChannelsConfigWatcher(self.config, on_reload=self._on_channels_reloaded)
+                    self.config_watcher.start()
+                
+                # 后台刷新所有映射的频道元数据
+                self.chat_cache.start(self.application.bot)
+                
+                if self.deferred_queue:
+                    self.deferred_task = asyncio.create_task(self._deferred_release_loop())
+                
+                if self.config.metrics_port and not self.shared:
+                    self.metrics_server = MetricsServer(
+                        self.config.metrics_host, self.config.metrics_port, [self.transfer_progress.render_metrics]
+                    )
+                    await self.metrics_server.start()
+                
                 # 根据配置决定是否自动开始自定义轮询
                 if self.config.auto_polling and self.config.polling_enabled:
                     await self.start_custom_polling()
@@ -1212,27 +2354,91 @@ class CompleteTelegramMediaBot:
                 else:
                     logger.info("⏸️ 自定义轮询未自动启动，使用 /start_polling 命令手动启动")
                 
+                # 恢复上次关闭时保存的未完成消息
+                restore_task = asyncio.create_task(self._restore_drain_checkpoint())
+                
                 # 等待关闭信号
                 while not self.shutdown_flag:
                     await asyncio.sleep(1)
                 
+                # 关闭排空：停止接收新消息，正在发布的内容完成，其余保存到检查点
+                await self._drain()
+                await asyncio.gather(restore_task, return_exceptions=True)
+                
                 # 停止轮询
                 await self.application.updater.stop()
                 
+                if self.config_watcher:
+                    await self.config_watcher.stop()
+                await self.chat_cache.stop()
+                if self.deferred_task:
+                    self.deferred_task.cancel()
+                    await asyncio.gather(self.deferred_task, return_exceptions=True)
+                if self.metrics_server:
+                    await self.metrics_server.stop()
+                
                 # 停止轮询和应用
                 await self.stop_custom_polling()
                 await self.application.stop()
             
+            if self.backfill_engine:
+                await self.backfill_engine.stop()
+            if self.bot_handler and self.bot_handler.image_processor:
+                self.bot_handler.image_processor.shutdown()
+            if self.message_index:
+                self.message_index.close()
+            if self.message_map:
+                self.message_map.close()
+            if self.update_recorder:
+                self.update_recorder.close()
+            if self.deferred_queue:
+                self.deferred_queue.close()
+            if self.drain_checkpoint:
+                self.drain_checkpoint.close()
+            
             logger.info("机器人已正常关闭")
             
         except Exception as e:
             logger.error(f"机器人运行出错: {e}")
 
 
+async def run_tenants(tenants_file: str):
+    """多租户模式：在一个进程中运行租户配置文件中的所有机器人（共享连接池、下载槽位等资源）"""
+    tenants = load_tenants(tenants_file)
+    configs = {tenant['id']: Config(env=tenant_env(tenant)) for tenant in tenants}
+    first_config = configs[tenants[0]['id']]
+    shared = SharedResources(first_config, build_proxy_url(first_config))
+    bots = [
+        CompleteTelegramMediaBot(configs[tenant['id']], tenant_id=tenant['id'], shared=shared,
+                                 quota=TenantQuota(tenant['max_concurrent_downloads']))
+        for tenant in tenants
+    ]
+    logger.info(f"🏢 多租户模式: {len(bots)} 个租户 ({', '.join(bot.tenant_id for bot in bots)})")
+    
+    def signal_handler(signum, frame):
+        logger.info(f"收到信号 {signum}，关闭所有租户...")
+        for bot in bots:
+            bot.shutdown_flag = True
+    
+    signal.signal(signal.SIGTERM, signal_handler)
+    signal.signal(signal.SIGINT, signal_handler)
+    
+    await shared.start([lambda: render_transfer_metrics({bot.tenant_id: bot.transfer_progress for bot in bots})])
+    try:
+        # 每个租户的 run() 自行处理启动失败（记录日志后退出），不影响其他租户
+        await asyncio.gather(*(bot.run() for bot in bots))
+    finally:
+        await shared.stop()
+
+
 async def main():
     """主函数"""
-    bot = CompleteTelegramMediaBot()
+    tenants_file = os.getenv('TENANTS_CONFIG_FILE')
     try:
+        if tenants_file:
+            await run_tenants(tenants_file)
+            return
+        bot = CompleteTelegramMediaBot()
         await bot.run()
     except KeyboardInterrupt:
         logger.info("收到键盘中断，机器人已停止")
@@ -13,6 +13,10 @@ from telegram import Message
 from telegram.error import TelegramError
 
 from config import Config
+from http_pools import TRAFFIC_DOWNLOAD
+from memory_staging import StagedBuffer, StagingBudget
+from transfer_progress import DIRECTION_DOWNLOAD, TransferProgress
+from transfer_timeouts import TransferTimeouts
 
 logger = logging.getLogger(__name__)
 
@@ -23,24 +27,33 @@ class MediaDownloader:
     def __init__(self, config: Config):
         self.config = config
         self.download_path = Path(config.download_path)
-        self.download_path.mkdir(exist_ok=True)
+        self.download_path.mkdir(parents=True, exist_ok=True)
+        # 小文件直接下载到内存（超出预算时回退到磁盘）
+        self.staging_budget = StagingBudget(config.memory_staging_budget) if config.memory_staging_enabled else None
+        self.disk_stats = {'files': 0, 'bytes': 0}  # 经过下载目录的文件
+        self.transfer_timeouts = TransferTimeouts(config)  # 下载截止时间（主程序替换为带实测吞吐量的实例）
+        self.transfer_progress = TransferProgress()  # 下载进度（主程序替换为与上传共用的实例）
     
     async def download_media(self, message: Message, bot=None) -> List[dict]:
         """下载消息中的媒体文件，返回文件路径和类型信息"""
+        # 检查消息是否包含媒体
+        if not self._has_media(message):
+            logger.info(f"消息 {message.message_id} 不包含媒体文件")
+            return []
+        
+        # 获取所有媒体文件信息
+        media_info_list = self._get_all_media_info(message)
+        if not media_info_list:
+            logger.warning(f"无法获取消息 {message.message_id} 的媒体信息")
+            return []
+        
+        return await self.download_media_infos(message.message_id, media_info_list, bot)
+    
+    async def download_media_infos(self, message_id: int, media_info_list: List[dict], bot) -> List[dict]:
+        """按媒体信息下载文件（不需要 Message 对象，供媒体组记录使用），返回格式与 download_media 相同"""
         downloaded_files = []
         
         try:
-            # 检查消息是否包含媒体
-            if not self._has_media(message):
-                logger.info(f"消息 {message.message_id} 不包含媒体文件")
-                return downloaded_files
-            
-            # 获取所有媒体文件信息
-            media_info_list = self._get_all_media_info(message)
-            if not media_info_list:
-                logger.warning(f"无法获取消息 {message.message_id} 的媒体信息")
-                return downloaded_files
-            
             # 下载所有媒体文件
             for i, media_info in enumerate(media_info_list):
                 # 检查文件大小
@@ -55,21 +68,17 @@ class MediaDownloader:
                     logger.info("💡 建议：搭建本地Bot API服务器以支持大文件下载")
                 
                 # 生成文件名
-                file_name = self._generate_file_name(message, media_info, i)
-                file_path = self.download_path / file_name
+                file_name = self._build_file_name(message_id, media_info, i)
                 
                 # 下载文件
                 logger.info(f"开始下载文件: {file_name}")
-                await self._download_file(message, media_info, file_path, bot)
+                file_info = await self._fetch_file(None, media_info, file_name, bot)
                 
-                if file_path.exists() and file_path.stat().st_size > 0:
-                    downloaded_files.append({
-                        'path': file_path,
-                        'type': media_info['media_type']
-                    })
-                    logger.info(f"成功下载文件: {file_path}")
+                if file_info:
+                    downloaded_files.append(file_info)
+                    logger.info(f"成功下载文件: {file_info['path'] or file_name + '（内存）'}")
                 else:
-                    logger.error(f"文件下载失败或文件为空: {file_path}")
+                    logger.error(f"文件下载失败或文件为空: {file_name}")
             
         except Exception as e:
             logger.error(f"下载媒体文件时出错: {e}")
@@ -98,6 +107,7 @@ class MediaDownloader:
             photo = max(message.photo, key=lambda p: p.file_size)
             media_info_list.append({
                 'file_id': photo.file_id,
+                'file_unique_id': photo.file_unique_id,
                 'file_name': f"photo_{message.message_id}.jpg",
                 'file_size': photo.file_size or 0,
                 'media_type': 'photo'
@@ -105,6 +115,7 @@ class MediaDownloader:
         elif message.video:
             media_info_list.append({
                 'file_id': message.video.file_id,
+                'file_unique_id': message.video.file_unique_id,
                 'file_name': message.video.file_name or f"video_{message.message_id}.mp4",
                 'file_size': message.video.file_size or 0,
                 'media_type': 'video'
@@ -112,6 +123,7 @@ class MediaDownloader:
         elif message.document:
             media_info_list.append({
                 'file_id': message.document.file_id,
+                'file_unique_id': message.document.file_unique_id,
                 'file_name': message.document.file_name or f"document_{message.message_id}",
                 'file_size': message.document.file_size or 0,
                 'media_type': 'document'
@@ -119,6 +131,7 @@ class MediaDownloader:
         elif message.audio:
             media_info_list.append({
                 'file_id': message.audio.file_id,
+                'file_unique_id': message.audio.file_unique_id,
                 'file_name': message.audio.file_name or f"audio_{message.message_id}.mp3",
                 'file_size': message.audio.file_size or 0,
                 'media_type': 'audio'
@@ -126,6 +139,7 @@ class MediaDownloader:
         elif message.voice:
             media_info_list.append({
                 'file_id': message.voice.file_id,
+                'file_unique_id': message.voice.file_unique_id,
                 'file_name': f"voice_{message.message_id}.ogg",
                 'file_size': message.voice.file_size or 0,
                 'media_type': 'voice'
@@ -133,6 +147,7 @@ class MediaDownloader:
         elif message.video_note:
             media_info_list.append({
                 'file_id': message.video_note.file_id,
+                'file_unique_id': message.video_note.file_unique_id,
                 'file_name': f"video_note_{message.message_id}.mp4",
                 'file_size': message.video_note.file_size or 0,
                 'media_type': 'video_note'
@@ -140,6 +155,7 @@ class MediaDownloader:
         elif message.animation:
             media_info_list.append({
                 'file_id': message.animation.file_id,
+                'file_unique_id': message.animation.file_unique_id,
                 'file_name': message.animation.file_name or f"animation_{message.message_id}.gif",
                 'file_size': message.animation.file_size or 0,
                 'media_type': 'animation'
@@ -147,6 +163,7 @@ class MediaDownloader:
         elif message.sticker:
             media_info_list.append({
                 'file_id': message.sticker.file_id,
+                'file_unique_id': message.sticker.file_unique_id,
                 'file_name': f"sticker_{message.message_id}.webp",
                 'file_size': message.sticker.file_size or 0,
                 'media_type': 'sticker'
@@ -159,10 +176,94 @@ class MediaDownloader:
         media_info_list = self._get_all_media_info(message)
         return media_info_list[0] if media_info_list else None
     
+    async def download_indexed_media(self, record: dict, bot) -> List[dict]:
+        """按消息索引记录（file_id）重新下载媒体文件，返回格式与 download_media 相同"""
+        downloaded_files = []
+        
+        if not record.get('file_id'):
+            return downloaded_files
+        
+        media_info = {
+            'file_id': record['file_id'],
+            'file_unique_id': record.get('file_unique_id'),
+            'file_name': record.get('file_name') or f"{record['media_type']}_{record['message_id']}",
+            'file_size': record.get('file_size') or 0,
+            'media_type': record['media_type']
+        }
+        
+        if media_info['file_size'] > self.config.max_file_size:
+            logger.warning(f"⚠️ 索引文件 {media_info['file_name']} 超过大小限制，跳过下载")
+            return downloaded_files
+        
+        file_name = self._build_file_name(record['message_id'], media_info)
+        
+        try:
+            file_info = await self._fetch_file(None, media_info, file_name, bot)
+        except Exception as e:
+            logger.error(f"按索引下载文件失败 {record['chat']}/{record['message_id']}: {e}")
+            return downloaded_files
+        
+        if file_info:
+            downloaded_files.append(file_info)
+        
+        return downloaded_files
+    
+    async def _fetch_file(self, message: Optional[Message], media_info: dict, file_name: str, bot=None) -> Optional[dict]:
+        """下载单个文件：小文件在预算内时暂存到内存，否则写入下载目录
+        
+        返回 {'path': Path 或 None, 'staged': StagedBuffer（仅内存文件）, 'type': str}，文件为空时返回 None
+        """
+        file_size = media_info['file_size']
+        budget = self.staging_budget
+        if budget and 0 < file_size <= self.config.memory_staging_max_file_size and budget.try_reserve(file_size):
+            try:
+                data = await self._download_file(message, media_info, None, bot)
+            except BaseException:
+                budget.release(file_size)
+                raise
+            if not data:
+                budget.release(file_size)
+                return None
+            # 按实际大小记账（file_size 只是 Telegram 报告的估计值），实际更大且超出预算时写入磁盘
+            if not budget.adjust(file_size, len(data)):
+                budget.release(file_size)
+                file_path = self.download_path / file_name
+                await asyncio.to_thread(file_path.write_bytes, data)
+                self.disk_stats['files'] += 1
+                self.disk_stats['bytes'] += len(data)
+                return {
+                    'path': file_path,
+                    'type': media_info['media_type']
+                }
+            return {
+                'path': None,
+                'staged': StagedBuffer(bytes(data), file_name, budget, len(data)),
+                'type': media_info['media_type']
+            }
+        
+        file_path = self.download_path / file_name
+        try:
+            await self._download_file(message, media_info, file_path, bot)
+        except BaseException:
+            # 下载失败或被取消（例如媒体组预取被放弃）时不留下不完整的文件
+            file_path.unlink(missing_ok=True)
+            raise
+        if file_path.exists() and file_path.stat().st_size > 0:
+            self.disk_stats['files'] += 1
+            self.disk_stats['bytes'] += file_path.stat().st_size
+            return {
+                'path': file_path,
+                'type': media_info['media_type']
+            }
+        return None
+    
     def _generate_file_name(self, message: Message, media_info: dict, index: int = 0) -> str:
         """生成文件名"""
+        return self._build_file_name(message.message_id, media_info, index)
+    
+    def _build_file_name(self, message_id: int, media_info: dict, index: int = 0) -> str:
+        """根据消息ID和媒体信息生成文件名"""
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        message_id = message.message_id
         
         # 获取原始文件名和扩展名
         original_name = media_info['file_name']
@@ -208,8 +309,8 @@ class MediaDownloader:
             filename = name[:250] + '.' + ext
         return filename
     
-    async def _download_file(self, message: Message, media_info: dict, file_path: Path, bot=None):
-        """下载文件"""
+    async def _download_file(self, message: Message, media_info: dict, file_path: Optional[Path], bot=None) -> Optional[bytearray]:
+        """下载文件（file_path 为 None 时下载到内存并返回内容）"""
         file_name = media_info.get('file_name', 'unknown')
         file_size_mb = media_info.get('file_size', 0) / (1024 * 1024)
         
@@ -221,15 +322,11 @@ class MediaDownloader:
             
             logger.info(f"🔄 开始获取文件信息: {file_name} ({file_size_mb:.1f}MB)")
             
-            # 获取文件对象
-            file = await bot_instance.get_file(media_info['file_id'])
-            
-            logger.info(f"✅ 文件信息获取成功，开始下载: {file_name}")
-            
-            # 下载文件
-            await file.download_to_drive(file_path)
-            
-            logger.info(f"✅ 文件下载完成: {file_path}")
+            # 按文件大小和实测下载速度计算截止时间，停滞或超时后重试
+            return await self.transfer_timeouts.run(
+                TRAFFIC_DOWNLOAD, media_info.get('file_size', 0), f"下载 {file_name}",
+                lambda timeouts: self._download_file_once(bot_instance, media_info, file_path, timeouts)
+            )
             
         except TelegramError as e:
             # 详细记录Telegram API错误
@@ -260,6 +357,26 @@ class MediaDownloader:
             logger.error(f"   错误详情: {type(e).__name__}: {e}")
             raise
     
+    async def _download_file_once(self, bot, media_info: dict, file_path: Optional[Path], timeouts: dict) -> Optional[bytearray]:
+        file_name = media_info.get('file_name', 'unknown')
+        
+        # 获取文件对象
+        file = await bot.get_file(media_info['file_id'])
+        
+        logger.info(f"✅ 文件信息获取成功，开始下载: {file_name}")
+        
+        # 下载文件
+        with self.transfer_progress.track(DIRECTION_DOWNLOAD, file_name, file.file_size or media_info.get('file_size', 0)):
+            if file_path is None:
+                data = await file.download_as_bytearray(**timeouts)
+                logger.info(f"✅ 文件下载完成（内存）: {file_name}")
+                return data
+            
+            await file.download_to_drive(file_path, **timeouts)
+        
+        logger.info(f"✅ 文件下载完成: {file_path}")
+        return None
+    
     def cleanup_old_files(self, max_age_hours: int = 24):
         """清理旧文件"""
         try:
@@ -0,0 +1,165 @@
+"""
+媒体组记录模块 - 收集中的媒体组只保存处理流程需要的字段（ID、file_id、大小、类型、caption），
+不保留完整的 Message 对象，大量相册同时到达时内存占用保持很小
+已完成的媒体组留下有时限的墓碑记录，用于识别晚到的相册成员
+"""
+
+import asyncio
+import time
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+
+from telegram import Message, MessageEntity
+
+
+class AlbumItem:
+    """媒体组中的一个媒体文件"""
+
+    __slots__ = ('message_id', 'file_id', 'file_unique_id', 'file_name', 'file_size', 'media_type', 'prefetch')
+
+    def __init__(self, message_id: int, media_info: dict):
+        self.message_id = message_id
+        self.file_id = media_info['file_id']
+        self.file_unique_id = media_info['file_unique_id']
+        self.file_name = media_info['file_name']
+        self.file_size = media_info['file_size']
+        self.media_type = media_info['media_type']
+        self.prefetch: Optional[asyncio.Task] = None  # 收集期间提前开始的下载任务（结果为下载的文件信息列表）
+
+    def to_message_fields(self) -> dict:
+        """重建 Bot API 消息中的媒体字段（用于保存检查点，尺寸/时长等未保存的字段填0）"""
+        media = {'file_id': self.file_id, 'file_unique_id': self.file_unique_id, 'file_size': self.file_size}
+        if self.media_type == 'photo':
+            return {'photo': [{**media, 'width': 0, 'height': 0}]}
+        if self.media_type == 'video':
+            return {'video': {**media, 'file_name': self.file_name, 'width': 0, 'height': 0, 'duration': 0}}
+        if self.media_type == 'audio':
+            return {'audio': {**media, 'file_name': self.file_name, 'duration': 0}}
+        return {'document': {**media, 'file_name': self.file_name}}
+
+    def media_info(self) -> dict:
+        """转换为 MediaDownloader 使用的媒体信息格式"""
+        return {
+            'file_id': self.file_id,
+            'file_unique_id': self.file_unique_id,
+            'file_name': self.file_name,
+            'file_size': self.file_size,
+            'media_type': self.media_type,
+        }
+
+
+class MediaGroup:
+    """收集/下载中的媒体组"""
+
+    __slots__ = (
+        'chat_id', 'media_group_id', 'items', 'caption', 'caption_entities', 'channel_mapping',
+        'publish_ticket', 'timer', 'status', 'start_time', 'last_message_time', 'download_start_time',
+        'published_message_id', 'job', 'caption_message_id',
+    )
+
+    def __init__(self, chat_id: int, media_group_id: str, channel_mapping: Optional[dict], start_time: float):
+        self.chat_id = chat_id
+        self.media_group_id = media_group_id
+        self.items: List[AlbumItem] = []
+        self.caption = ""
+        self.caption_entities: Tuple[MessageEntity, ...] = ()
+        self.caption_message_id: Optional[int] = None  # 提供caption的源消息（编辑同步用）
+        self.channel_mapping = channel_mapping
+        self.publish_ticket = None
+        self.timer = None
+        self.status = 'collecting'  # collecting, downloading, scheduled, publishing, completed
+        self.start_time = start_time
+        self.last_message_time = start_time
+        self.download_start_time = None
+        self.published_message_id = None  # 发布后目标频道中相册第一条消息的ID
+        self.job = None  # 任务登记（job_registry.Job）
+
+    def add(self, message: Message, media_infos: List[dict], arrival_time: float) -> List[AlbumItem]:
+        """加入一条消息（只提取需要的字段），媒体组的caption取第一条带caption的消息；返回新加入的媒体文件"""
+        items = [AlbumItem(message.message_id, media_info) for media_info in media_infos]
+        self.items.extend(items)
+        if not self.caption and message.caption:
+            self.caption = message.caption
+            self.caption_entities = tuple(message.caption_entities)
+            self.caption_message_id = message.message_id
+        self.last_message_time = arrival_time
+        return items
+
+    def media_infos(self) -> List[dict]:
+        return [item.media_info() for item in self.items]
+
+    @property
+    def label(self) -> str:
+        return f"{self.chat_id}/{self.media_group_id}"
+
+    def total_size(self) -> int:
+        return sum(item.file_size or 0 for item in self.items)
+
+    def to_update_dicts(self) -> List[dict]:
+        """重建媒体组各条消息的 Update JSON（caption放在第一条），用于关闭时保存检查点"""
+        updates = []
+        for index, item in enumerate(self.items):
+            message = {
+                'message_id': item.message_id,
+                'date': 0,
+                'chat': {'id': self.chat_id, 'type': 'channel'},
+                'media_group_id': self.media_group_id,
+                **item.to_message_fields(),
+            }
+            if index == 0 and self.caption:
+                message['caption'] = self.caption
+                message['caption_entities'] = [entity.to_dict() for entity in self.caption_entities]
+            updates.append({'update_id': 0, 'channel_post': message})
+        return updates
+
+
+class GroupTombstone:
+    """已完成媒体组的墓碑记录"""
+
+    __slots__ = ('target_chat', 'first_message_id', 'has_caption', 'expires')
+
+    def __init__(self, target_chat: Optional[str], first_message_id: Optional[int], has_caption: bool, expires: float):
+        self.target_chat = target_chat
+        self.first_message_id = first_message_id  # 目标频道中相册第一条消息的ID（未发布为 None）
+        self.has_caption = has_caption            # 发布时是否已带有源caption
+        self.expires = expires
+
+
+class GroupTombstones:
+    """最近完成的媒体组（按 源频道+媒体组ID），有数量上限（LRU）和有效期（TTL）"""
+
+    def __init__(self, ttl: float, max_entries: int):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Tuple[int, str], GroupTombstone]" = OrderedDict()
+        self.stats = {'hits': 0, 'misses': 0, 'dropped': 0, 'edited': 0, 'evicted': 0}
+
+    def add(self, key: Tuple[int, str], target_chat: Optional[str], first_message_id: Optional[int], has_caption: bool):
+        self._entries[key] = GroupTombstone(target_chat, first_message_id, has_caption, time.monotonic() + self.ttl)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.stats['evicted'] += 1
+
+    def get(self, key: Tuple[int, str]) -> Optional[GroupTombstone]:
+        """查找墓碑记录（过期的记录视为不存在），命中时刷新LRU顺序"""
+        tombstone = self._entries.get(key)
+        if tombstone is not None and tombstone.expires <= time.monotonic():
+            del self._entries[key]
+            tombstone = None
+        if tombstone is None:
+            self.stats['misses'] += 1
+            return None
+        self._entries.move_to_end(key)
+        self.stats['hits'] += 1
+        return tombstone
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def format_status(self) -> str:
+        """格式化墓碑缓存状态（用于 /status）"""
+        return (
+            f"{len(self._entries)}/{self.max_entries} 条, 命中 {self.stats['hits']}, 未命中 {self.stats['misses']}, "
+            f"丢弃晚到消息 {self.stats['dropped']}, 补充caption {self.stats['edited']}"
+        )
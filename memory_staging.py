@@ -0,0 +1,82 @@
+"""
+内存暂存模块 - 小文件（图片、贴纸、语音等）直接下载到内存并从内存上传，不经过磁盘
+全局字节预算限制暂存的总内存，超出预算时回退到下载目录
+"""
+
+import logging
+import weakref
+from pathlib import Path
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+
+class StagingBudget:
+    """内存暂存的全局字节预算"""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.in_use = 0
+
+        # 统计信息
+        self.stats = {'staged': 0, 'staged_bytes': 0, 'fallback': 0, 'peak_bytes': 0}
+
+    def try_reserve(self, size: int) -> bool:
+        """预留内存，超出预算时返回 False（调用方回退到磁盘）"""
+        if self.in_use + size > self.max_bytes:
+            self.stats['fallback'] += 1
+            return False
+        self.in_use += size
+        self.stats['peak_bytes'] = max(self.stats['peak_bytes'], self.in_use)
+        return True
+
+    def adjust(self, reserved: int, actual: int) -> bool:
+        """把预留的字节数改为实际大小；增长后超出预算时返回 False（预留不变，调用方回退到磁盘）"""
+        if actual > reserved and self.in_use + actual - reserved > self.max_bytes:
+            self.stats['fallback'] += 1
+            return False
+        self.in_use = max(0, self.in_use + actual - reserved)
+        self.stats['peak_bytes'] = max(self.stats['peak_bytes'], self.in_use)
+        return True
+
+    def release(self, size: int):
+        self.in_use = max(0, self.in_use - size)
+
+    def format_status(self) -> str:
+        """格式化暂存状态（用于 /status）"""
+        return (
+            f"占用 {self.in_use / 1024 / 1024:.1f}/{self.max_bytes / 1024 / 1024:.0f}MB, "
+            f"峰值 {self.stats['peak_bytes'] / 1024 / 1024:.1f}MB, "
+            f"暂存 {self.stats['staged']} 个 ({self.stats['staged_bytes'] / 1024 / 1024:.1f}MB), "
+            f"回退磁盘 {self.stats['fallback']} 次"
+        )
+
+
+class StagedBuffer:
+    """内存中的已下载文件；显式释放或被回收时归还预算"""
+
+    __slots__ = ('data', 'file_name', '_finalizer', '__weakref__')
+
+    def __init__(self, data: bytes, file_name: str, budget: StagingBudget, reserved: int):
+        self.data = data
+        self.file_name = file_name
+        # 文件信息在异常路径上被丢弃时也要归还预算
+        self._finalizer = weakref.finalize(self, budget.release, reserved)
+        budget.stats['staged'] += 1
+        budget.stats['staged_bytes'] += len(data)
+
+    def release(self):
+        self._finalizer()
+        self.data = None
+
+    def spill(self, directory: Path) -> Path:
+        """写入磁盘（需要按文件处理的阶段使用，例如图片优化），并释放内存"""
+        path = Path(directory) / self.file_name
+        path.write_bytes(self.data)
+        self.release()
+        return path
+
+
+def staged_buffer(file_info: dict) -> Optional[StagedBuffer]:
+    """文件信息中的内存暂存数据（磁盘文件返回 None）"""
+    return file_info.get('staged') if isinstance(file_info, dict) else None
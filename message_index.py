@@ -0,0 +1,234 @@
+"""
+本地消息索引模块 - 基于 SQLite FTS5 记录所有收到的源频道消息
+写入先放入内存缓冲，每 FLUSH_INTERVAL 秒在线程中批量写入并提交一次，不阻塞事件循环
+查询（包括查询前写入缓冲）同样在线程中执行
+"""
+
+import asyncio
+import logging
+import sqlite3
+import threading
+from pathlib import Path
+from typing import List, Optional, Iterable
+
+logger = logging.getLogger(__name__)
+
+# trigram 分词器可对中文做子串匹配，但少于3个字符的关键词无法命中
+MIN_TRIGRAM_QUERY_LENGTH = 3
+
+FLUSH_INTERVAL = 1.0  # 秒 - 缓冲的消息批量写入的间隔
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY,
+    chat TEXT NOT NULL,
+    message_id INTEGER NOT NULL,
+    media_group_id TEXT,
+    media_type TEXT NOT NULL,
+    file_id TEXT,
+    file_unique_id TEXT,
+    file_size INTEGER NOT NULL DEFAULT 0,
+    file_name TEXT,
+    caption TEXT NOT NULL DEFAULT '',
+    date INTEGER NOT NULL,
+    UNIQUE (chat, message_id)
+);
+CREATE INDEX IF NOT EXISTS idx_messages_date ON messages (date);
+CREATE INDEX IF NOT EXISTS idx_messages_type_date ON messages (media_type, date);
+CREATE INDEX IF NOT EXISTS idx_messages_unique_id ON messages (file_unique_id);
+
+CREATE TRIGGER IF NOT EXISTS messages_ai AFTER INSERT ON messages BEGIN
+    INSERT INTO messages_fts (rowid, caption) VALUES (new.id, new.caption);
+END;
+CREATE TRIGGER IF NOT EXISTS messages_ad AFTER DELETE ON messages BEGIN
+    INSERT INTO messages_fts (messages_fts, rowid, caption) VALUES ('delete', old.id, old.caption);
+END;
+CREATE TRIGGER IF NOT EXISTS messages_au AFTER UPDATE ON messages BEGIN
+    INSERT INTO messages_fts (messages_fts, rowid, caption) VALUES ('delete', old.id, old.caption);
+    INSERT INTO messages_fts (rowid, caption) VALUES (new.id, new.caption);
+END;
+"""
+
+COLUMNS = "chat, message_id, media_group_id, media_type, file_id, file_unique_id, file_size, file_name, caption, date"
+M_COLUMNS = ", ".join(f"m.{column}" for column in COLUMNS.split(", "))
+UPSERT_SQL = (
+    f"INSERT INTO messages ({COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?) "
+    "ON CONFLICT (chat, message_id) DO UPDATE SET "
+    "media_group_id = excluded.media_group_id, media_type = excluded.media_type, "
+    "file_id = excluded.file_id, file_unique_id = excluded.file_unique_id, "
+    "file_size = excluded.file_size, file_name = excluded.file_name, "
+    "caption = excluded.caption, date = excluded.date"
+)
+
+
+class MessageIndex:
+    """源频道消息索引（SQLite + FTS5）"""
+
+    def __init__(self, db_path: str):
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._pending_lock = threading.Lock()
+        self._pending: List[tuple] = []  # 等待批量写入的行
+        self._flush_task: Optional[asyncio.Task] = None
+        self._conn = sqlite3.connect(str(self.db_path), check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+
+        self.trigram = self._create_fts_table()
+        self._conn.executescript(SCHEMA)
+        self._conn.commit()
+
+        logger.info(f"🗂️ 消息索引已加载: {self.db_path} (分词器: {'trigram' if self.trigram else 'unicode61'})")
+
+    def _create_fts_table(self) -> bool:
+        """创建FTS5全文索引表，优先使用trigram分词器（支持中文子串搜索）"""
+        try:
+            self._conn.execute(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5("
+                "caption, content='messages', content_rowid='id', tokenize='trigram')"
+            )
+            return True
+        except sqlite3.OperationalError:
+            # SQLite < 3.34 不支持trigram
+            self._conn.execute(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5("
+                "caption, content='messages', content_rowid='id')"
+            )
+            return False
+
+    def record_message(self, chat: str, message, media_info_list: List[dict]) -> None:
+        """记录一条源频道消息（媒体信息来自 MediaDownloader._get_all_media_info）"""
+        caption = message.text or message.caption or ''
+        date = int(message.date.timestamp()) if message.date else 0
+        media_info = media_info_list[0] if media_info_list else {}
+
+        row = (
+            chat,
+            message.message_id,
+            message.media_group_id,
+            media_info.get('media_type', 'text'),
+            media_info.get('file_id'),
+            media_info.get('file_unique_id'),
+            media_info.get('file_size', 0),
+            media_info.get('file_name'),
+            caption,
+            date,
+        )
+
+        with self._pending_lock:
+            self._pending.append(row)
+        self._schedule_flush()
+
+    def _schedule_flush(self):
+        if self._flush_task is not None:
+            return
+        try:
+            self._flush_task = asyncio.get_running_loop().create_task(self._flush_later())
+        except RuntimeError:
+            self.flush()  # 没有事件循环（脚本中使用）时直接写入
+
+    async def _flush_later(self):
+        await asyncio.sleep(FLUSH_INTERVAL)
+        self._flush_task = None
+        await asyncio.to_thread(self.flush)
+
+    def flush(self) -> int:
+        """把缓冲的消息在一个事务中写入，返回写入的行数"""
+        with self._lock:
+            return self._flush_locked()
+
+    def _flush_locked(self) -> int:
+        with self._pending_lock:
+            rows, self._pending = self._pending, []
+        if not rows:
+            return 0
+        try:
+            self._conn.executemany(UPSERT_SQL, rows)
+            self._conn.commit()
+        except sqlite3.Error as e:
+            self._conn.rollback()
+            logger.error(f"写入消息索引失败 ({len(rows)} 条): {e}")
+            return 0
+        return len(rows)
+
+    async def _query(self, sql: str, params: Iterable) -> List[dict]:
+        return await asyncio.to_thread(self._query_sync, sql, tuple(params))
+
+    def _query_sync(self, sql: str, params: tuple) -> List[dict]:
+        with self._lock:
+            self._flush_locked()  # 查询能看到刚收到的消息
+            return [dict(row) for row in self._conn.execute(sql, params).fetchall()]
+
+    @staticmethod
+    def _chat_filter(chats: Optional[List[str]], column: str = 'chat') -> tuple:
+        if not chats:
+            return "", []
+        placeholders = ", ".join("?" for _ in chats)
+        return f" AND {column} IN ({placeholders})", list(chats)
+
+    async def search_keyword(self, keyword: str, chats: Optional[List[str]] = None, limit: int = 50) -> List[dict]:
+        """按关键词搜索（FTS5全文索引，短关键词回退到LIKE）"""
+        chat_sql, chat_params = self._chat_filter(chats, 'm.chat')
+
+        if self.trigram and len(keyword) < MIN_TRIGRAM_QUERY_LENGTH:
+            escaped = keyword.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+            return await self._query(
+                f"SELECT {M_COLUMNS} FROM messages m WHERE m.caption LIKE ? ESCAPE '\\'{chat_sql} "
+                "ORDER BY m.date DESC, m.message_id DESC LIMIT ?",
+                [f"%{escaped}%", *chat_params, limit]
+            )
+
+        # 作为短语查询，避免关键词中的FTS语法字符被解析
+        phrase = '"' + keyword.replace('"', '""') + '"'
+        return await self._query(
+            f"SELECT {M_COLUMNS} FROM messages_fts f JOIN messages m ON m.id = f.rowid "
+            f"WHERE messages_fts MATCH ?{chat_sql} ORDER BY m.date DESC, m.message_id DESC LIMIT ?",
+            [phrase, *chat_params, limit]
+        )
+
+    async def search_type(self, media_type: str, chats: Optional[List[str]] = None, limit: int = 50) -> List[dict]:
+        """按媒体类型搜索（text 表示纯文本消息）"""
+        chat_sql, chat_params = self._chat_filter(chats)
+        return await self._query(
+            f"SELECT {COLUMNS} FROM messages WHERE media_type = ?{chat_sql} "
+            "ORDER BY date DESC, message_id DESC LIMIT ?",
+            [media_type, *chat_params, limit]
+        )
+
+    async def recent(self, count: int, chats: Optional[List[str]] = None) -> List[dict]:
+        """获取最近N条消息"""
+        chat_sql, chat_params = self._chat_filter(chats)
+        return await self._query(
+            f"SELECT {COLUMNS} FROM messages WHERE 1 = 1{chat_sql} "
+            "ORDER BY date DESC, message_id DESC LIMIT ?",
+            [*chat_params, count]
+        )
+
+    async def get_media_group(self, chat: str, media_group_id: str) -> List[dict]:
+        """获取同一媒体组内的所有记录（按消息ID排序）"""
+        return await self._query(
+            f"SELECT {COLUMNS} FROM messages WHERE chat = ? AND media_group_id = ? ORDER BY message_id",
+            [chat, media_group_id]
+        )
+
+    async def get_stats(self) -> dict:
+        """获取索引统计信息"""
+        return await asyncio.to_thread(self._stats_sync)
+
+    def _stats_sync(self) -> dict:
+        with self._lock:
+            self._flush_locked()
+            total = self._conn.execute("SELECT COUNT(*) FROM messages").fetchone()[0]
+        size = self.db_path.stat().st_size if self.db_path.exists() else 0
+        return {'total_messages': total, 'db_size_mb': size / (1024 * 1024)}
+
+    def close(self) -> None:
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            self._flush_task = None
+        with self._lock:
+            self._flush_locked()
+            self._conn.close()
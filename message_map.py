@@ -0,0 +1,260 @@
+"""
+消息映射模块 - 记录源消息（或媒体组）发布到目标频道后的消息ID（SQLite）
+源频道编辑caption/文本时直接编辑目标消息（不再重新下载和上传媒体），/unpublish 删除已发布的消息
+超过保留天数的记录自动清理
+写入先放入内存缓冲，每 FLUSH_INTERVAL 秒在线程中按顺序批量执行并提交一次；查询同样在线程中执行
+媒体组的每条源消息记在 message_map_members 表中，按源消息ID查找走索引
+"""
+
+import asyncio
+import logging
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import List, Optional
+
+from telegram import Message
+
+logger = logging.getLogger(__name__)
+
+KIND_TEXT = 'text'
+KIND_MEDIA = 'media'
+
+EVICT_INTERVAL = 3600  # 秒 - 清理过期记录的间隔
+FLUSH_INTERVAL = 1.0   # 秒 - 缓冲的写入批量提交的间隔
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS message_map (
+    source_chat INTEGER NOT NULL,
+    source_key TEXT NOT NULL,
+    target_chat TEXT NOT NULL,
+    target_ids TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    caption_source_id INTEGER,
+    source_ids TEXT,
+    created INTEGER NOT NULL,
+    PRIMARY KEY (source_chat, source_key, target_chat)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_message_map_created ON message_map (created);
+
+CREATE TABLE IF NOT EXISTS message_map_members (
+    source_chat INTEGER NOT NULL,
+    message_id INTEGER NOT NULL,
+    source_key TEXT NOT NULL,
+    target_chat TEXT NOT NULL,
+    PRIMARY KEY (source_chat, message_id, source_key, target_chat)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_message_map_members_key ON message_map_members (source_chat, source_key, target_chat);
+"""
+
+# 旧版本只在 source_ids 列中记录媒体组成员：首次启动时拆分到 message_map_members
+MIGRATE_MEMBERS_SQL = """
+WITH RECURSIVE split (source_chat, source_key, target_chat, message_id, rest) AS (
+    SELECT source_chat, source_key, target_chat, NULL, source_ids || ','
+    FROM message_map WHERE source_key LIKE 'g:%' AND source_ids IS NOT NULL AND source_ids != ''
+    UNION ALL
+    SELECT source_chat, source_key, target_chat,
+           CAST(substr(rest, 1, instr(rest, ',') - 1) AS INTEGER), substr(rest, instr(rest, ',') + 1)
+    FROM split WHERE rest != ''
+)
+INSERT OR IGNORE INTO message_map_members (source_chat, message_id, source_key, target_chat)
+SELECT source_chat, message_id, source_key, target_chat FROM split WHERE message_id IS NOT NULL
+"""
+
+MEMBER_KEY_SQL = "source_chat = ? AND source_key = ? AND target_chat = ?"
+
+
+def source_key(message_id: int, media_group_id: Optional[str] = None) -> str:
+    """单条消息按消息ID，媒体组按 g:<media_group_id>"""
+    return f"g:{media_group_id}" if media_group_id else str(message_id)
+
+
+def message_key(message: Message) -> str:
+    return source_key(message.message_id, message.media_group_id)
+
+
+class MessageMap:
+    """源消息 -> 目标消息ID 的持久映射"""
+
+    def __init__(self, db_path: str, max_age_days: float):
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_age = max_age_days * 86400
+
+        self._lock = threading.Lock()
+        self._pending_lock = threading.Lock()
+        self._pending: List[tuple] = []  # 等待批量执行的 (sql, 参数)，按调用顺序执行
+        self._flush_task: Optional[asyncio.Task] = None
+        self._conn = sqlite3.connect(str(self.db_path), check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        migrate = self._conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'message_map_members'"
+        ).fetchone() is None
+        self._conn.executescript(SCHEMA)
+        if migrate:
+            self._conn.execute(MIGRATE_MEMBERS_SQL)
+        self._conn.commit()
+        self._last_evict = 0.0
+
+        self.stats = {'recorded': 0, 'edits_synced': 0, 'edits_unchanged': 0, 'edits_missed': 0, 'deleted': 0, 'evicted': 0}
+        self.evict()
+        logger.info(f"🔗 消息映射已加载: {self.db_path} ({self._count_sync()} 条, 保留 {max_age_days:g} 天)")
+
+    def record(self, source_chat: int, key: str, target_chat: str, sent_messages: List[Message], kind: str,
+               caption_source_id: Optional[int] = None, source_ids: Optional[List[int]] = None):
+        """记录一次发布（媒体组记录所有源消息ID和提供caption的源消息）"""
+        if not sent_messages:
+            return
+        target_chat = str(target_chat)
+        row = (
+            source_chat, key, target_chat,
+            ",".join(str(message.message_id) for message in sent_messages), kind, caption_source_id,
+            ",".join(str(message_id) for message_id in source_ids) if source_ids else None,
+            int(time.time()),
+        )
+        statements = [
+            ("INSERT OR REPLACE INTO message_map (source_chat, source_key, target_chat, target_ids, kind, "
+             "caption_source_id, source_ids, created) VALUES (?, ?, ?, ?, ?, ?, ?, ?)", row),
+            (f"DELETE FROM message_map_members WHERE {MEMBER_KEY_SQL}", (source_chat, key, target_chat)),
+        ]
+        statements += [
+            ("INSERT OR IGNORE INTO message_map_members (source_chat, message_id, source_key, target_chat) "
+             "VALUES (?, ?, ?, ?)", (source_chat, message_id, key, target_chat))
+            for message_id in (source_ids or [])
+        ]
+        self._enqueue(statements)
+        self.stats['recorded'] += 1
+
+    def set_caption_source(self, source_chat: int, key: str, message_id: int):
+        """媒体组发布时没有caption：记录之后第一条编辑出caption的源消息"""
+        self._enqueue([(
+            "UPDATE message_map SET caption_source_id = ? WHERE source_chat = ? AND source_key = ?",
+            (message_id, source_chat, key)
+        )])
+
+    def remove(self, source_chat: int, key: str):
+        self._enqueue([
+            ("DELETE FROM message_map_members WHERE source_chat = ? AND source_key = ?", (source_chat, key)),
+            ("DELETE FROM message_map WHERE source_chat = ? AND source_key = ?", (source_chat, key)),
+        ])
+
+    def _enqueue(self, statements: List[tuple]):
+        with self._pending_lock:
+            self._pending.extend(statements)
+        self._schedule_flush()
+
+    def _schedule_flush(self):
+        if self._flush_task is not None:
+            return
+        try:
+            self._flush_task = asyncio.get_running_loop().create_task(self._flush_later())
+        except RuntimeError:
+            self.flush()  # 没有事件循环（脚本中使用）时直接写入
+
+    async def _flush_later(self):
+        await asyncio.sleep(FLUSH_INTERVAL)
+        self._flush_task = None
+        await asyncio.to_thread(self.flush)
+
+    def flush(self) -> int:
+        """在一个事务中执行缓冲的写入（到期时顺带清理过期记录），返回执行的语句数"""
+        with self._lock:
+            count = self._flush_locked()
+            if time.time() - self._last_evict >= EVICT_INTERVAL:
+                self._evict_locked()
+            return count
+
+    def _flush_locked(self) -> int:
+        with self._pending_lock:
+            statements, self._pending = self._pending, []
+        if not statements:
+            return 0
+        try:
+            for sql, params in statements:
+                self._conn.execute(sql, params)
+            self._conn.commit()
+        except sqlite3.Error as e:
+            self._conn.rollback()
+            logger.error(f"写入消息映射失败 ({len(statements)} 条语句): {e}")
+            return 0
+        return len(statements)
+
+    @staticmethod
+    def _row(row: sqlite3.Row) -> dict:
+        entry = dict(row)
+        entry['target_ids'] = [int(message_id) for message_id in entry['target_ids'].split(',')]
+        entry['source_ids'] = [int(message_id) for message_id in entry['source_ids'].split(',')] if entry['source_ids'] else []
+        return entry
+
+    async def _query(self, sql: str, params: tuple) -> List[dict]:
+        return await asyncio.to_thread(self._query_sync, sql, params)
+
+    def _query_sync(self, sql: str, params: tuple) -> List[dict]:
+        with self._lock:
+            self._flush_locked()  # 查询能看到刚记录的发布
+            return [self._row(row) for row in self._conn.execute(sql, params).fetchall()]
+
+    async def lookup(self, source_chat: int, key: str) -> List[dict]:
+        return await self._query("SELECT * FROM message_map WHERE source_chat = ? AND source_key = ?", (source_chat, key))
+
+    async def find_by_message(self, source_chat: int, message_id: int) -> List[dict]:
+        """按源消息ID查找（单条消息或媒体组中的任意一条）"""
+        return await self._query(
+            "SELECT * FROM message_map WHERE source_chat = ? AND source_key = ? "
+            "UNION ALL "
+            "SELECT m.* FROM message_map_members g JOIN message_map m ON m.source_chat = g.source_chat "
+            "AND m.source_key = g.source_key AND m.target_chat = g.target_chat "
+            "WHERE g.source_chat = ? AND g.message_id = ?",
+            (source_chat, str(message_id), source_chat, message_id)
+        )
+
+    def evict(self) -> int:
+        """删除超过保留时间的记录"""
+        with self._lock:
+            return self._evict_locked()
+
+    def _evict_locked(self) -> int:
+        self._last_evict = time.time()
+        cutoff = int(time.time() - self.max_age)
+        try:
+            self._conn.execute(
+                "DELETE FROM message_map_members WHERE (source_chat, source_key, target_chat) IN "
+                "(SELECT source_chat, source_key, target_chat FROM message_map WHERE created < ?)",
+                (cutoff,)
+            )
+            cursor = self._conn.execute("DELETE FROM message_map WHERE created < ?", (cutoff,))
+            self._conn.commit()
+        except sqlite3.Error as e:
+            self._conn.rollback()
+            logger.error(f"清理消息映射失败: {e}")
+            return 0
+        if cursor.rowcount:
+            self.stats['evicted'] += cursor.rowcount
+            logger.info(f"🧹 已清理 {cursor.rowcount} 条过期的消息映射")
+        return cursor.rowcount
+
+    def _count_sync(self) -> int:
+        with self._lock:
+            self._flush_locked()
+            return self._conn.execute("SELECT COUNT(*) FROM message_map").fetchone()[0]
+
+    async def count(self) -> int:
+        return await asyncio.to_thread(self._count_sync)
+
+    async def format_status(self) -> str:
+        """格式化统计（用于 /status）"""
+        return (
+            f"{await self.count()} 条, 同步编辑 {self.stats['edits_synced']} 次 (未变化 {self.stats['edits_unchanged']}, "
+            f"未找到 {self.stats['edits_missed']}), 删除 {self.stats['deleted']}, 过期清理 {self.stats['evicted']}"
+        )
+
+    def close(self):
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            self._flush_task = None
+        with self._lock:
+            self._flush_locked()
+            self._conn.close()
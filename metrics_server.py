@@ -0,0 +1,37 @@
+"""
+指标导出模块 - 以 Prometheus 文本格式提供 /metrics（METRICS_PORT 为 0 时不启动）
+"""
+
+import logging
+from typing import Callable, List, Optional
+
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+
+class MetricsServer:
+    """HTTP /metrics 端点，内容由各模块的 render 函数拼接"""
+
+    def __init__(self, host: str, port: int, renderers: List[Callable[[], str]]):
+        self.host = host
+        self.port = port
+        self.renderers = renderers
+        self._runner: Optional[web.AppRunner] = None
+
+    async def _metrics(self, request: web.Request) -> web.Response:
+        body = "".join(render() for render in self.renderers)
+        return web.Response(text=body, content_type='text/plain', charset='utf-8')
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_get('/metrics', self._metrics)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        logger.info(f"📈 指标端点已启动: http://{self.host}:{self.port}/metrics")
+
+    async def stop(self):
+        if self._runner:
+            await self._runner.cleanup()
+            self._runner = None
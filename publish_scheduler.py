@@ -0,0 +1,141 @@
+"""
+发布调度模块 - 为每个目标频道的每条内容分配随机化的目标发布时间（模拟人工操作）
+消息到达时即预约发布顺序，下载立即进行，只有发布步骤等待轮到自己；不在处理器中 sleep
+"""
+
+import asyncio
+import logging
+import random
+import time
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class PublishTicket:
+    """一次发布预约"""
+
+    __slots__ = ('target', 'chain', 'sequence', 'publish_at', 'gap', 'released')
+
+    def __init__(self, target: str, chain: str, sequence: int, publish_at: float, gap: float):
+        self.target = target
+        self.chain = chain            # 顺序链：同一条链上的内容按预约顺序发布
+        self.sequence = sequence
+        self.publish_at = publish_at  # 计划发布时间（time.monotonic）
+        self.gap = gap                # 与上一条实际发布之间的最小间隔
+        self.released = False
+
+
+class PublishScheduler:
+    """按目标频道排序的发布调度器：保持到达顺序，相邻发布之间保持随机间隔"""
+
+    DEFAULT_CHAIN = 'ordered'
+
+    def __init__(self):
+        # {target: {'planned_until': float, 'last_published': float,
+        #           'chains': {chain: {'next_sequence': int, 'head': int, 'released': set, 'waiters': {sequence: Future}}}}}
+        self._channels: Dict[str, dict] = {}
+        self.stats = {'scheduled': 0, 'published': 0, 'cancelled': 0, 'total_wait': 0.0}
+
+    def _get_channel(self, target: str) -> dict:
+        channel = self._channels.get(target)
+        if channel is None:
+            channel = {
+                'planned_until': 0.0,      # 最后一个预约的计划发布时间
+                'last_published': 0.0,     # 最近一次实际发布时间
+                'chains': {},
+            }
+            self._channels[target] = channel
+        return channel
+
+    def _get_chain(self, channel: dict, chain_name: str) -> dict:
+        chain = channel['chains'].get(chain_name)
+        if chain is None:
+            chain = {
+                'next_sequence': 0,
+                'head': 0,                 # 最早的未完成预约序号
+                'released': set(),         # 已完成但还没轮到 head 的序号
+                'waiters': {},             # 等待轮到自己的预约
+            }
+            channel['chains'][chain_name] = chain
+        return chain
+
+    def reserve(self, target: str, min_delay: float = 0.0, max_delay: float = 0.0, chain: str = DEFAULT_CHAIN) -> PublishTicket:
+        """消息到达时预约发布位置（同步调用，不等待）
+
+        同一目标频道的所有内容共享发布间隔；只有同一条顺序链上的内容才互相等待。
+        """
+        channel = self._get_channel(target)
+        chain_state = self._get_chain(channel, chain)
+        now = time.monotonic()
+        gap = random.uniform(min_delay, max_delay) if max_delay > 0 else 0.0
+        publish_at = max(now, channel['planned_until']) + gap
+        channel['planned_until'] = publish_at
+
+        ticket = PublishTicket(target, chain, chain_state['next_sequence'], publish_at, gap)
+        chain_state['next_sequence'] += 1
+        self.stats['scheduled'] += 1
+        return ticket
+
+    async def wait_turn(self, ticket: PublishTicket):
+        """等待轮到该预约发布：同一顺序链上之前的预约都已完成，且到达计划时间并与上一次发布保持间隔"""
+        channel = self._get_channel(ticket.target)
+        chain = self._get_chain(channel, ticket.chain)
+        started = time.monotonic()
+
+        if chain['head'] != ticket.sequence:
+            waiter = asyncio.get_running_loop().create_future()
+            chain['waiters'][ticket.sequence] = waiter
+            try:
+                await waiter
+            finally:
+                chain['waiters'].pop(ticket.sequence, None)
+
+        publish_at = max(ticket.publish_at, channel['last_published'] + ticket.gap)
+        delay = publish_at - time.monotonic()
+        if delay > 0:
+            logger.info(f"⏱️ 目标频道 {ticket.target} 第 {ticket.sequence} 条内容将在 {delay:.1f}s 后发布（模拟人工操作）")
+            await asyncio.sleep(delay)
+        self.stats['total_wait'] += time.monotonic() - started
+
+    def release(self, ticket: PublishTicket, published: bool = True):
+        """发布完成（或放弃发布）后释放预约，让后续内容继续（重复调用无副作用）"""
+        if ticket.released:
+            return
+        ticket.released = True
+        channel = self._get_channel(ticket.target)
+        chain = self._get_chain(channel, ticket.chain)
+
+        if published:
+            channel['last_published'] = time.monotonic()
+            self.stats['published'] += 1
+        else:
+            self.stats['cancelled'] += 1
+
+        chain['released'].add(ticket.sequence)
+        while chain['head'] in chain['released']:
+            chain['released'].discard(chain['head'])
+            chain['head'] += 1
+
+        waiter = chain['waiters'].get(chain['head'])
+        if waiter is not None and not waiter.done():
+            waiter.set_result(None)
+
+    def pending_count(self, target: Optional[str] = None) -> int:
+        """尚未发布的预约数量"""
+        if target is not None:
+            channel = self._channels.get(target)
+            return sum(chain['next_sequence'] - chain['head'] for chain in channel['chains'].values()) if channel else 0
+        return sum(self.pending_count(target) for target in self._channels)
+
+    def format_status(self) -> str:
+        """格式化调度状态（用于 /status）"""
+        pending = {target: self.pending_count(target) for target in self._channels if self.pending_count(target)}
+        average_wait = self.stats['total_wait'] / self.stats['published'] if self.stats['published'] else 0.0
+        status = (
+            f"已发布 {self.stats['published']}, 放弃 {self.stats['cancelled']}, "
+            f"排队 {sum(pending.values())}, 平均等待 {average_wait:.1f}s"
+        )
+        if pending:
+            status += " (" + ", ".join(f"{target}: {count}" for target, count in pending.items()) + ")"
+        return status
@@ -0,0 +1,188 @@
+"""
+流式上传模块 - 大文件上传不再读入内存，也不经过 httpx 的 multipart 重新编码
+请求体由内存中的 multipart 头尾和磁盘上的文件组成：直连的 http:// 地址（本地 Bot API 服务器）用 sendfile
+由内核把文件直接写入 socket；经过代理或 TLS 时按块读取文件，通过连接池流式发送
+"""
+
+import asyncio
+import logging
+import mimetypes
+import os
+from pathlib import Path
+from typing import AsyncIterator, List, Optional, Tuple, Union
+from urllib.parse import urlsplit
+from uuid import uuid4
+
+from telegram import InputFile
+from telegram.error import NetworkError, TimedOut
+from telegram.request import RequestData
+
+from transfer_progress import mark_body_sent, record_bytes
+
+logger = logging.getLogger(__name__)
+
+SENDFILE_SEGMENT_SIZE = 1024 * 1024  # 单次 sendfile 的最大字节数（写入超时作用于每一段，相当于停滞检测）
+READ_CHUNK_SIZE = 1024 * 1024        # 回退路径每次读取文件的字节数
+MAX_RESPONSE_HEADER = 64 * 1024
+
+MODE_SENDFILE = 'sendfile'
+MODE_CHUNKED = 'chunked'
+
+
+class FileInputFile(InputFile):
+    """按路径上传的文件：创建时不读取内容，由上传连接池流式发送"""
+
+    __slots__ = ('path', 'size')
+
+    def __init__(self, path: Union[str, Path], filename: Optional[str] = None, attach: bool = False):
+        self.path = Path(path)
+        self.size = self.path.stat().st_size
+        self.input_file_content = b''
+        self.attach_name = "attached" + uuid4().hex if attach else None
+        self.filename = filename or self.path.name
+        self.mimetype = mimetypes.guess_type(self.filename, strict=False)[0] or 'application/octet-stream'
+
+    @property
+    def field_tuple(self):
+        # 内容位置放文件对象本身，上传连接池据此识别流式上传
+        return self.filename, self, self.mimetype
+
+    def __len__(self) -> int:
+        return self.size
+
+
+def contains_file_inputs(request_data: Optional[RequestData]) -> bool:
+    """请求中是否有按路径上传的文件"""
+    if request_data is None or not request_data.contains_files:
+        return False
+    return any(isinstance(part[1], FileInputFile) for part in request_data.multipart_data.values())
+
+
+def _quote(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\r', '').replace('\n', '')
+
+
+class MultipartBody:
+    """multipart/form-data 请求体：普通字段和小文件编码为字节，大文件保留路径"""
+
+    def __init__(self, request_data: RequestData):
+        self.boundary = uuid4().hex
+        self.segments: List[Union[bytes, FileInputFile]] = []
+        prefix = b''
+        for name, value in request_data.json_parameters.items():
+            prefix += (
+                f'--{self.boundary}\r\nContent-Disposition: form-data; name="{_quote(name)}"\r\n\r\n'
+            ).encode() + value.encode() + b'\r\n'
+        for name, (filename, content, mimetype) in request_data.multipart_data.items():
+            prefix += (
+                f'--{self.boundary}\r\nContent-Disposition: form-data; name="{_quote(name)}"; '
+                f'filename="{_quote(filename)}"\r\nContent-Type: {mimetype}\r\n\r\n'
+            ).encode()
+            if isinstance(content, FileInputFile):
+                self.segments += [prefix, content]
+                prefix = b'\r\n'
+            else:
+                prefix += content + b'\r\n'
+        self.segments.append(prefix + f'--{self.boundary}--\r\n'.encode())
+
+    @property
+    def content_type(self) -> str:
+        return f'multipart/form-data; boundary={self.boundary}'
+
+    def __len__(self) -> int:
+        return sum(len(segment) for segment in self.segments)
+
+    async def iter_chunks(self) -> AsyncIterator[bytes]:
+        """回退路径：按块读取文件（读取在线程中执行，不阻塞事件循环）"""
+        for segment in self.segments:
+            if isinstance(segment, bytes):
+                yield segment
+                continue
+            with open(segment.path, 'rb') as f:
+                while True:
+                    chunk = await asyncio.to_thread(f.read, READ_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    yield chunk
+
+
+def sendfile_supported(url: str, proxy_url: Optional[str]) -> bool:
+    """只有不经过代理的明文 HTTP 连接能用 sendfile（TLS 需要在用户态加密）"""
+    return proxy_url is None and urlsplit(url).scheme == 'http' and hasattr(os, 'sendfile')
+
+
+async def _read_response(reader: asyncio.StreamReader, read_timeout: Optional[float]) -> Tuple[int, bytes]:
+    head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), read_timeout)
+    if len(head) > MAX_RESPONSE_HEADER:
+        raise NetworkError("sendfile: 响应头过大")
+    status_line, *header_lines = head.decode('latin-1').split('\r\n')
+    status_code = int(status_line.split(' ', 2)[1])
+    headers = {}
+    for line in header_lines:
+        if ':' in line:
+            key, value = line.split(':', 1)
+            headers[key.strip().lower()] = value.strip()
+
+    if 'chunked' in headers.get('transfer-encoding', '').lower():
+        body = b''
+        while True:
+            size_line = await asyncio.wait_for(reader.readuntil(b'\r\n'), read_timeout)
+            size = int(size_line.split(b';', 1)[0], 16)
+            chunk = await asyncio.wait_for(reader.readexactly(size + 2), read_timeout)
+            if size == 0:
+                break
+            body += chunk[:-2]
+        return status_code, body
+    if 'content-length' in headers:
+        return status_code, await asyncio.wait_for(reader.readexactly(int(headers['content-length'])), read_timeout)
+    return status_code, await asyncio.wait_for(reader.read(), read_timeout)
+
+
+async def sendfile_request(url: str, body: MultipartBody, user_agent: str, connect_timeout: Optional[float],
+                           read_timeout: Optional[float], write_timeout: Optional[float]) -> Tuple[int, bytes]:
+    """单独建立一个连接发送请求（Connection: close），文件部分用 loop.sendfile 发送"""
+    parts = urlsplit(url)
+    target = parts.path + (f'?{parts.query}' if parts.query else '')
+    loop = asyncio.get_running_loop()
+    try:
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(parts.hostname, parts.port or 80), connect_timeout)
+    except asyncio.TimeoutError as e:
+        raise TimedOut("sendfile: 连接超时") from e
+    except OSError as e:
+        raise NetworkError(f"sendfile: 连接失败: {e}") from e
+
+    try:
+        head = (
+            f"POST {target} HTTP/1.1\r\nHost: {parts.netloc}\r\nUser-Agent: {user_agent}\r\n"
+            f"Content-Type: {body.content_type}\r\nContent-Length: {len(body)}\r\nConnection: close\r\n\r\n"
+        ).encode()
+        pending = head
+        for segment in body.segments:
+            if isinstance(segment, bytes):
+                pending += segment
+                continue
+            writer.write(pending)
+            await asyncio.wait_for(writer.drain(), write_timeout)
+            record_bytes(len(pending) - len(head))
+            head = b''
+            pending = b''
+            with open(segment.path, 'rb') as f:
+                offset = 0
+                while offset < segment.size:
+                    count = min(SENDFILE_SEGMENT_SIZE, segment.size - offset)
+                    sent = await asyncio.wait_for(loop.sendfile(writer.transport, f, offset, count), write_timeout)
+                    if not sent:
+                        raise NetworkError("sendfile: 文件在上传过程中被截断")
+                    offset += sent
+                    record_bytes(sent)
+        writer.write(pending)
+        await asyncio.wait_for(writer.drain(), write_timeout)
+        record_bytes(len(pending) - len(head))
+        mark_body_sent()
+        return await _read_response(reader, read_timeout)
+    except asyncio.TimeoutError as e:
+        raise TimedOut("sendfile: 传输超时") from e
+    except (OSError, asyncio.IncompleteReadError, ValueError) as e:
+        raise NetworkError(f"sendfile: {e.__class__.__name__}: {e}") from e
+    finally:
+        writer.close()
@@ -0,0 +1,178 @@
+"""
+多租户模块 - 一个进程运行多个机器人（每个租户独立的 Bot Token、channels.json、状态目录和 Application）
+租户之间共享 API/下载/上传连接池、下载槽位（公平调度）、内存暂存预算、图片处理进程池和指标端点，
+每个租户可以设置并发下载配额
+"""
+
+import asyncio
+import json
+import logging
+import os
+import re
+import time
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+from config import Config
+from fair_scheduler import FairScheduler
+from http_pools import TRAFFIC_DOWNLOAD, TRAFFIC_POLL, build_traffic_requests
+from image_processor import ImageProcessor
+from memory_staging import StagingBudget
+from metrics_server import MetricsServer
+from work_lanes import WorkLanes
+
+logger = logging.getLogger(__name__)
+
+TENANT_ID_PATTERN = re.compile(r'^[A-Za-z0-9_-]+$')
+
+# 默认位于 STATE_DIR 下的状态文件：在进程环境中直接设置会让所有租户共用同一个文件
+STATE_PATH_KEYS = (
+    'MESSAGE_INDEX_PATH', 'MESSAGE_MAP_PATH', 'UPDATE_RECORD_PATH', 'DEFERRED_QUEUE_PATH',
+    'DRAIN_CHECKPOINT_PATH', 'BACKFILL_SESSION_PATH', 'BACKFILL_STATE_PATH',
+)
+
+current_tenant: ContextVar[Optional[str]] = ContextVar('current_tenant', default=None)
+
+
+class TenantLogFilter(logging.Filter):
+    """日志加上当前租户ID（租户的任务都在其 run() 的上下文中创建）"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        tenant = current_tenant.get()
+        record.tenant = f"[{tenant}] " if tenant else ''
+        return True
+
+
+def load_tenants(tenants_file: str) -> List[dict]:
+    """读取并验证租户配置文件，返回启用的租户"""
+    path = Path(tenants_file)
+    if not path.exists():
+        raise ValueError(f"租户配置文件不存在: {tenants_file}")
+    with open(path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+
+    shared_paths = [key for key in STATE_PATH_KEYS if os.getenv(key)]
+    tenants = []
+    seen_ids, seen_tokens = set(), set()
+    for tenant in data.get('tenants', []):
+        tenant_id = tenant.get('id')
+        if not tenant_id or not TENANT_ID_PATTERN.match(str(tenant_id)):
+            raise ValueError(f"租户ID无效（只能包含字母、数字、- 和 _）: {tenant_id!r}")
+        if tenant_id in seen_ids:
+            raise ValueError(f"租户ID重复: {tenant_id}")
+        seen_ids.add(tenant_id)
+        if not tenant.get('enabled', True):
+            continue
+
+        env = {key: str(value) for key, value in (tenant.get('env') or {}).items()}
+        token = tenant.get('bot_token') or env.get('BOT_TOKEN')
+        if not token:
+            raise ValueError(f"租户 {tenant_id} 没有设置 bot_token")
+        if token in seen_tokens:
+            raise ValueError(f"租户 {tenant_id} 的 bot_token 与其他租户重复（同一个机器人不能同时长轮询）")
+        seen_tokens.add(token)
+
+        conflicts = [key for key in shared_paths if key not in env]
+        if conflicts:
+            raise ValueError(
+                f"进程环境中设置了 {', '.join(conflicts)}，所有租户会共用同一个状态文件；"
+                f"请在租户 {tenant_id} 的 env 中单独设置，或改用默认路径（STATE_DIR/<租户ID>/）"
+            )
+
+        max_downloads = int(tenant.get('max_concurrent_downloads', 0))
+        if max_downloads < 0:
+            raise ValueError(f"租户 {tenant_id} 的 max_concurrent_downloads 不能为负数")
+        tenants.append({
+            'id': tenant_id,
+            'bot_token': token,
+            'channels_config_file': tenant.get('channels_config_file'),
+            'max_concurrent_downloads': max_downloads,
+            'env': env,
+        })
+
+    if not tenants:
+        raise ValueError(f"租户配置文件中没有启用的租户: {tenants_file}")
+    return tenants
+
+
+def tenant_env(tenant: dict) -> Dict[str, str]:
+    """租户的配置覆盖（状态目录和下载目录默认按租户ID分开）"""
+    env = {
+        'BOT_TOKEN': tenant['bot_token'],
+        'STATE_DIR': str(Path(os.getenv('STATE_DIR', './data')) / tenant['id']),
+        'DOWNLOAD_PATH': str(Path(os.getenv('DOWNLOAD_PATH', './downloads')) / tenant['id']),
+    }
+    if tenant['channels_config_file']:
+        env['MULTI_CHANNEL_ENABLED'] = 'true'
+        env['CHANNELS_CONFIG_FILE'] = tenant['channels_config_file']
+    env.update(tenant['env'])
+    return env
+
+
+class TenantQuota:
+    """租户的并发下载配额（在共享的公平调度之前占用，0为不限制）"""
+
+    def __init__(self, max_downloads: int = 0):
+        self.max_downloads = max_downloads
+        self._semaphore = asyncio.Semaphore(max_downloads) if max_downloads else None
+        self.stats = {'waited': 0, 'total_wait': 0.0}
+
+    @asynccontextmanager
+    async def download_slot(self):
+        if self._semaphore is None:
+            yield
+            return
+        if self._semaphore.locked():
+            started = time.monotonic()
+            await self._semaphore.acquire()
+            self.stats['waited'] += 1
+            self.stats['total_wait'] += time.monotonic() - started
+        else:
+            await self._semaphore.acquire()
+        try:
+            yield
+        finally:
+            self._semaphore.release()
+
+    def format_status(self) -> str:
+        """格式化配额状态（用于 /status）"""
+        if self._semaphore is None:
+            return "不限制"
+        in_use = self.max_downloads - self._semaphore._value
+        return f"下载 {in_use}/{self.max_downloads}, 因配额等待 {self.stats['waited']} 次 (共 {self.stats['total_wait']:.1f}s)"
+
+
+class SharedResources:
+    """租户共享的资源（按第一个租户的配置创建，通常在 config.env 中统一设置）"""
+
+    def __init__(self, config: Config, proxy_url: Optional[str] = None):
+        self.config = config
+        # 长轮询连接每个租户独立，其余连接池共享
+        self.http_requests = build_traffic_requests(
+            {traffic_class: settings for traffic_class, settings in config.http_pools.items() if traffic_class != TRAFFIC_POLL},
+            proxy_url, config.upload_sendfile_enabled
+        )
+        download_slots = config.http_pools[TRAFFIC_DOWNLOAD]['size']
+        self.work_lanes = WorkLanes(config, download_slots)
+        self.fair_scheduler = FairScheduler(download_slots * 2)
+        # 映射并发上限对所有租户的映射合计生效，取第一个租户 channels.json 的 global_settings
+        self.fair_scheduler.update_limits(config.global_channel_settings)
+        self.staging_budget = StagingBudget(config.memory_staging_budget) if config.memory_staging_enabled else None
+        self.image_processor = ImageProcessor(config)  # 只提供进程池，各租户的图片优化设置不变
+        self.metrics_server = None
+
+    async def start(self, metrics_renderers: List[Callable[[], str]]):
+        for request in self.http_requests.values():
+            await request.initialize()
+        if self.config.metrics_port:
+            self.metrics_server = MetricsServer(self.config.metrics_host, self.config.metrics_port, metrics_renderers)
+            await self.metrics_server.start()
+
+    async def stop(self):
+        if self.metrics_server:
+            await self.metrics_server.stop()
+        for request in self.http_requests.values():
+            await request.shutdown()
+        self.image_processor.shutdown()
@@ -0,0 +1,156 @@
+"""
+时间窗口模块 - 预先计算允许时间段的开启/关闭时刻，并把时间段外的消息保存到持久化延迟队列
+窗口开启后按配置的速率平滑释放积压消息，避免一次性触发洪水限制
+"""
+
+import json
+import logging
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from telegram import Update
+
+logger = logging.getLogger(__name__)
+
+
+class TimeWindow:
+    """每日时间窗口（支持跨日），缓存时区对象和下一次开启/关闭时刻"""
+
+    def __init__(self, start_time: str, end_time: str, timezone: str):
+        import pytz
+
+        self.tz = pytz.timezone(timezone)
+        self.start = datetime.strptime(start_time, '%H:%M').time()
+        self.end = datetime.strptime(end_time, '%H:%M').time()
+        self._open = False
+        self._valid_from = 0.0
+        self._valid_until = 0.0  # 当前状态保持到此时间戳（即下一次开启/关闭时刻）
+
+    def _localize(self, day, moment) -> float:
+        return self.tz.localize(datetime.combine(day, moment)).timestamp()
+
+    def _refresh(self, now: float):
+        """计算当前所在状态和下一次状态切换时刻（结束时间按分钟包含，与 HH:MM 比较保持一致）"""
+        self._valid_from = now
+        today = datetime.fromtimestamp(now, self.tz).date()
+        for offset in (-1, 0, 1):
+            day = today + timedelta(days=offset)
+            opens = self._localize(day, self.start)
+            close_day = day if self.start <= self.end else day + timedelta(days=1)
+            closes = self._localize(close_day, self.end) + 60
+            if opens <= now < closes:
+                self._open, self._valid_until = True, closes
+                return
+
+        for offset in (0, 1, 2):
+            opens = self._localize(today + timedelta(days=offset), self.start)
+            if opens > now:
+                self._open, self._valid_until = False, opens
+                return
+
+    def is_open(self, now: Optional[float] = None) -> bool:
+        now = time.time() if now is None else now
+        if not self._valid_from <= now < self._valid_until:
+            self._refresh(now)
+        return self._open
+
+    def seconds_until_change(self, now: Optional[float] = None) -> float:
+        """距离下一次开启/关闭的秒数"""
+        now = time.time() if now is None else now
+        self.is_open(now)
+        return max(0.0, self._valid_until - now)
+
+    def format_next_change(self) -> str:
+        """格式化下一次状态切换（用于状态显示）"""
+        is_open = self.is_open()
+        moment = datetime.fromtimestamp(self._valid_until, self.tz).strftime('%m-%d %H:%M')
+        return f"{'关闭' if is_open else '开启'}于 {moment}"
+
+
+class DeferredQueue:
+    """时间段外消息的持久化延迟队列（SQLite），按到达顺序释放，媒体组整体作为一条帖子
+    
+    关闭排空时也用同样的结构保存未完成的消息（检查点），重启后按顺序恢复。
+    """
+
+    def __init__(self, db_path: str):
+        Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS deferred (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                mapping_id TEXT NOT NULL,
+                source TEXT NOT NULL,
+                media_group_id TEXT,
+                update_json TEXT NOT NULL,
+                arrived REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS deferred_group ON deferred (mapping_id, source, media_group_id);
+        """)
+        self._conn.commit()
+
+        # 每个映射的待释放数量（内存缓存，避免每条实时消息都查询数据库）
+        self._pending: Dict[str, int] = {}
+        for mapping_id, count in self._conn.execute("SELECT mapping_id, COUNT(*) FROM deferred GROUP BY mapping_id"):
+            self._pending[mapping_id] = count
+
+        self.stats = {'deferred': 0, 'released': 0, 'dropped': 0}
+
+    def push(self, mapping_id: str, source: str, update: Update):
+        message = update.effective_message
+        self.push_data(mapping_id, source, update.to_dict(), message.media_group_id if message else None)
+
+    def push_data(self, mapping_id: str, source: str, update_data: dict, media_group_id: Optional[str] = None):
+        """保存 Update JSON（不需要 Update 对象，例如由媒体组记录重建的消息）"""
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO deferred (mapping_id, source, media_group_id, update_json, arrived) VALUES (?, ?, ?, ?, ?)",
+                (mapping_id, source, media_group_id, json.dumps(update_data, ensure_ascii=False), time.time())
+            )
+            self._conn.commit()
+        self._pending[mapping_id] = self._pending.get(mapping_id, 0) + 1
+        self.stats['deferred'] += 1
+
+    def pending_count(self, mapping_id: Optional[str] = None) -> int:
+        if mapping_id is None:
+            return sum(self._pending.values())
+        return self._pending.get(mapping_id, 0)
+
+    def peek_post(self) -> Tuple[Optional[str], List[Tuple[int, dict]]]:
+        """取出最早的一条帖子（不删除）：返回 (映射ID, [(行ID, Update JSON), ...])，媒体组返回全部成员"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT id, mapping_id, source, media_group_id, update_json FROM deferred ORDER BY id LIMIT 1"
+            ).fetchone()
+            if row is None:
+                return None, []
+            row_id, mapping_id, source, media_group_id, update_json = row
+            if not media_group_id:
+                return mapping_id, [(row_id, json.loads(update_json))]
+
+            rows = self._conn.execute(
+                "SELECT id, update_json FROM deferred WHERE mapping_id = ? AND source = ? AND media_group_id = ? ORDER BY id",
+                (mapping_id, source, media_group_id)
+            ).fetchall()
+        return mapping_id, [(row_id, json.loads(update_json)) for row_id, update_json in rows]
+
+    def remove(self, mapping_id: str, row_ids: List[int], released: bool = True):
+        with self._lock:
+            self._conn.executemany("DELETE FROM deferred WHERE id = ?", [(row_id,) for row_id in row_ids])
+            self._conn.commit()
+        remaining = self._pending.get(mapping_id, 0) - len(row_ids)
+        if remaining > 0:
+            self._pending[mapping_id] = remaining
+        else:
+            self._pending.pop(mapping_id, None)
+        self.stats['released' if released else 'dropped'] += len(row_ids)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,276 @@
+"""
+传输进度模块 - 按字节记录每个下载/上传的进度、瞬时速度、平均速度和预计剩余时间
+网络层（http_pools 的分块读写）把传输的字节数记到当前任务正在进行的传输上；媒体组按下载总量汇总进度
+/transfers 命令查看，METRICS_PORT 开启时以 Prometheus 文本格式导出
+"""
+
+import itertools
+import logging
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+DIRECTION_DOWNLOAD = 'download'
+DIRECTION_UPLOAD = 'upload'
+
+RATE_WINDOW = 5.0      # 秒 - 瞬时速度的统计窗口
+SAMPLE_INTERVAL = 0.5  # 秒 - 进度采样间隔
+
+_current_transfer: ContextVar[Optional['Transfer']] = ContextVar('current_transfer', default=None)
+_current_album: ContextVar[Optional['AlbumProgress']] = ContextVar('current_album', default=None)
+
+
+class RequestPhase:
+    """一次上传请求的阶段：开始读取响应时请求体已经全部发出，服务器可能已经处理（超时后重发会重复发布）"""
+
+    __slots__ = ('body_sent',)
+
+    def __init__(self):
+        self.body_sent = False
+
+
+current_request_phase: ContextVar[Optional[RequestPhase]] = ContextVar('current_request_phase', default=None)
+
+
+def mark_body_sent():
+    """网络层调用：当前任务的请求体已写完，开始等待响应"""
+    phase = current_request_phase.get()
+    if phase is not None:
+        phase.body_sent = True
+
+
+def record_bytes(nbytes: int):
+    """网络层调用：把字节数记到当前任务正在进行的传输上（没有登记的请求忽略）"""
+    transfer = _current_transfer.get()
+    if transfer is not None:
+        transfer.add(nbytes)
+
+
+class _Progress:
+    """字节进度（速度、预计剩余时间）"""
+
+    __slots__ = ('total', 'transferred', 'started', 'last_progress', '_samples')
+
+    def __init__(self, total: int):
+        self.total = total
+        self.transferred = 0
+        self.started = time.monotonic()
+        self.last_progress = self.started
+        self._samples = deque([(self.started, 0)])
+
+    def add(self, nbytes: int):
+        now = time.monotonic()
+        self.transferred += nbytes
+        self.last_progress = now
+        if now - self._samples[-1][0] >= SAMPLE_INTERVAL:
+            self._samples.append((now, self.transferred))
+            while len(self._samples) > 2 and now - self._samples[1][0] > RATE_WINDOW:
+                self._samples.popleft()
+
+    @property
+    def average_rate(self) -> float:
+        elapsed = time.monotonic() - self.started
+        return self.transferred / elapsed if elapsed > 0 else 0.0
+
+    @property
+    def current_rate(self) -> float:
+        """最近几秒的速度（停滞时逐渐降为0）"""
+        now = time.monotonic()
+        since, transferred = self._samples[0]
+        if now - since <= 0:
+            return 0.0
+        return (self.transferred - transferred) / (now - since)
+
+    @property
+    def idle(self) -> float:
+        """距离上次有数据传输的秒数"""
+        return time.monotonic() - self.last_progress
+
+    @property
+    def eta(self) -> Optional[float]:
+        rate = self.current_rate or self.average_rate
+        if not self.total or not rate:
+            return None
+        return max(0.0, self.total - self.transferred) / rate
+
+
+class Transfer(_Progress):
+    """一个文件的下载或上传（媒体组上传为一个传输）"""
+
+    __slots__ = ('transfer_id', 'direction', 'name', 'album')
+
+    def __init__(self, transfer_id: int, direction: str, name: str, total: int, album: Optional['AlbumProgress']):
+        super().__init__(total)
+        self.transfer_id = transfer_id
+        self.direction = direction
+        self.name = name
+        self.album = album
+
+    def add(self, nbytes: int):
+        super().add(nbytes)
+        if self.album is not None and self.direction == DIRECTION_DOWNLOAD:
+            self.album.add(nbytes)
+
+
+class AlbumProgress(_Progress):
+    """媒体组的下载进度（所有文件的总字节数）"""
+
+    __slots__ = ('label',)
+
+    def __init__(self, label: str, total: int):
+        super().__init__(total)
+        self.label = label
+
+
+def _format_size(nbytes: float) -> str:
+    return f"{nbytes / 1024 / 1024:.1f}MB"
+
+
+def _format_eta(eta: Optional[float]) -> str:
+    if eta is None:
+        return "未知"
+    minutes, seconds = divmod(int(eta), 60)
+    return f"{minutes}分{seconds}秒" if minutes else f"{seconds}秒"
+
+
+class TransferProgress:
+    """所有正在进行的传输和累计统计"""
+
+    def __init__(self):
+        self.active: Dict[int, Transfer] = {}
+        self._transfer_ids = itertools.count(1)
+        self.albums: Dict[str, AlbumProgress] = {}
+        self.stats = {
+            direction: {'bytes': 0, 'completed': 0, 'failed': 0}
+            for direction in (DIRECTION_DOWNLOAD, DIRECTION_UPLOAD)
+        }
+
+    @contextmanager
+    def track(self, direction: str, name: str, total: int):
+        """登记当前任务中的一次传输（网络层按 contextvar 把字节记到这里）"""
+        transfer = Transfer(next(self._transfer_ids), direction, name, total, _current_album.get())
+        self.active[transfer.transfer_id] = transfer
+        token = _current_transfer.set(transfer)
+        completed = False
+        try:
+            yield transfer
+            completed = True
+        finally:
+            _current_transfer.reset(token)
+            del self.active[transfer.transfer_id]
+            stats = self.stats[direction]
+            stats['bytes'] += transfer.transferred
+            stats['completed' if completed else 'failed'] += 1
+
+    @contextmanager
+    def album(self, label: str, total: int):
+        """当前任务中的下载计入媒体组进度（同一媒体组的多个任务共用一个进度）"""
+        album = self.albums.get(label)
+        if album is None:
+            album = self.albums[label] = AlbumProgress(label, total)
+        album.total = max(album.total, total)
+        token = _current_album.set(album)
+        try:
+            yield album
+        finally:
+            _current_album.reset(token)
+
+    def finish_album(self, label: str):
+        self.albums.pop(label, None)
+
+    def format_transfers(self, limit: int = 20) -> str:
+        """格式化正在进行的传输（用于 /transfers）"""
+        if not self.active and not self.albums:
+            return "📭 当前没有正在进行的传输"
+        lines = [f"📶 正在进行的传输: {len(self.active)} 个"]
+        transfers: List[Transfer] = sorted(self.active.values(), key=lambda t: t.started)
+        for transfer in transfers[:limit]:
+            icon = "⬇️" if transfer.direction == DIRECTION_DOWNLOAD else "⬆️"
+            percent = min(100.0, transfer.transferred * 100 / transfer.total) if transfer.total else 0.0
+            # 上传的数据全部写出后还要等服务器处理完成
+            remaining = "等待服务器响应" if transfer.total and transfer.transferred >= transfer.total else f"剩余 {_format_eta(transfer.eta)}"
+            line = (
+                f"{icon} {transfer.name}: {_format_size(transfer.transferred)}/{_format_size(transfer.total)} ({percent:.0f}%), "
+                f"当前 {_format_size(transfer.current_rate)}/s, 平均 {_format_size(transfer.average_rate)}/s, {remaining}"
+            )
+            if transfer.idle >= 10:
+                line += f" ⚠️ {transfer.idle:.0f}s 无数据"
+            lines.append(line)
+        if len(transfers) > limit:
+            lines.append(f"... 还有 {len(transfers) - limit} 个")
+        if self.albums:
+            lines.append("\n📦 媒体组下载:")
+            for album in self.albums.values():
+                percent = min(100.0, album.transferred * 100 / album.total) if album.total else 0.0
+                lines.append(
+                    f"• {album.label}: {_format_size(album.transferred)}/{_format_size(album.total)} ({percent:.0f}%), "
+                    f"当前 {_format_size(album.current_rate)}/s, 剩余 {_format_eta(album.eta)}"
+                )
+        return "\n".join(lines)
+
+    def format_status(self) -> str:
+        """格式化累计统计（用于 /status）"""
+        parts = []
+        for direction, label in ((DIRECTION_DOWNLOAD, '下载'), (DIRECTION_UPLOAD, '上传')):
+            stats = self.stats[direction]
+            active = [t for t in self.active.values() if t.direction == direction]
+            rate = sum(t.current_rate for t in active)
+            parts.append(
+                f"{label} 进行中 {len(active)} ({_format_size(rate)}/s), "
+                f"完成 {stats['completed']}, 中止 {stats['failed']}, 共 {_format_size(stats['bytes'])}"
+            )
+        return "; ".join(parts)
+
+    def render_metrics(self) -> str:
+        """Prometheus 文本格式的指标"""
+        return render_transfer_metrics({'': self})
+
+
+def render_transfer_metrics(progresses: Dict[str, TransferProgress]) -> str:
+    """多个进度表的指标（多租户模式下按租户ID加 tenant 标签，每个指标的 HELP/TYPE 只输出一次）
+
+    每个传输的指标带 id 标签：同名的传输（如多个"媒体组(N个文件)"）同时进行时不会输出重复的序列
+    """
+    def escape(value) -> str:
+        return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+    def labels(tenant: str, **values) -> str:
+        pairs = ([f'tenant="{escape(tenant)}"'] if tenant else []) + [f'{key}="{escape(value)}"' for key, value in values.items()]
+        return "{" + ",".join(pairs) + "}"
+
+    lines = [
+        "# HELP telegram_bot_transfer_bytes_total Bytes moved by finished transfers.",
+        "# TYPE telegram_bot_transfer_bytes_total counter",
+    ]
+    for tenant, progress in progresses.items():
+        for direction, stats in progress.stats.items():
+            lines.append(f'telegram_bot_transfer_bytes_total{labels(tenant, direction=direction)} {stats["bytes"]}')
+    lines += [
+        "# HELP telegram_bot_transfers_total Finished transfers by result.",
+        "# TYPE telegram_bot_transfers_total counter",
+    ]
+    for tenant, progress in progresses.items():
+        for direction, stats in progress.stats.items():
+            for result in ('completed', 'failed'):
+                lines.append(f'telegram_bot_transfers_total{labels(tenant, direction=direction, result=result)} {stats[result]}')
+
+    per_transfer = {
+        'transfer_bytes': ('gauge', "Bytes moved so far by an active transfer.", lambda t: t.transferred),
+        'transfer_size_bytes': ('gauge', "Expected size of an active transfer.", lambda t: t.total),
+        'transfer_rate_bytes': ('gauge', "Recent rate of an active transfer (bytes/s).", lambda t: round(t.current_rate)),
+        'transfer_idle_seconds': ('gauge', "Seconds since an active transfer last moved bytes.", lambda t: round(t.idle, 1)),
+        'transfer_eta_seconds': ('gauge', "Estimated seconds left for an active transfer.", lambda t: round(t.eta, 1) if t.eta is not None else 'NaN'),
+    }
+    for metric, (metric_type, help_text, value) in per_transfer.items():
+        lines += [f"# HELP telegram_bot_{metric} {help_text}", f"# TYPE telegram_bot_{metric} {metric_type}"]
+        for tenant, progress in progresses.items():
+            for transfer in progress.active.values():
+                lines.append(
+                    f'telegram_bot_{metric}{labels(tenant, direction=transfer.direction, id=transfer.transfer_id, name=transfer.name)} '
+                    f'{value(transfer)}'
+                )
+    return "\n".join(lines) + "\n"
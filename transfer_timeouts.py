@@ -0,0 +1,122 @@
+"""
+传输超时模块 - 按文件大小和连接池实测吞吐量计算每次上传/下载的截止时间
+停滞（一段时间没有数据传输）或超过截止时间的传输会被中止并很快重试，不再占用槽位等待固定的30分钟超时
+上传（send* 不是幂等的）只在请求体还没发完时重试；请求体已发出后超时，服务器可能已经发布，不再重发
+"""
+
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict, Optional, TypeVar
+
+import httpx
+from telegram.error import TimedOut
+
+from config import Config
+from http_pools import TRAFFIC_UPLOAD, TrafficClassRequest
+from transfer_progress import RequestPhase, current_request_phase
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar('T')
+
+
+class UploadUnconfirmed(TimedOut):
+    """上传请求体已全部发出后超时：服务器可能已经处理，重发可能重复发布"""
+
+
+class TransferTimeouts:
+    """按流量类型（上传/下载连接池）计算传输截止时间，并负责中止后的重试"""
+
+    def __init__(self, config: Config, requests: Optional[Dict[str, TrafficClassRequest]] = None):
+        self.config = config
+        self.requests = requests or {}  # 连接池（提供实测吞吐量），未设置时使用初始速度
+        self.stats = {'stalled': 0, 'deadline': 0, 'retried': 0, 'gave_up': 0, 'unconfirmed': 0}
+
+    def _upper_bound(self, traffic_class: str) -> float:
+        return self.config.upload_read_timeout if traffic_class == TRAFFIC_UPLOAD else self.config.download_timeout
+
+    def measured_rate(self, traffic_class: str) -> Optional[float]:
+        request = self.requests.get(traffic_class)
+        return request.throughput.rate if request else None
+
+    def deadline(self, traffic_class: str, size: int) -> float:
+        """传输截止时间：文件大小 / (实测速度 / 允许的慢速倍数)，有下限，不超过固定超时"""
+        if not self.config.transfer_adaptive_timeouts:
+            return self._upper_bound(traffic_class)
+        rate = self.measured_rate(traffic_class)
+        rate = rate / self.config.transfer_deadline_factor if rate else self.config.transfer_initial_rate
+        return min(self._upper_bound(traffic_class), self.config.transfer_min_timeout + size / rate)
+
+    def request_timeouts(self, traffic_class: str, size: int) -> dict:
+        """传给 Bot API 方法的超时参数（读/写超时是单次socket操作的超时，即停滞时间）"""
+        if not self.config.transfer_adaptive_timeouts:
+            if traffic_class == TRAFFIC_UPLOAD:
+                return {
+                    'read_timeout': self.config.upload_read_timeout,
+                    'write_timeout': self.config.upload_write_timeout,
+                    'connect_timeout': self.config.upload_connect_timeout
+                }
+            return {}
+        stall_timeout = self.config.transfer_stall_timeout
+        if traffic_class == TRAFFIC_UPLOAD:
+            # 上传完成后服务器处理大文件需要时间，读取超时使用截止时间
+            return {
+                'read_timeout': self.deadline(traffic_class, size),
+                'write_timeout': stall_timeout,
+                'connect_timeout': self.config.upload_connect_timeout
+            }
+        return {'read_timeout': stall_timeout, 'connect_timeout': self.config.upload_connect_timeout}
+
+    async def run(self, traffic_class: str, size: int, description: str,
+                  attempt: Callable[[dict], Awaitable[T]]) -> T:
+        """执行传输（attempt 接收超时参数），停滞或超过截止时间时中止并重试"""
+        if not self.config.transfer_adaptive_timeouts:
+            return await attempt(self.request_timeouts(traffic_class, size))
+
+        retries = self.config.transfer_retries
+        for attempt_number in range(retries + 1):
+            deadline = self.deadline(traffic_class, size)
+            phase = RequestPhase()
+            token = current_request_phase.set(phase) if traffic_class == TRAFFIC_UPLOAD else None
+            try:
+                return await asyncio.wait_for(attempt(self.request_timeouts(traffic_class, size)), deadline)
+            except asyncio.TimeoutError:
+                self.stats['deadline'] += 1
+                reason = f"超过截止时间 {deadline:.0f}s"
+                error = TimedOut(f"{description} 超过截止时间 ({deadline:.0f}s)")
+            except TimedOut as e:
+                if isinstance(e.__cause__, httpx.PoolTimeout):
+                    raise  # 连接池排队超时，请求没有发出，由调用方处理
+                self.stats['stalled'] += 1
+                reason = f"{self.config.transfer_stall_timeout:.0f}s 内没有数据传输"
+                error = e
+            finally:
+                if token is not None:
+                    current_request_phase.reset(token)
+
+            if phase.body_sent:
+                # 请求体已经发出，只是等待响应超时：服务器可能已经发布，重发会重复
+                self.stats['unconfirmed'] += 1
+                logger.error(f"❌ {description} 的请求已全部发出，等待响应时中止（{reason}），可能已经发布，不再重发")
+                raise UploadUnconfirmed(f"{description} 已发出但未确认 ({reason})") from error
+
+            if attempt_number >= retries:
+                self.stats['gave_up'] += 1
+                logger.error(f"❌ {description} 传输中止（{reason}），已重试 {retries} 次，放弃")
+                raise error
+            self.stats['retried'] += 1
+            delay = min(2 ** attempt_number, 10)
+            logger.warning(f"⚠️ {description} 传输中止（{reason}），{delay}s 后重试 ({attempt_number + 1}/{retries})")
+            await asyncio.sleep(delay)
+
+    def format_status(self) -> str:
+        """格式化实测速度和中止统计（用于 /status）"""
+        rates = []
+        for traffic_class, request in self.requests.items():
+            if request.throughput.rate:
+                rates.append(f"{traffic_class} {request.throughput.rate / 1024 / 1024:.1f}MB/s")
+        return (
+            f"{', '.join(rates) or '暂无实测速度'}; 停滞中止 {self.stats['stalled']}, "
+            f"超时中止 {self.stats['deadline']}, 重试 {self.stats['retried']}, 放弃 {self.stats['gave_up']}, "
+            f"已发出未确认 {self.stats['unconfirmed']}"
+        )
@@ -0,0 +1,75 @@
+"""
+更新流录制模块 - 把收到的原始 Update JSON 连同到达时间追加写入本地文件
+录制文件可用 benchmarks/run_benchmarks.py 的 replay 场景按 1×/N×/最快速度回放
+"""
+
+import gzip
+import json
+import logging
+import time
+from pathlib import Path
+from typing import Iterator, Tuple
+
+from telegram import Update
+
+logger = logging.getLogger(__name__)
+
+FLUSH_INTERVAL = 1.0  # 秒 - 最多缓冲多久后写盘
+
+
+def _open_recording(path: Path, mode: str):
+    """按扩展名打开录制文件（.gz 使用gzip压缩，追加写入会产生多段gzip，读取时自动拼接）"""
+    if path.suffix == '.gz':
+        return gzip.open(path, mode + 't', encoding='utf-8')
+    return open(path, mode, encoding='utf-8')
+
+
+class UpdateRecorder:
+    """只追加的更新流录制器（每行一条: {"t": 到达时间戳, "u": Update JSON}）"""
+
+    def __init__(self, path: str):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._file = _open_recording(self.path, 'a')
+        self._last_flush = time.monotonic()
+        self.recorded = 0
+        logger.info(f"🎙️ 更新流录制已启用: {self.path}")
+
+    def record(self, update: Update, arrival_time: float = None):
+        """追加一条更新"""
+        if self._file is None:
+            return
+        entry = {'t': round(arrival_time or time.time(), 3), 'u': update.to_dict()}
+        try:
+            self._file.write(json.dumps(entry, ensure_ascii=False, separators=(',', ':')) + '\n')
+            self.recorded += 1
+            now = time.monotonic()
+            if now - self._last_flush >= FLUSH_INTERVAL:
+                self._file.flush()
+                self._last_flush = now
+        except OSError as e:
+            logger.error(f"录制更新失败: {e}")
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+            logger.info(f"🎙️ 更新流录制已关闭，共录制 {self.recorded} 条")
+
+
+def read_recording(path: str) -> Iterator[Tuple[float, dict]]:
+    """读取录制文件，返回 (到达时间戳, Update JSON)；忽略进程中断导致的不完整末行"""
+    with _open_recording(Path(path), 'r') as f:
+        try:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    logger.warning("⚠️ 跳过不完整的录制行")
+                    continue
+                yield entry['t'], entry['u']
+        except EOFError:
+            logger.warning("⚠️ 录制文件末尾不完整（gzip流被截断）")
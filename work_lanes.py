@@ -0,0 +1,158 @@
+"""
+优先级通道模块 - 按预估成本（文件大小、媒体类型）把下载任务分到快速通道和大文件通道
+快速通道优先获得下载槽位，大文件通道最多占用部分槽位，等待过久的大文件任务优先调度，避免饿死
+"""
+
+import asyncio
+import logging
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import List
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+LANE_EXPRESS = 'express'  # 纯文本和小文件
+LANE_BULK = 'bulk'        # 大文件
+
+# 大小未知时可能是大文件的媒体类型
+UNSIZED_BULK_TYPES = {'video', 'document', 'audio', 'animation'}
+
+
+class WorkLanes:
+    """下载槽位的优先级分配器"""
+
+    def __init__(self, config: Config, total_slots: int):
+        self.total_slots = total_slots
+        self.express_max_size = config.lane_express_max_size
+        # 大文件通道最多占用的槽位数，至少给快速通道留一个
+        self.bulk_max_slots = config.lane_bulk_max_slots or max(1, total_slots - 1)
+        self.bulk_max_wait = config.lane_bulk_max_wait
+
+        self._active = {LANE_EXPRESS: 0, LANE_BULK: 0}
+        self._waiters = {LANE_EXPRESS: deque(), LANE_BULK: deque()}  # (入队时间, Future, ticket, 优先)
+
+        # 统计信息
+        self.stats = {
+            lane: {'completed': 0, 'total_wait': 0.0, 'max_wait': 0.0, 'promoted': 0}
+            for lane in (LANE_EXPRESS, LANE_BULK)
+        }
+
+    def classify(self, media_infos: List[dict]) -> str:
+        """根据媒体信息估算成本并选择通道（纯文本/小文件走快速通道）"""
+        total_size = 0
+        for media_info in media_infos:
+            if not media_info['file_size'] and media_info['media_type'] in UNSIZED_BULK_TYPES:
+                return LANE_BULK
+            total_size += media_info['file_size']
+        return LANE_EXPRESS if total_size <= self.express_max_size else LANE_BULK
+
+    def _can_start(self, lane: str) -> bool:
+        if sum(self._active.values()) >= self.total_slots:
+            return False
+        return lane == LANE_EXPRESS or self._active[LANE_BULK] < self.bulk_max_slots
+
+    def _dispatch(self):
+        """有空闲槽位时按优先级唤醒等待者：提升优先级的任务 > 超时的大文件任务 > 快速通道 > 大文件通道"""
+        now = time.monotonic()
+        while True:
+            express, bulk = self._waiters[LANE_EXPRESS], self._waiters[LANE_BULK]
+            bulk_starving = bulk and now - bulk[0][0] >= self.bulk_max_wait
+
+            if express and express[0][3] and self._can_start(LANE_EXPRESS):
+                lane = LANE_EXPRESS
+            elif bulk and bulk[0][3] and self._can_start(LANE_BULK):
+                lane = LANE_BULK
+            elif bulk_starving and self._can_start(LANE_BULK):
+                lane = LANE_BULK
+                self.stats[LANE_BULK]['promoted'] += 1
+            elif express and self._can_start(LANE_EXPRESS):
+                lane = LANE_EXPRESS
+            elif bulk and self._can_start(LANE_BULK):
+                lane = LANE_BULK
+            else:
+                return
+
+            enqueued, future, _, _ = self._waiters[lane].popleft()
+            if future.done():
+                continue
+            self._active[lane] += 1
+            future.set_result(now - enqueued)
+
+    @staticmethod
+    def _insert_priority(waiters: deque, waiter: tuple):
+        """优先的等待者排在队首（在已有的优先等待者之后）"""
+        index = 0
+        while index < len(waiters) and waiters[index][3]:
+            index += 1
+        waiters.insert(index, waiter)
+
+    def _must_wait(self, lane: str, priority: bool) -> bool:
+        if not self._can_start(lane):
+            return True
+        if priority:
+            return any(waiters and waiters[0][3] for waiters in self._waiters.values())
+        return bool(self._waiters[lane]) or (lane == LANE_BULK and bool(self._waiters[LANE_EXPRESS]))
+
+    @asynccontextmanager
+    async def slot(self, lane: str, ticket=None, priority: bool = False):
+        """占用一个下载槽位（ticket 标识所属任务，priority 为 True 时排在队首）"""
+        waited = 0.0
+        if self._must_wait(lane, priority):
+            future = asyncio.get_running_loop().create_future()
+            waiter = (time.monotonic(), future, ticket, priority)
+            if priority:
+                self._insert_priority(self._waiters[lane], waiter)
+            else:
+                self._waiters[lane].append(waiter)
+            self._dispatch()
+            try:
+                waited = await future
+            except asyncio.CancelledError:
+                if future.done() and not future.cancelled():
+                    # 已分配到槽位但被取消，归还槽位
+                    self._active[lane] -= 1
+                    self._dispatch()
+                raise
+        else:
+            self._active[lane] += 1
+
+        stats = self.stats[lane]
+        stats['total_wait'] += waited
+        stats['max_wait'] = max(stats['max_wait'], waited)
+        try:
+            yield
+        finally:
+            self._active[lane] -= 1
+            stats['completed'] += 1
+            self._dispatch()
+
+    def bump(self, ticket) -> int:
+        """提升任务的优先级：它的等待者移到通道队首并先于其他通道调度；返回找到的等待者数量"""
+        found = 0
+        for waiters in self._waiters.values():
+            matched = [waiter for waiter in waiters if waiter[2] is ticket and not waiter[1].done()]
+            for waiter in matched:
+                waiters.remove(waiter)
+                self._insert_priority(waiters, waiter[:3] + (True,))
+            found += len(matched)
+        if found:
+            self._dispatch()
+        return found
+
+    def format_status(self) -> str:
+        """格式化通道状态（用于 /status）"""
+        parts = []
+        for lane, name in ((LANE_EXPRESS, '快速'), (LANE_BULK, '大文件')):
+            stats = self.stats[lane]
+            average_wait = stats['total_wait'] / stats['completed'] if stats['completed'] else 0.0
+            part = (
+                f"{name} {self._active[lane]} 活跃/{len(self._waiters[lane])} 等待 "
+                f"(完成 {stats['completed']}, 平均等待 {average_wait:.1f}s, 最长 {stats['max_wait']:.1f}s"
+            )
+            if lane == LANE_BULK:
+                part += f", 防饿死提升 {stats['promoted']}次"
+            parts.append(part + ")")
+        return "; ".join(parts)